@@ -31,6 +31,7 @@ from nion.swift.model import Cache
 from nion.swift.model import DataItem
 from nion.swift.model import DocumentModel
 from nion.swift.model import HardwareSource
+from nion.swift.model import NDataHandler
 from nion.swift.model import PlugInManager
 from nion.swift.model import Utility
 from nion.ui import Dialog
@@ -175,6 +176,8 @@ class Application:
         cache_filename = "Nion Swift Cache {version}.nscache".format(version=DataItem.DataItem.writer_version)
         library_path = os.path.join(workspace_dir, library_filename)
         cache_path = os.path.join(workspace_dir, cache_filename)
+        index_filename = "Nion Swift Index {version}.nsindex".format(version=DataItem.DataItem.writer_version)
+        index_path = os.path.join(workspace_dir, index_filename)
         if not skip_choose and not os.path.exists(library_path):
             self.choose_library()
             return True
@@ -182,7 +185,7 @@ class Application:
         if os.path.exists(library_path):
             self.migrate_library(workspace_dir, library_path, welcome_message)
         self.workspace_dir = workspace_dir
-        file_persistent_storage_system = DocumentModel.FileStorageSystem([os.path.join(workspace_dir, "Nion Swift Data {version}".format(version=DataItem.DataItem.writer_version))])
+        file_persistent_storage_system = DocumentModel.FileStorageSystem([os.path.join(workspace_dir, "Nion Swift Data {version}".format(version=DataItem.DataItem.writer_version))], index_path)
         create_new_document = not os.path.exists(library_path)
         if create_new_document:
             if welcome_message:
@@ -264,8 +267,17 @@ class Application:
         return True
 
     def continue_start(self, cache_path, create_new_document, file_persistent_storage_system, library_storage, workspace_dir, ignore_older_files, welcome_message=True):
-        storage_cache = Cache.DbStorageCache(cache_path)
+        storage_cache = Cache.LruStorageCache(Cache.DbStorageCache(cache_path))
         DocumentModel.DocumentModel.computation_min_period = 0.1
+        DocumentModel.DocumentModel.computation_max_load = 0.5
+        DocumentModel.DocumentModel.computation_thread_count = min(max((os.cpu_count() or 1) // 2, 1), 8)
+        DocumentModel.DocumentModel.persistent_storage_write_delay = 0.25
+        # windows cannot replace a file while it is mapped; ndata files are replaced when their data is written.
+        NDataHandler.NDataHandler.memory_map_min_size = 64 * 1024 * 1024 if sys.platform != "win32" else None
+        # summed area tables make rectangular pick sums fast, at the cost of two to four times the memory of the data.
+        # allow tables up to 2GB, enough for a 256x256x2048 spectrum image (whose table is about 1.1GB). tables are
+        # never made larger than half of the available physical memory either.
+        DataItem.BufferedDataSource.summed_area_table_max_size = 2 * 1024 * 1024 * 1024
         auto_migrations = list()
         auto_migrations.append(DocumentModel.AutoMigration([os.path.join(workspace_dir, "Nion Swift Data")]))
         auto_migrations.append(DocumentModel.AutoMigration([os.path.join(workspace_dir, "Nion Swift Data 10")]))
@@ -57,6 +57,8 @@ class DisplayItem:
             (property, read-only) status_str
             (method) drag_started(ui, x, y, modifiers), returns mime_data, thumbnail_data
             (event) needs_update_event
+
+        The is_thumbnail_prefetched attribute records whether the cached thumbnail has been read ahead of drawing.
     """
 
     def __init__(self, data_item, ui):
@@ -71,6 +73,7 @@ class DisplayItem:
 
         self.__thumbnail_updated_event_listener = None
         self.__thumbnail_source = None
+        self.is_thumbnail_prefetched = False
 
     def close(self):
         # remove the listener.
@@ -87,6 +90,10 @@ class DisplayItem:
     def data_item(self):
         return self.__data_item
 
+    @property
+    def display(self):
+        return self.__data_item.primary_display_specifier.display
+
     def __create_thumbnail_source(self):
         # grab the display specifier and if there is a display, handle thumbnail updating.
         display_specifier = self.__data_item.primary_display_specifier
@@ -158,6 +165,21 @@ class DisplayItem:
         drawing_context.add(self.__create_thumbnail(rect.inset(6)))
 
 
+def _get_thumbnail_prefetch_display_items(display_items, display_item, count):
+    """Return the display items whose thumbnails to read in one round trip before display_item is drawn.
+
+    These are display_item and the count - 1 items after it which have not been read already. Items are only drawn when
+    visible, so scrolling to items which have not been read reads the next batch.
+    """
+    if display_item.is_thumbnail_prefetched or display_item not in display_items:
+        return list()
+    index = display_items.index(display_item)
+    prefetch_display_items = [d for d in display_items[index:index + count] if not d.is_thumbnail_prefetched]
+    for prefetch_display_item in prefetch_display_items:
+        prefetch_display_item.is_thumbnail_prefetched = True
+    return prefetch_display_items
+
+
 class DataListController:
     """Control a list of display items in a list widget.
 
@@ -177,6 +199,7 @@ class DataListController:
         on_data_item_double_clicked(data_item)
         on_focus_changed(focused)
         on_context_menu_event(display_item, x, y, gx, gy)
+        on_prefetch_thumbnails(display_items)
 
     Display items should respond to these properties and methods and events:
         (method) close()
@@ -185,9 +208,13 @@ class DataListController:
         (property, read-only) format_str
         (property, read-only) status_str
         (method) draw_list_item(drawing_context, draw_rect)
+        (attribute) is_thumbnail_prefetched
         (method) drag_started(ui, x, y, modifiers), returns mime_data, thumbnail_data
     """
 
+    # the number of thumbnails read in one round trip when an item whose thumbnail has not been read is drawn.
+    thumbnail_prefetch_count = 32
+
     def __init__(self, dispatch_task, add_task, clear_task, ui, selection):
         super().__init__()
         self.dispatch_task = dispatch_task
@@ -214,6 +241,7 @@ class DataListController:
                 return self.__data_list_controller.display_items
 
             def paint_item(self, drawing_context, display_item, rect, is_selected):
+                self.__data_list_controller._prefetch_thumbnails(display_item)
                 display_item.draw_list_item(drawing_context, rect)
 
             def on_context_menu_event(self, index, x, y, gx, gy):
@@ -253,6 +281,7 @@ class DataListController:
         self.on_context_menu_event = None
         self.on_focus_changed = None
         self.on_drag_started = None
+        self.on_prefetch_thumbnails = None
 
         # changed data items keep track of items whose content has changed
         # the content changed messages may come from a thread so have to be
@@ -273,6 +302,7 @@ class DataListController:
         self.on_drag_started = None
         self.on_focus_changed = None
         self.on_delete_data_items = None
+        self.on_prefetch_thumbnails = None
         self.on_key_pressed = None
 
     def __update_display_items(self):
@@ -321,6 +351,14 @@ class DataListController:
             if self.on_drag_started:
                 self.on_drag_started(mime_data, thumbnail_data)
 
+    # this message comes from the canvas item before it draws a visible item
+    def _prefetch_thumbnails(self, display_item):
+        display_items = self.display_items
+        if callable(self.on_prefetch_thumbnails) and display_items is not None:
+            prefetch_display_items = _get_thumbnail_prefetch_display_items(display_items, display_item, self.thumbnail_prefetch_count)
+            if prefetch_display_items:
+                self.on_prefetch_thumbnails(prefetch_display_items)
+
     def __display_item_needs_update(self):
         with self.__changed_display_items_mutex:
             self.__changed_display_items = True
@@ -363,6 +401,7 @@ class DataGridController:
         on_focus_changed(focused)
         on_context_menu_event(display_item, x, y, gx, gy)
         on_drag_started(mime_data, thumbnail_data)
+        on_prefetch_thumbnails(display_items)
 
     Display items should respond to these properties and methods and events:
         (method) close()
@@ -372,9 +411,13 @@ class DataGridController:
         (property, read-only) format_str
         (property, read-only) status_str
         (method) draw_grid_item(drawing_context, draw_rect)
+        (attribute) is_thumbnail_prefetched
         (method) drag_started(ui, x, y, modifiers), returns mime_data, thumbnail_data
     """
 
+    # the number of thumbnails read in one round trip when an item whose thumbnail has not been read is drawn.
+    thumbnail_prefetch_count = 64
+
     def __init__(self, dispatch_task, add_task, clear_task, ui, selection, direction=GridCanvasItem.Direction.Row, wrap=True):
         super(DataGridController, self).__init__()
         self.dispatch_task = dispatch_task
@@ -389,6 +432,7 @@ class DataGridController:
         self.on_context_menu_event = None
         self.on_focus_changed = None
         self.on_drag_started = None
+        self.on_prefetch_thumbnails = None
 
         self.__display_items = list()
         self.__display_item_needs_update_listeners = list()
@@ -406,6 +450,7 @@ class DataGridController:
                 return self.__data_grid_controller.display_items
 
             def paint_item(self, drawing_context, display_item, rect, is_selected):
+                self.__data_grid_controller._prefetch_thumbnails(display_item)
                 display_item.draw_grid_item(drawing_context, rect)
 
             def on_context_menu_event(self, index, x, y, gx, gy):
@@ -479,6 +524,7 @@ class DataGridController:
         self.on_drag_started = None
         self.on_focus_changed = None
         self.on_delete_data_items = None
+        self.on_prefetch_thumbnails = None
         self.on_key_pressed = None
         self.on_data_item_double_clicked= None
         self.__closed = True
@@ -534,6 +580,14 @@ class DataGridController:
             if self.on_drag_started:
                 self.on_drag_started(mime_data, thumbnail_data)
 
+    # this message comes from the canvas item before it draws a visible item
+    def _prefetch_thumbnails(self, display_item):
+        display_items = self.display_items
+        if callable(self.on_prefetch_thumbnails) and display_items is not None:
+            prefetch_display_items = _get_thumbnail_prefetch_display_items(display_items, display_item, self.thumbnail_prefetch_count)
+            if prefetch_display_items:
+                self.on_prefetch_thumbnails(prefetch_display_items)
+
     def __display_item_needs_update(self):
         with self.__changed_display_items_mutex:
             self.__changed_display_items = True
@@ -1145,6 +1199,11 @@ class DataPanel(Panel.Panel):
             menu.popup(gx, gy)
             return True
 
+        def prefetch_thumbnails(display_items):
+            # read the cached thumbnails of the items about to be drawn in a single round trip.
+            displays = [display_item.display for display_item in display_items]
+            Thumbnails.ThumbnailManager().prefetch_thumbnail_data(document_controller.document_model.storage_cache, displays)
+
         selection = self.document_controller.selection
         self.data_list_controller = DataListController(dispatch_task, document_controller.add_task, document_controller.clear_task, ui, selection)
         self.data_list_controller.on_selection_changed = lambda data_items: self.__data_browser_controller.set_data_browser_selection(data_items=data_items)
@@ -1152,6 +1211,7 @@ class DataPanel(Panel.Panel):
         self.data_list_controller.on_data_item_double_clicked = document_controller.data_item_double_clicked
         self.data_list_controller.on_focus_changed = lambda focused: setattr(self.__data_browser_controller, "focused", focused)
         self.data_list_controller.on_delete_data_items = document_controller.delete_data_items
+        self.data_list_controller.on_prefetch_thumbnails = prefetch_thumbnails
 
         self.data_grid_controller = DataGridController(dispatch_task, document_controller.add_task, document_controller.clear_task, ui, selection)
         self.data_grid_controller.on_selection_changed = lambda data_items: self.__data_browser_controller.set_data_browser_selection(data_items=data_items)
@@ -1159,6 +1219,7 @@ class DataPanel(Panel.Panel):
         self.data_grid_controller.on_data_item_double_clicked = document_controller.data_item_double_clicked
         self.data_grid_controller.on_focus_changed = lambda focused: setattr(self.__data_browser_controller, "focused", focused)
         self.data_grid_controller.on_delete_data_items = document_controller.delete_data_items
+        self.data_grid_controller.on_prefetch_thumbnails = prefetch_thumbnails
 
         data_list_widget = DataListWidget(ui, self.data_list_controller)
         data_grid_widget = DataGridWidget(ui, self.data_grid_controller)
@@ -1183,7 +1244,9 @@ class DataPanel(Panel.Panel):
 
         self.__display_items = list()
 
-        for index, data_item in enumerate(self.__binding.data_items):
+        data_items = self.__binding.data_items
+
+        for index, data_item in enumerate(data_items):
             data_item_inserted(data_item, index)
 
         list_icon_button = CanvasItem.BitmapButtonCanvasItem(ui.load_rgba_data_from_file(Decorators.relative_file(__file__, "resources/list_icon_20.png")))
@@ -41,6 +41,7 @@ import datetime
 import gettext
 import pickle
 import threading
+import time
 import typing
 import uuid as uuid_module
 import weakref
@@ -52,17 +53,21 @@ import numpy
 from nion.data import Calibration as CalibrationModule
 from nion.data import DataAndMetadata
 from nion.data import Image
+from nion.data import xdata_1_0
 from nion.swift import Application as ApplicationModule
 from nion.swift import DisplayPanel as DisplayPanelModule
 from nion.swift import Panel as PanelModule
 from nion.swift import Workspace
 from nion.swift.model import DataItem as DataItemModule
 from nion.swift.model import DocumentModel as DocumentModelModule
+from nion.swift.model import FourierTransform
 from nion.swift.model import Graphics
 from nion.swift.model import HardwareSource as HardwareSourceModule
 from nion.swift.model import ImportExportManager
+from nion.swift.model import LineProfile
 from nion.swift.model import Metadata
 from nion.swift.model import PlugInManager
+from nion.swift.model import RegionSum
 from nion.swift.model import Utility
 from nion.ui import CanvasItem as CanvasItemModule
 from nion.ui import Declarative
@@ -707,12 +712,13 @@ class Graphic(metaclass=SharedInstance):
     def mask_xdata_with_shape(self, shape: DataAndMetadata.ShapeType) -> DataAndMetadata.DataAndMetadata:
         """Return the mask created by this graphic as extended data.
 
+        The mask data may be the graphic's cached mask and is read only; copy it to modify it.
+
         .. versionadded:: 1.0
 
         Scriptable: Yes
         """
-        mask = self._graphic.get_mask(shape)
-        return DataAndMetadata.DataAndMetadata.from_data(mask)
+        return DataAndMetadata.DataAndMetadata.from_data(self._graphic.get_mask(shape))
 
     # position, start, end, vector, center, size, bounds, angle
 
@@ -1531,6 +1537,67 @@ class RecordTask:
         self.__hardware_source.abort_recording()
 
 
+class SequenceRecordTask:
+    """Record a sequence of frames from each data channel, writing each frame to storage as it arrives.
+
+    The frames of each data channel are written to a large format data item, so only the current frame is held in
+    memory however long the sequence is. The frames are acquired continuously, as for viewing, since recording acquires
+    a single frame.
+
+    Not yet part of the released API.
+    """
+
+    def __init__(self, hardware_source: HardwareSourceModule.HardwareSource, data_items: typing.Sequence["DataItem"], frame_count: int, frame_parameters: dict, channels_enabled: typing.List[bool]):
+        self.__hardware_source = hardware_source
+        self.__was_playing = self.__hardware_source.is_playing
+        if frame_parameters:
+            self.__hardware_source.set_current_frame_parameters(self.__hardware_source.get_frame_parameters_from_dict(frame_parameters))
+        if channels_enabled is not None:
+            for channel_index, channel_enabled in enumerate(channels_enabled):
+                self.__hardware_source.set_channel_enabled(channel_index, channel_enabled)
+        self.__sequence_recorders = list()
+        for data_channel, data_item in zip(self.__hardware_source.data_channels, data_items):
+            if data_item:
+                sequence_recorder = HardwareSourceModule.SequenceRecorder(data_channel, data_item._data_item, frame_count)
+                sequence_recorder.start()
+                self.__sequence_recorders.append(sequence_recorder)
+        if not self.__was_playing:
+            self.__hardware_source.start_playing()
+
+    def close(self) -> None:
+        """Close the task, stopping the recording, and describe the recorded frames in the data items.
+
+        This method must be called from the UI thread when the task is no longer needed.
+        """
+        if not self.__was_playing:
+            self.__hardware_source.stop_playing()
+        for sequence_recorder in self.__sequence_recorders:
+            sequence_recorder.close()
+        self.__sequence_recorders = list()
+
+    @property
+    def is_finished(self) -> bool:
+        """Return whether each data item has all of its frames."""
+        return all(sequence_recorder.finished_event.is_set() for sequence_recorder in self.__sequence_recorders)
+
+    @property
+    def frame_count(self) -> int:
+        """Return the number of frames recorded in every data item."""
+        return min((sequence_recorder.frame_index for sequence_recorder in self.__sequence_recorders), default=0)
+
+    def wait(self, timeout: float=None) -> bool:
+        """Wait until each data item has all of its frames. Return whether they do.
+
+        This method is thread safe. Call close afterwards from the UI thread to finish the data items.
+        """
+        end_time = time.time() + timeout if timeout is not None else None
+        for sequence_recorder in self.__sequence_recorders:
+            remaining_time = max(end_time - time.time(), 0.0) if end_time is not None else None
+            if not sequence_recorder.finished_event.wait(remaining_time):
+                return False
+        return True
+
+
 class ViewTask:
 
     release = ["close", "grab_earliest", "grab_immediate", "grab_next_to_finish", "grab_next_to_start"]
@@ -1740,6 +1807,22 @@ class HardwareSource(metaclass=SharedInstance):
         """
         return RecordTask(self.__hardware_source, frame_parameters, channels_enabled)
 
+    def create_sequence_record_task(self, data_items: typing.Sequence["DataItem"], frame_count: int, frame_parameters: dict=None, channels_enabled: typing.List[bool]=None) -> SequenceRecordTask:
+        """Create a task recording frame_count frames of each data channel to storage as they arrive.
+
+        :param data_items: The large format data item for each data channel, in the order of the channels. Pass None
+            to skip a channel.
+        :param frame_count: The number of frames to record.
+        :param frame_parameters: The frame parameters for the acquisition. Pass None for defaults.
+        :param channels_enabled: The enabled channels for the acquisition. Pass None for defaults.
+        :return: The :py:class:`SequenceRecordTask` object.
+
+        Callers should call close on the returned task from the UI thread when finished.
+
+        Not yet part of the released API.
+        """
+        return SequenceRecordTask(self.__hardware_source, data_items, frame_count, frame_parameters, channels_enabled)
+
     def create_view_task(self, frame_parameters: dict=None, channels_enabled: typing.List[bool]=None, buffer_size: int=1) -> ViewTask:
         """Create a view task for this hardware source.
 
@@ -1817,6 +1900,24 @@ class HardwareSource(metaclass=SharedInstance):
     def set_property_as_float_point(self, name, value) -> None:
         self.__hardware_source.set_property(name, tuple(Geometry.FloatPoint.make(value)))
 
+    def get_pipeline_statistics(self) -> dict:
+        """Return the acquisition pipeline statistics of each channel.
+
+        Returns a dict mapping channel ids to dicts with "stages" (latency histograms in seconds, by stage) and "counts"
+        (frame counts, including merged and dropped updates).
+
+        Not yet part of the released API.
+        """
+        return self.__hardware_source.get_pipeline_statistics()
+
+    def reset_pipeline_statistics(self) -> None:
+        """Reset the acquisition pipeline statistics of each channel. Not yet part of the released API."""
+        self.__hardware_source.reset_pipeline_statistics()
+
+    def write_pipeline_statistics(self, file_path: str) -> None:
+        """Write the acquisition pipeline statistics of each channel to a JSON file. Not yet part of the released API."""
+        self.__hardware_source.write_pipeline_statistics(file_path)
+
 
 class Instrument(metaclass=SharedInstance):
 
@@ -2042,10 +2143,11 @@ class Library(metaclass=SharedInstance):
         """
         return [DataItem(data_item) for data_item in self._document_model.get_dependent_data_items(data_item._data_item)] if data_item else None
 
-    def create_data_item(self, title: str=None) -> DataItem:
+    def create_data_item(self, title: str=None, large_format: bool=False) -> DataItem:
         """Create an empty data item in the library.
 
         :param title: The title of the data item (optional).
+        :param large_format: Whether to store the data item in large format, which sequence recording requires (optional).
         :return: The new :py:class:`nion.swift.Facade.DataItem` object.
         :rtype: :py:class:`nion.swift.Facade.DataItem`
 
@@ -2053,7 +2155,7 @@ class Library(metaclass=SharedInstance):
 
         Scriptable: Yes
         """
-        data_item = DataItemModule.DataItem()
+        data_item = DataItemModule.DataItem(large_format=large_format)
         data_item.ensure_data_source()
         if title is not None:
             data_item.title = title
@@ -3015,6 +3117,15 @@ class API_1:
     def raise_requirements_exception(self, reason) -> None:
         raise PlugInManager.RequirementsException(reason)
 
+    def line_profiles_xdata(self, data_and_metadata: DataAndMetadata.DataAndMetadata, lines: typing.Sequence[typing.Tuple[NormVectorType, float]]) -> typing.List[DataAndMetadata.DataAndMetadata]:
+        """Return the line profile of 2d data for each vector and integration width in lines.
+
+        The same as calling xd.line_profile for each line, but prepares the data once and sums the profiles together.
+
+        Not yet part of the released API.
+        """
+        return LineProfile.line_profiles(data_and_metadata, lines)
+
 
 def _get_api_with_app(version: str, ui_version: str, app: ApplicationModule.Application) -> API_1:
     actual_version = "1.0.0"
@@ -3146,6 +3257,14 @@ def runOnThread(api):
 # for this to work, Facade must be imported early in the startup process.
 def initialize():
     PlugInManager.register_api_broker_fn(get_api)
+    # computations call the xdata functions of version 1.0 of the data api. dispatch the ones which have faster
+    # equivalents here; the results are the same, so saved expressions stay the same and earlier versions can read them.
+    xdata_1_0.fft = FourierTransform.fft
+    xdata_1_0.ifft = FourierTransform.ifft
+    xdata_1_0.autocorrelate = FourierTransform.autocorrelate
+    xdata_1_0.crosscorrelate = FourierTransform.crosscorrelate
+    xdata_1_0.sum_region = RegionSum.sum_region
+    xdata_1_0.line_profile = LineProfile.line_profile
 
 def start_server():
     api = get_api(version="1", ui_version="1")
@@ -5,6 +5,7 @@
 # standard libraries
 import threading
 import time
+import typing
 
 # third-party libraries
 import numpy
@@ -262,3 +263,13 @@ class ThumbnailManager(metaclass=Utility.Singleton):
         if thumbnail_source:
             return thumbnail_source.thumbnail_data
         return None
+
+    def prefetch_thumbnail_data(self, storage_cache, displays: typing.Sequence[Display]) -> None:
+        """Read the cached thumbnails for displays without a thumbnail source in a single round trip.
+
+        The storage cache keeps the values for the thumbnail sources created later.
+        """
+        with self.__lock:
+            displays = [display for display in displays if display and display not in self.__thumbnail_sources]
+        if displays:
+            storage_cache.get_many([(display, "thumbnail_data") for display in displays])
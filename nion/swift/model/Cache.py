@@ -1,6 +1,8 @@
 # standard libraries
+import collections
 import copy
 import functools
+import io
 import logging
 import os
 import pickle
@@ -8,9 +10,10 @@ import queue
 import sqlite3
 import sys
 import threading
+import time
 
 # third party libraries
-# None
+import numpy
 
 # local libraries
 # None
@@ -39,6 +42,10 @@ class TracingCache:
         logging.debug("# %s", result)
         return result
 
+    def get_many(self, target_key_list, default_value=None):
+        logging.debug("%s.get_many(%s, %s)", id(self), len(target_key_list), default_value)
+        return self.__storage_cache.get_many(target_key_list, default_value)
+
     def remove_cached_value(self, target, key):
         logging.debug("%s.remove_cached_value(%s, %s)", id(self), target, key)
         self.__storage_cache.remove_cached_value(target, key)
@@ -53,8 +60,24 @@ class TracingCache:
         logging.debug("%s.set_cached_value_dirty(%s, %s, %s)", id(self), target, key, dirty)
         self.__storage_cache.set_cached_value_dirty(target, key, dirty)
 
+    def release_cached_values(self, target):
+        logging.debug("%s.release_cached_values(%s)", id(self), id(target))
+        self.__storage_cache.release_cached_values(target)
+
+    def reserve_bytes(self, byte_count):
+        logging.debug("%s.reserve_bytes(%s)", id(self), byte_count)
+        self.__storage_cache.reserve_bytes(byte_count)
+
 
 class SuspendableCache:
+    """Delay writes to another storage cache while suspended.
+
+    Values written while suspended are held in memory until spill_cache is called, or until they exceed max_bytes, in
+    which case they are written early. The bytes held are counted in the budget of the other storage cache using
+    reserve_bytes.
+    """
+
+    max_bytes = 16 * 1024 * 1024
 
     def __init__(self, storage_cache):
         self.__storage_cache = storage_cache
@@ -63,6 +86,7 @@ class SuspendableCache:
         self.__cache_dirty = dict()
         self.__cache_mutex = threading.RLock()
         self.__cache_delayed = False
+        self.__byte_count = 0
 
     # the cache system stores values that are expensive to calculate for quick retrieval.
     # an item can be marked dirty in the cache so that callers can determine whether that
@@ -71,6 +95,10 @@ class SuspendableCache:
     # cache even when it is marked dirty. this way the cache is used to retrieve the best
     # available data without doing additional calculations.
 
+    @property
+    def byte_count(self):
+        return self.__byte_count
+
     def suspend_cache(self):
         with self.__cache_mutex:
             self.__cache_delayed = True
@@ -78,13 +106,27 @@ class SuspendableCache:
     # move local cache items into permanent cache when transaction is finished.
     def spill_cache(self):
         with self.__cache_mutex:
-            cache_copy = copy.copy(self.__cache)
-            cache_dirty_copy = copy.copy(self.__cache_dirty)
-            cache_remove_copy = copy.copy(self.__cache_remove)
-            self.__cache.clear()
-            self.__cache_remove.clear()
-            self.__cache_dirty.clear()
             self.__cache_delayed = False
+        self.__spill()
+
+    def __spill(self, target=None):
+        # move the local cache items of target, or of all targets if target is None, into the permanent cache.
+        with self.__cache_mutex:
+            if target is not None:
+                object_id = id(target)
+                cache_copy = {object_id: self.__cache.pop(object_id)} if object_id in self.__cache else dict()
+                cache_dirty_copy = {object_id: self.__cache_dirty.pop(object_id)} if object_id in self.__cache_dirty else dict()
+                cache_remove_copy = {object_id: self.__cache_remove.pop(object_id)} if object_id in self.__cache_remove else dict()
+                byte_count = sum(estimate_cached_value_size(value) for _, object_dict in cache_copy.values() for value in object_dict.values())
+            else:
+                cache_copy = copy.copy(self.__cache)
+                cache_dirty_copy = copy.copy(self.__cache_dirty)
+                cache_remove_copy = copy.copy(self.__cache_remove)
+                self.__cache.clear()
+                self.__cache_remove.clear()
+                self.__cache_dirty.clear()
+                byte_count = self.__byte_count
+            self.__byte_count -= byte_count
         if self.__storage_cache:
             for object_id, (target, object_dict) in iter(cache_copy.items()):
                 _, object_dirty_dict = cache_dirty_copy.get(id(target), (target, dict()))
@@ -94,6 +136,18 @@ class SuspendableCache:
             for object_id, (target, key_list) in iter(cache_remove_copy.items()):
                 for key in key_list:
                     self.__storage_cache.remove_cached_value(target, key)
+            if byte_count:
+                self.__storage_cache.reserve_bytes(-byte_count)
+
+    def release_cached_values(self, target):
+        """Write the values of target held in memory and release them. Called when target closes."""
+        self.__spill(target)
+        if self.__storage_cache:
+            self.__storage_cache.release_cached_values(target)
+
+    def reserve_bytes(self, byte_count):
+        if self.__storage_cache:
+            self.__storage_cache.reserve_bytes(byte_count)
 
     # update the value in the cache. usually updating a value in the cache
     # means it will no longer be dirty.
@@ -107,10 +161,17 @@ class SuspendableCache:
                 _, object_dict = self.__cache.setdefault(id(target), (target, dict()))
                 _, object_list = self.__cache_remove.get(id(target), (target, list()))
                 _, object_dirty_dict = self.__cache_dirty.setdefault(id(target), (target, dict()))
+                byte_count = estimate_cached_value_size(value) - (estimate_cached_value_size(object_dict[key]) if key in object_dict else 0)
                 object_dict[key] = value
                 object_dirty_dict[key] = dirty
                 if key in object_list:
                     object_list.remove(key)
+                self.__byte_count += byte_count
+                is_over_budget = self.__byte_count > self.max_bytes
+            if self.__storage_cache:
+                self.__storage_cache.reserve_bytes(byte_count)
+            if is_over_budget:
+                self.__spill()
 
     # grab the last cached value, if any, from the cache.
     def get_cached_value(self, target, key, default_value=None):
@@ -119,7 +180,7 @@ class SuspendableCache:
             _, object_dict = self.__cache.get(id(target), (target, dict()))
             if key in object_dict:
                 return object_dict.get(key)
-            _, object_list = self.__cache_remove.setdefault(id(target), (target, list()))
+            _, object_list = self.__cache_remove.get(id(target), (target, list()))
             if key in object_list:
                 return None
         # not there, go to cache db
@@ -127,6 +188,26 @@ class SuspendableCache:
             return self.__storage_cache.get_cached_value(target, key, default_value)
         return default_value
 
+    # grab many cached values, going to the cache db once for those not in the temporary cache.
+    def get_many(self, target_key_list, default_value=None):
+        values = [default_value] * len(target_key_list)
+        read_indexes = list()
+        with self.__cache_mutex:
+            for index, (target, key) in enumerate(target_key_list):
+                _, object_dict = self.__cache.get(id(target), (target, dict()))
+                _, object_list = self.__cache_remove.get(id(target), (target, list()))
+                if key in object_dict:
+                    values[index] = object_dict[key]
+                elif key in object_list:
+                    values[index] = None
+                else:
+                    read_indexes.append(index)
+        if self.__storage_cache and read_indexes:
+            read_values = self.__storage_cache.get_many([target_key_list[index] for index in read_indexes], default_value)
+            for index, value in zip(read_indexes, read_values):
+                values[index] = value
+        return values
+
     # removing values from the cache happens immediately under a transaction.
     # this is an area of improvement if it becomes a bottleneck.
     def remove_cached_value(self, target, key):
@@ -135,16 +216,21 @@ class SuspendableCache:
             self.__storage_cache.remove_cached_value(target, key)
         else:
             # if its in the temporary cache, remove it
+            byte_count = 0
             with self.__cache_mutex:
                 _, object_dict = self.__cache.get(id(target), (target, dict()))
                 _, object_list = self.__cache_remove.setdefault(id(target), (target, list()))
                 _, object_dirty_dict = self.__cache_dirty.get(id(target), (target, dict()))
                 if key in object_dict:
+                    byte_count = estimate_cached_value_size(object_dict[key])
+                    self.__byte_count -= byte_count
                     del object_dict[key]
                 if key in object_dirty_dict:
                     del object_dirty_dict[key]
                 if key not in object_list:
                     object_list.append(key)
+            if self.__storage_cache and byte_count:
+                self.__storage_cache.reserve_bytes(-byte_count)
 
     # determines whether the item in the cache is dirty.
     def is_cached_value_dirty(self, target, key):
@@ -174,15 +260,19 @@ class ShadowCache:
     """Shadow another cache, allowing cache usage before the other cache is created.
 
     Set the other cache using set_storage_cache. Anything cached on this object before
-    set_storage_cache is called will be spilled into the other cache."""
+    set_storage_cache is called will be spilled into the other cache. Until then, values are
+    kept up to max_bytes; the least recently written values are dropped beyond that."""
+
+    max_bytes = 16 * 1024 * 1024
 
     def __init__(self):
         self.__storage_cache = None
-        self.__cache = dict()
+        self.__cache = collections.OrderedDict()
         self.__cache_remove = list()
         self.__cache_dirty = dict()
         self.__cache_mutex = threading.RLock()
         self.__cache_delayed = False
+        self.__byte_count = 0
 
     @property
     def storage_cache(self):
@@ -208,6 +298,7 @@ class ShadowCache:
             self.__cache.clear()
             self.__cache_remove = list()
             self.__cache_dirty.clear()
+            self.__byte_count = 0
         if self.storage_cache:
             for key, value in iter(cache_copy.items()):
                 self.storage_cache.set_cached_value(target, key, value, cache_dirty_copy.get(key, False))
@@ -223,10 +314,20 @@ class ShadowCache:
         # otherwise, store it temporarily until transaction is finished
         else:
             with self.__cache_mutex:
+                self.__pop_value(key)
                 self.__cache[key] = value
                 self.__cache_dirty[key] = dirty
+                self.__byte_count += estimate_cached_value_size(value)
                 if key in self.__cache_remove:
                     self.__cache_remove.remove(key)
+                while self.__byte_count > self.max_bytes and self.__cache:
+                    self.__pop_value(next(iter(self.__cache)))
+
+    def __pop_value(self, key):
+        # must be called with the mutex held. dropping the dirty flag too makes the value read as missing and dirty.
+        if key in self.__cache:
+            self.__byte_count -= estimate_cached_value_size(self.__cache.pop(key))
+            self.__cache_dirty.pop(key, None)
 
     # grab the last cached value, if any, from the cache.
     def get_cached_value(self, target, key, default_value=None):
@@ -247,8 +348,7 @@ class ShadowCache:
             self.storage_cache.remove_cached_value(target, key)
         # if its in the temporary cache, remove it
         with self.__cache_mutex:
-            if key in self.__cache:
-                del self.__cache[key]
+            self.__pop_value(key)
             if key in self.__cache_dirty:
                 del self.__cache_dirty[key]
             if key not in self.__cache_remove:
@@ -275,6 +375,20 @@ class ShadowCache:
             with self.__cache_mutex:
                 self.__cache_dirty[key] = dirty
 
+    def release_cached_values(self, target):
+        """Release the values held in memory for target. Called when target closes."""
+        with self.__cache_mutex:
+            self.__cache.clear()
+            self.__cache_remove = list()
+            self.__cache_dirty.clear()
+            self.__byte_count = 0
+        if self.storage_cache:
+            self.storage_cache.release_cached_values(target)
+
+    def reserve_bytes(self, byte_count):
+        if self.storage_cache:
+            self.storage_cache.reserve_bytes(byte_count)
+
 
 def db_make_directory_if_needed(directory_path):
     if os.path.exists(directory_path):
@@ -285,9 +399,24 @@ def db_make_directory_if_needed(directory_path):
 
 
 class DictStorageCache:
-    def __init__(self, cache=None, cache_dirty=None):
+    """Store cached values in memory, up to max_bytes.
+
+    The least recently written values are dropped when the values exceed max_bytes, counting the bytes reserved by
+    caches which hold values for this one.
+    """
+
+    default_max_bytes = 64 * 1024 * 1024
+
+    def __init__(self, cache=None, cache_dirty=None, max_bytes=None):
         self.__cache = copy.deepcopy(cache) if cache else dict()
         self.__cache_dirty = copy.deepcopy(cache_dirty) if cache_dirty else dict()
+        self.max_bytes = max_bytes if max_bytes is not None else self.default_max_bytes
+        self.__byte_counts = collections.OrderedDict()  # (uuid, key) -> byte_count, in the order written
+        for uuid, object_dict in self.__cache.items():
+            for key, value in object_dict.items():
+                self.__byte_counts[(uuid, key)] = estimate_cached_value_size(value)
+        self.byte_count = sum(self.__byte_counts.values())
+        self.reserved_byte_count = 0
 
     def close(self):
         pass
@@ -305,7 +434,7 @@ class DictStorageCache:
         return self.__cache_dirty
 
     def clone(self):
-        return DictStorageCache(cache=self.__cache, cache_dirty=self.__cache_dirty)
+        return DictStorageCache(cache=self.__cache, cache_dirty=self.__cache_dirty, max_bytes=self.max_bytes)
 
     def suspend_cache(self):
         pass
@@ -313,26 +442,50 @@ class DictStorageCache:
     def spill_cache(self):
         pass
 
+    def release_cached_values(self, target):
+        # values are stored here rather than held for another cache, so they are kept after target closes.
+        pass
+
+    def reserve_bytes(self, byte_count):
+        self.reserved_byte_count += byte_count
+        self.__evict()
+
+    def __pop_value(self, uuid, key):
+        self.byte_count -= self.__byte_counts.pop((uuid, key), 0)
+        self.__cache.get(uuid, dict()).pop(key, None)
+
+    def __evict(self):
+        while self.byte_count + self.reserved_byte_count > self.max_bytes and self.__byte_counts:
+            uuid, key = next(iter(self.__byte_counts))
+            self.__pop_value(uuid, key)
+            self.__cache_dirty.get(uuid, dict()).pop(key, None)
+
     def set_cached_value(self, target, key, value, dirty=False):
         cache = self.__cache.setdefault(target.uuid, dict())
         cache_dirty = self.__cache_dirty.setdefault(target.uuid, dict())
+        self.__pop_value(target.uuid, key)
         cache[key] = value
         cache_dirty[key] = dirty
+        byte_count = estimate_cached_value_size(value)
+        self.__byte_counts[(target.uuid, key)] = byte_count
+        self.byte_count += byte_count
+        self.__evict()
 
     def get_cached_value(self, target, key, default_value=None):
-        cache = self.__cache.setdefault(target.uuid, dict())
+        cache = self.__cache.get(target.uuid, dict())
         return cache.get(key, default_value)
 
+    def get_many(self, target_key_list, default_value=None):
+        return [self.get_cached_value(target, key, default_value) for target, key in target_key_list]
+
     def remove_cached_value(self, target, key):
-        cache = self.__cache.setdefault(target.uuid, dict())
-        cache_dirty = self.__cache_dirty.setdefault(target.uuid, dict())
-        if key in cache:
-            del cache[key]
+        cache_dirty = self.__cache_dirty.get(target.uuid, dict())
+        self.__pop_value(target.uuid, key)
         if key in cache_dirty:
             del cache_dirty[key]
 
     def is_cached_value_dirty(self, target, key):
-        cache_dirty = self.__cache_dirty.setdefault(target.uuid, dict())
+        cache_dirty = self.__cache_dirty.get(target.uuid, dict())
         return cache_dirty[key] if key in cache_dirty else True
 
     def set_cached_value_dirty(self, target, key, dirty=True):
@@ -340,10 +493,47 @@ class DictStorageCache:
         cache_dirty[key] = dirty
 
 
+def encode_cached_value(value) -> bytes:
+    """Encode a cached value as bytes.
+
+    Numpy arrays are stored as raw buffers in the npy format (which records the dtype and shape); other values are
+    pickled with the highest protocol.
+    """
+    if isinstance(value, numpy.ndarray) and not value.dtype.hasobject:
+        bytes_io = io.BytesIO()
+        numpy.lib.format.write_array(bytes_io, value, allow_pickle=False)
+        return bytes_io.getvalue()
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def decode_cached_value(value_bytes: bytes):
+    """Decode a cached value encoded with encode_cached_value or pickled by older versions."""
+    if value_bytes[:len(numpy.lib.format.MAGIC_PREFIX)] == numpy.lib.format.MAGIC_PREFIX:
+        return numpy.lib.format.read_array(io.BytesIO(value_bytes), allow_pickle=False)
+    return pickle.loads(value_bytes, encoding='latin1')
+
+
 class DbStorageCache:
+    """Store cached values in a sqlite database.
+
+    All database access happens on a dedicated thread. Writes are recorded in a pending list and written in a single
+    transaction once flush_interval seconds have passed; reads see pending writes without waiting for them.
+
+    Use get_many to read many values in a single round trip. Up to prefetch_max_count of the rows it reads are also
+    kept for subsequent calls to get_cached_value and is_cached_value_dirty until the next call to get_many.
+    """
+
+    flush_interval = 0.5
+
+    prefetch_max_count = 256
+
     def __init__(self, cache_filename):
         self.__queue = queue.Queue()
         self.__queue_lock = threading.RLock()
+        self.__pending_lock = threading.RLock()
+        self.__pending = collections.OrderedDict()  # (uuid_str, key) -> ("set", value, dirty) | ("remove", ) | ("dirty", dirty)
+        self.__prefetched = dict()  # (uuid_str, key) -> (value, dirty)
+        self.__flush_time = None  # only accessed on the db thread
         self.__started_event = threading.Event()
         self.__thread = threading.Thread(target=self.__run, args=[cache_filename])
         self.__thread.daemon = True
@@ -363,13 +553,34 @@ class DbStorageCache:
     def spill_cache(self):
         pass
 
+    def flush(self):
+        """Write pending changes to the database and wait until they are written."""
+        self.__call(self.__flush)
+
+    @property
+    def _prefetched(self):
+        return self.__prefetched
+
+    def release_cached_values(self, target):
+        uuid_str = str(target.uuid)
+        with self.__pending_lock:
+            self.__prefetched = {uuid_key: row for uuid_key, row in self.__prefetched.items() if uuid_key[0] != uuid_str}
+
+    def reserve_bytes(self, byte_count):
+        pass
+
     def __run(self, cache_filename):
         self.conn = sqlite3.connect(cache_filename)
         self.conn.execute("PRAGMA synchronous = OFF")
         self.__create()
         self.__started_event.set()
         while True:
-            action = self.__queue.get()
+            try:
+                timeout = max(self.__flush_time - time.perf_counter(), 0.0) if self.__flush_time is not None else None
+                action = self.__queue.get(timeout=timeout)
+            except queue.Empty:
+                self.__flush()
+                continue
             item, result, event, action_name = action
             # logging.debug("item %s  result %s  event %s  action %s", item, result, event, action_name)
             if item:
@@ -391,6 +602,10 @@ class DbStorageCache:
                     # logging.debug("FINISH")
                     if event:
                         event.set()
+            else:
+                self.__flush()
+            if self.__flush_time is not None and time.perf_counter() >= self.__flush_time:
+                self.__flush()
             self.__queue.task_done()
             if not item:
                 break
@@ -413,79 +628,346 @@ class DbStorageCache:
                 logging.debug("%s", stmt)
             return None
 
-    def __set_cached_value(self, target, key, value, dirty=False):
-        with self.conn:
-            self.execute("INSERT OR REPLACE INTO cache (uuid, key, value, dirty) VALUES (?, ?, ?, ?)",
-                         (str(target.uuid), key, sqlite3.Binary(pickle.dumps(value, 0)), 1 if dirty else 0))
-
-    def __get_cached_value(self, target, key, default_value=None):
-        last_result = self.execute("SELECT value FROM cache WHERE uuid=? AND key=?", (str(target.uuid), key))
+    def __schedule_flush(self):
+        # runs on the db thread. the first pending write starts the flush timer.
+        if self.__flush_time is None:
+            self.__flush_time = time.perf_counter() + self.flush_interval
+
+    def __flush(self):
+        # runs on the db thread. write all pending changes in a single transaction.
+        self.__flush_time = None
+        with self.__pending_lock:
+            pending = self.__pending
+            self.__pending = collections.OrderedDict()
+        if not pending:
+            return
+        set_rows = list()
+        remove_rows = list()
+        dirty_rows = list()
+        for (uuid_str, key), action in pending.items():
+            try:
+                if action[0] == "set":
+                    set_rows.append((uuid_str, key, sqlite3.Binary(encode_cached_value(action[1])), 1 if action[2] else 0))
+                elif action[0] == "remove":
+                    remove_rows.append((uuid_str, key))
+                else:
+                    dirty_rows.append((1 if action[1] else 0, uuid_str, key))
+            except Exception as e:
+                import traceback
+                logging.debug("DB Error: %s", e)
+                traceback.print_exc()
+        try:
+            with self.conn:
+                self.conn.executemany("DELETE FROM cache WHERE uuid=? AND key=?", remove_rows)
+                self.conn.executemany("INSERT OR REPLACE INTO cache (uuid, key, value, dirty) VALUES (?, ?, ?, ?)", set_rows)
+                self.conn.executemany("UPDATE cache SET dirty=? WHERE uuid=? AND key=?", dirty_rows)
+        except Exception as e:
+            import traceback
+            logging.debug("DB Error: %s", e)
+            traceback.print_exc()
+
+    def __read_rows(self, uuid_key_list):
+        # runs on the db thread. return a dict mapping (uuid_str, key) to (value_bytes, dirty).
+        rows = dict()
+        keys_by_uuid = dict()
+        for uuid_str, key in uuid_key_list:
+            keys_by_uuid.setdefault(uuid_str, set()).add(key)
+        uuid_strs = list(keys_by_uuid.keys())
+        batch_size = 500  # stay below the sqlite host parameter limit
+        for i in range(0, len(uuid_strs), batch_size):
+            batch = uuid_strs[i:i + batch_size]
+            stmt = "SELECT uuid, key, value, dirty FROM cache WHERE uuid IN ({})".format(", ".join("?" * len(batch)))
+            for uuid_str, key, value_bytes, dirty in self.conn.execute(stmt, batch):
+                if key in keys_by_uuid[uuid_str]:
+                    rows[(uuid_str, key)] = value_bytes, dirty != 0
+        return rows
+
+    def __get_cached_value(self, uuid_str, key, default_value=None):
+        last_result = self.execute("SELECT value FROM cache WHERE uuid=? AND key=?", (uuid_str, key))
         value_row = last_result.fetchone()
         if value_row is not None:
-            if sys.version < '3':
-                result = pickle.loads(bytes(bytearray(value_row[0])))
-            else:
-                result = pickle.loads(value_row[0], encoding='latin1')
-            return result
+            return decode_cached_value(value_row[0])
         else:
             return default_value
 
-    def __remove_cached_value(self, target, key):
-        with self.conn:
-            self.execute("DELETE FROM cache WHERE uuid=? AND key=?", (str(target.uuid), key))
-
-    def __is_cached_value_dirty(self, target, key):
-        last_result = self.execute("SELECT dirty FROM cache WHERE uuid=? AND key=?", (str(target.uuid), key))
+    def __is_cached_value_dirty(self, uuid_str, key):
+        # return None if there is no value in the database.
+        last_result = self.execute("SELECT dirty FROM cache WHERE uuid=? AND key=?", (uuid_str, key))
         value_row = last_result.fetchone()
         if value_row is not None:
             return value_row[0] != 0
         else:
-            return True
-
-    def __set_cached_value_dirty(self, target, key, dirty=True):
-        with self.conn:
-            self.execute("UPDATE cache SET dirty=? WHERE uuid=? AND key=?", (1 if dirty else 0, str(target.uuid), key))
+            return None
 
-    def set_cached_value(self, target, key, value, dirty=False):
-        event = threading.Event()
+    def __get_many(self, uuid_key_list, default_value):
+        rows = self.__read_rows(uuid_key_list)
+        prefetched = dict()
+        values = list()
+        for uuid_key in uuid_key_list:
+            row = rows.get(uuid_key)
+            if row is not None:
+                value = decode_cached_value(row[0])
+                if len(prefetched) < self.prefetch_max_count:
+                    prefetched[uuid_key] = value, row[1]
+                values.append(value)
+            else:
+                values.append(default_value)
+        with self.__pending_lock:
+            # rows with pending writes are superseded; dropping them here is safe since pending writes are only
+            # removed from the pending list on this thread.
+            self.__prefetched = {uuid_key: row for uuid_key, row in prefetched.items() if uuid_key not in self.__pending}
+        return values
+
+    def __put(self, uuid_key, action):
         with self.__queue_lock:
             _queue = self.__queue
         if _queue:
-            _queue.put((functools.partial(self.__set_cached_value, target, key, value, dirty), None, event, "set_cached_value"))
-        # event.wait()
-
-    def get_cached_value(self, target, key, default_value=None):
+            with self.__pending_lock:
+                self.__prefetched.pop(uuid_key, None)
+                old_action = self.__pending.pop(uuid_key, None)
+                if action[0] == "dirty" and old_action is not None:
+                    if old_action[0] == "set":
+                        action = ("set", old_action[1], action[1])
+                    elif old_action[0] == "remove":
+                        action = old_action
+                self.__pending[uuid_key] = action
+            _queue.put((self.__schedule_flush, None, None, "schedule_flush"))
+
+    def __call(self, fn, *args):
         event = threading.Event()
         result = list()
         with self.__queue_lock:
             _queue = self.__queue
         if _queue:
-            _queue.put((functools.partial(self.__get_cached_value, target, key, default_value), result, event, "get_cached_value"))
+            _queue.put((functools.partial(fn, *args), result, event, fn.__name__))
             event.wait()
         return result[0] if len(result) > 0 else None
 
+    def set_cached_value(self, target, key, value, dirty=False):
+        self.__put((str(target.uuid), key), ("set", value, dirty))
+
+    def get_cached_value(self, target, key, default_value=None):
+        uuid_key = str(target.uuid), key
+        with self.__pending_lock:
+            action = self.__pending.get(uuid_key)
+            if action is not None and action[0] == "set":
+                return action[1]
+            if action is not None and action[0] == "remove":
+                return default_value
+            row = self.__prefetched.pop(uuid_key, None)
+            if row is not None:
+                return row[0]
+        return self.__call(self.__get_cached_value, uuid_key[0], key, default_value)
+
+    def get_many(self, target_key_list, default_value=None):
+        """Return a list of values for the list of (target, key) pairs, reading them in a single round trip."""
+        values = [None] * len(target_key_list)
+        read_indexes = list()
+        read_uuid_keys = list()
+        with self.__pending_lock:
+            for index, (target, key) in enumerate(target_key_list):
+                uuid_key = str(target.uuid), key
+                action = self.__pending.get(uuid_key)
+                if action is not None and action[0] == "set":
+                    values[index] = action[1]
+                elif action is not None and action[0] == "remove":
+                    values[index] = default_value
+                else:
+                    read_indexes.append(index)
+                    read_uuid_keys.append(uuid_key)
+        if read_uuid_keys:
+            read_values = self.__call(self.__get_many, read_uuid_keys, default_value)
+            read_values = read_values if read_values is not None else [default_value] * len(read_indexes)
+            for index, value in zip(read_indexes, read_values):
+                values[index] = value
+        return values
+
     def remove_cached_value(self, target, key):
-        event = threading.Event()
-        with self.__queue_lock:
-            _queue = self.__queue
-        if _queue:
-            _queue.put((functools.partial(self.__remove_cached_value, target, key), None, event, "remove_cached_value"))
-        # event.wait()
+        self.__put((str(target.uuid), key), ("remove", ))
 
     def is_cached_value_dirty(self, target, key):
-        event = threading.Event()
-        result = list()
-        with self.__queue_lock:
-            _queue = self.__queue
-        if _queue:
-            _queue.put((functools.partial(self.__is_cached_value_dirty, target, key), result, event, "is_cached_value_dirty"))
-            event.wait()
-        return result[0]
+        uuid_key = str(target.uuid), key
+        with self.__pending_lock:
+            action = self.__pending.get(uuid_key)
+            if action is not None and action[0] == "set":
+                return action[2]
+            if action is not None and action[0] == "remove":
+                return True
+            row = self.__prefetched.get(uuid_key)
+            if row is not None:
+                return row[1]
+        dirty = self.__call(self.__is_cached_value_dirty, uuid_key[0], key)
+        if dirty is None:
+            return True
+        if action is not None:
+            # a pending dirty flag only applies if the value exists in the database.
+            return action[1]
+        return dirty
 
     def set_cached_value_dirty(self, target, key, dirty=True):
-        event = threading.Event()
-        with self.__queue_lock:
-            _queue = self.__queue
-        if _queue:
-            _queue.put((functools.partial(self.__set_cached_value_dirty, target, key, dirty), None, event, "set_cached_value_dirty"))
-        # event.wait()
+        self.__put((str(target.uuid), key), ("dirty", dirty))
+
+
+def estimate_cached_value_size(value) -> int:
+    """Return an estimate of the number of bytes used by a cached value."""
+    if isinstance(value, numpy.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+class LruStorageCache:
+    """Keep recently used values from another storage cache in memory, up to max_bytes.
+
+    Writes go through to the other storage cache. Reads are served from memory when possible; otherwise they are read
+    from the other storage cache and kept. The least recently used values are evicted when the values in memory, plus
+    the bytes reserved by caches which hold values for this one, exceed max_bytes. The values of a target are released
+    when it closes.
+
+    The hit_count, miss_count, eviction_count, byte_count and reserved_byte_count attributes track usage of the memory
+    tier.
+    """
+
+    default_max_bytes = 64 * 1024 * 1024
+
+    def __init__(self, storage_cache, max_bytes=None):
+        self.__storage_cache = storage_cache
+        self.max_bytes = max_bytes if max_bytes is not None else self.default_max_bytes
+        self.__entries = collections.OrderedDict()  # (uuid, key) -> [value, dirty, byte_count]; dirty is None if unknown
+        self.__target_keys = dict()  # uuid -> set of keys in entries
+        self.__lock = threading.RLock()
+        self.hit_count = 0
+        self.miss_count = 0
+        self.eviction_count = 0
+        self.byte_count = 0
+        self.reserved_byte_count = 0
+
+    def close(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__target_keys.clear()
+            self.byte_count = 0
+        self.__storage_cache.close()
+
+    @property
+    def storage_cache(self):
+        return self.__storage_cache
+
+    @property
+    def statistics(self) -> dict:
+        with self.__lock:
+            return {"hits": self.hit_count, "misses": self.miss_count, "evictions": self.eviction_count,
+                    "bytes": self.byte_count, "reserved_bytes": self.reserved_byte_count, "max_bytes": self.max_bytes,
+                    "count": len(self.__entries)}
+
+    def suspend_cache(self):
+        self.__storage_cache.suspend_cache()
+
+    def spill_cache(self):
+        self.__storage_cache.spill_cache()
+
+    def __put_entry(self, uuid_key, value, dirty):
+        # must be called with lock held.
+        self.__pop_entry(uuid_key)
+        byte_count = estimate_cached_value_size(value)
+        if byte_count <= self.max_bytes:
+            self.__entries[uuid_key] = [value, dirty, byte_count]
+            self.__target_keys.setdefault(uuid_key[0], set()).add(uuid_key[1])
+            self.byte_count += byte_count
+            self.__evict()
+
+    def __evict(self):
+        # must be called with lock held.
+        while self.byte_count + self.reserved_byte_count > self.max_bytes and self.__entries:
+            self.__pop_entry(next(iter(self.__entries)))
+            self.eviction_count += 1
+
+    def __pop_entry(self, uuid_key):
+        # must be called with lock held.
+        entry = self.__entries.pop(uuid_key, None)
+        if entry is not None:
+            self.byte_count -= entry[2]
+            keys = self.__target_keys.get(uuid_key[0])
+            keys.discard(uuid_key[1])
+            if not keys:
+                del self.__target_keys[uuid_key[0]]
+        return entry
+
+    def release_cached_values(self, target):
+        """Release the values of target kept in memory. Called when target closes; stored values are kept."""
+        with self.__lock:
+            for key in list(self.__target_keys.get(target.uuid, set())):
+                self.__pop_entry((target.uuid, key))
+        self.__storage_cache.release_cached_values(target)
+
+    def reserve_bytes(self, byte_count):
+        """Count bytes held by a cache which holds values for this one in the budget, or release them if negative."""
+        with self.__lock:
+            self.reserved_byte_count += byte_count
+            self.__evict()
+
+    def set_cached_value(self, target, key, value, dirty=False):
+        with self.__lock:
+            self.__put_entry((target.uuid, key), value, dirty)
+        self.__storage_cache.set_cached_value(target, key, value, dirty)
+
+    def get_cached_value(self, target, key, default_value=None):
+        uuid_key = target.uuid, key
+        with self.__lock:
+            entry = self.__entries.get(uuid_key)
+            if entry is not None:
+                self.__entries.move_to_end(uuid_key)
+                self.hit_count += 1
+                return entry[0]
+            self.miss_count += 1
+        value = self.__storage_cache.get_cached_value(target, key, None)
+        if value is None:
+            return default_value
+        with self.__lock:
+            if uuid_key not in self.__entries:
+                self.__put_entry(uuid_key, value, None)
+        return value
+
+    def get_many(self, target_key_list, default_value=None):
+        # values read from the storage cache are not kept here; the storage cache keeps them until they are read with
+        # get_cached_value, which keeps them here.
+        values = [default_value] * len(target_key_list)
+        read_indexes = list()
+        with self.__lock:
+            for index, (target, key) in enumerate(target_key_list):
+                entry = self.__entries.get((target.uuid, key))
+                if entry is not None:
+                    values[index] = entry[0]
+                else:
+                    read_indexes.append(index)
+        if read_indexes:
+            read_values = self.__storage_cache.get_many([target_key_list[index] for index in read_indexes], default_value)
+            for index, value in zip(read_indexes, read_values):
+                values[index] = value
+        return values
+
+    def remove_cached_value(self, target, key):
+        with self.__lock:
+            self.__pop_entry((target.uuid, key))
+        self.__storage_cache.remove_cached_value(target, key)
+
+    def is_cached_value_dirty(self, target, key):
+        uuid_key = target.uuid, key
+        with self.__lock:
+            entry = self.__entries.get(uuid_key)
+            if entry is not None and entry[1] is not None:
+                return entry[1]
+        dirty = self.__storage_cache.is_cached_value_dirty(target, key)
+        with self.__lock:
+            entry = self.__entries.get(uuid_key)
+            if entry is not None and entry[1] is None:
+                entry[1] = dirty
+        return dirty
+
+    def set_cached_value_dirty(self, target, key, dirty=True):
+        with self.__lock:
+            entry = self.__entries.get((target.uuid, key))
+            if entry is not None:
+                entry[1] = dirty
+        self.__storage_cache.set_cached_value_dirty(target, key, dirty)
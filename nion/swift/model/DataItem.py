@@ -5,7 +5,6 @@ import datetime
 import gettext
 import os
 import threading
-import time
 import typing
 import uuid
 import warnings
@@ -83,6 +82,25 @@ METADATA = 2
 DISPLAYS = 3
 
 
+_created_lock = threading.Lock()
+_last_created = None
+
+
+def utcnow_unique() -> datetime.datetime:
+    """Return the current utc time, advanced if necessary so that each call returns a distinct time.
+
+    Windows utcnow has a resolution of 1ms; advancing by 1us guarantees unique created times without limiting the
+    rate at which library items can be created.
+    """
+    global _last_created
+    with _created_lock:
+        now = datetime.datetime.utcnow()
+        if _last_created is not None and now <= _last_created:
+            now = _last_created + datetime.timedelta(microseconds=1)
+        _last_created = now
+        return now
+
+
 class DtypeToStringConverter:
     def convert(self, value):
         return str(value) if value is not None else None
@@ -132,8 +150,20 @@ class BufferedDataSource(Observable.Observable, Persistence.PersistentObject):
     left, within increasing y moving downward and increasing x moving right. For 3d data, this means that the first
     coordinate specifies the depth with 0 considered to be the "top". The next two coordinates are y, x with 0, 0 at the
     top left of each layer.
+
+    A summed area table of 3d data can be made to sum rectangular regions of the first two dimensions quickly. The
+    table is made on a thread when first asked for, if it would take no more than summed_area_table_max_size bytes
+    and no more than half of the physical memory available at the time, and is discarded when the data changes. Until
+    it is made, callers use the data directly. The table takes two to four times the memory of the data; tables are
+    not made unless summed_area_table_max_size is set, which it is not by default.
     """
 
+    summed_area_table_max_size = None  # type: typing.Optional[int]
+
+    # the buffered data sources by their data and metadata, so that the summed area table can be found from the data.
+    __data_sources = weakref.WeakKeyDictionary()  # type: typing.MutableMapping[DataAndMetadata.DataAndMetadata, typing.Callable]
+    __data_sources_lock = threading.RLock()
+
     def __init__(self, data=None):
         super().__init__()
         self.define_type("buffered-data-source")
@@ -163,6 +193,9 @@ class BufferedDataSource(Observable.Observable, Persistence.PersistentObject):
         self.__metadata = dict()
         self.__data_ref_count = 0
         self.__data_ref_count_mutex = threading.RLock()
+        self.__summed_area_table = None  # tuple of the data and metadata and its summed area table
+        self.__summed_area_table_thread = None  # tuple of the data and metadata and the thread making its table
+        self.__summed_area_table_lock = threading.RLock()
         self.data_changed_event = Event.Event()
         self.metadata_changed_event = Event.Event()
         if data is not None:
@@ -307,6 +340,12 @@ class BufferedDataSource(Observable.Observable, Persistence.PersistentObject):
 
     def __set_data_metadata_direct(self, data_and_metadata, data_modified=None):
         self.__data_and_metadata = data_and_metadata
+        with self.__summed_area_table_lock:
+            self.__summed_area_table = None
+            self.__summed_area_table_thread = None
+        if data_and_metadata:
+            with BufferedDataSource.__data_sources_lock:
+                BufferedDataSource.__data_sources[data_and_metadata] = weakref.ref(self)
         if self.__data_and_metadata:
             with self.__data_ref_count_mutex:
                 self.__data_and_metadata._add_data_ref_count(self.__data_ref_count)
@@ -321,12 +360,19 @@ class BufferedDataSource(Observable.Observable, Persistence.PersistentObject):
             metadata_copy = copy.deepcopy(self.__data_and_metadata.metadata)
             self.__metadata = metadata_copy
             self._set_persistent_property_value("metadata", metadata_copy)
+            with self.__data_ref_count_mutex:
+                if self.__data_ref_count > 0 and not self.__data_and_metadata.is_data_valid:
+                    # stored data which is in use; load it now that it is described.
+                    self.__data_and_metadata._set_data(self.__load_data())
         self.data_modified = data_modified if data_modified else datetime.datetime.utcnow()
         self.data_changed_event.fire(self)
 
-    def set_data_and_metadata(self, data_and_metadata, data_modified=None):
+    def set_data_and_metadata(self, data_and_metadata, data_modified=None, sub_area=None):
         """Sets the underlying data and data-metadata to the data_and_metadata.
 
+        Pass sub_area ((top, left), (height, width)) if only that area of the data has changed, so that only
+        that area needs to be written.
+
         Note: this does not make a copy of the data.
         """
         self.increment_data_ref_count()
@@ -345,11 +391,122 @@ class BufferedDataSource(Observable.Observable, Persistence.PersistentObject):
             self.__set_data_metadata_direct(new_data_and_metadata, data_modified)
             if self.__data_and_metadata is not None:
                 if self.persistent_object_context:
-                    self.persistent_object_context.rewrite_data_item_data(self, self.__data_and_metadata.data)  # ouch, up reference to data item
+                    self.persistent_object_context.rewrite_data_item_data(self, self.__data_and_metadata.data, sub_area)  # ouch, up reference to data item
                     self.__data_and_metadata.unloadable = True
         finally:
             self.decrement_data_ref_count()
 
+    def reserve_stored_data(self, data_shape, data_dtype) -> None:
+        """Reserve storage for sequence data with the shape and dtype, to be written frame by frame.
+
+        Write each frame with write_stored_data_frame, then describe the stored data with set_stored_data_metadata.
+        Reserving again with a different frame count keeps the frames already written. Thread safe.
+        """
+        if self.persistent_object_context:
+            self.persistent_object_context.reserve_data_item_data(self, data_shape, data_dtype)  # ouch, up reference to data item
+
+    def write_stored_data_frame(self, data, index: int) -> None:
+        """Write data as the frame at index of the reserved storage. Thread safe."""
+        if self.persistent_object_context:
+            self.persistent_object_context.rewrite_data_item_data_frame(self, data, index)  # ouch, up reference to data item
+
+    def set_stored_data_metadata(self, data_metadata: DataAndMetadata.DataMetadata, data_modified=None) -> None:
+        """Sets the data metadata describing data which has been written directly to storage.
+
+        The data is loaded from storage when needed.
+        """
+        data_shape_and_dtype = data_metadata.data_shape_and_dtype
+        intensity_calibration = data_metadata.intensity_calibration
+        dimensional_calibrations = data_metadata.dimensional_calibrations
+        metadata = data_metadata.metadata
+        timestamp = data_metadata.timestamp
+        data_descriptor = data_metadata.data_descriptor
+        new_data_and_metadata = DataAndMetadata.DataAndMetadata(self.__load_data, data_shape_and_dtype, intensity_calibration, dimensional_calibrations, metadata, timestamp, data_descriptor=data_descriptor)
+        new_data_and_metadata.unloadable = self.persistent_object_context is not None
+        self.__set_data_metadata_direct(new_data_and_metadata, data_modified)
+
+    def get_summed_area_table(self, wait: bool=False) -> typing.Optional[numpy.ndarray]:
+        """Return the summed area table over the first two dimensions of 3d data, or None if there is none yet.
+
+        Element [i, j] of the table is the sum of data[:i, :j], so the table is one larger than the data in the first
+        two dimensions. The table is integer for integer data, so sums are exact. Returns None for other data or if the
+        table would be too large. Otherwise the first call starts making the table on a thread and returns None unless
+        wait is True, in which case it returns the table once it is made. Thread safe.
+        """
+        return self.__get_summed_area_table(self.__data_and_metadata, wait)
+
+    @classmethod
+    def get_summed_area_table_of_data(cls, data_and_metadata: DataAndMetadata.DataAndMetadata, wait: bool=False) -> typing.Optional[numpy.ndarray]:
+        """Return the summed area table of data and metadata, as get_summed_area_table does for its data source.
+
+        Returns None if the data and metadata is not the current data of a buffered data source. Thread safe.
+        """
+        with cls.__data_sources_lock:
+            data_source_ref = cls.__data_sources.get(data_and_metadata)
+        data_source = data_source_ref() if data_source_ref else None
+        return data_source.__get_summed_area_table(data_and_metadata, wait) if data_source else None
+
+    def __get_summed_area_table(self, data_and_metadata: DataAndMetadata.DataAndMetadata, wait: bool) -> typing.Optional[numpy.ndarray]:
+        max_size = self.summed_area_table_max_size
+        with self.__summed_area_table_lock:
+            if data_and_metadata is not self.__data_and_metadata:
+                return None
+            summed_area_table = self.__summed_area_table
+            if summed_area_table is not None and summed_area_table[0] is data_and_metadata:
+                return summed_area_table[1]
+            if max_size is None or not data_and_metadata or len(data_and_metadata.data_shape) != 3:
+                return None
+            data_shape = data_and_metadata.data_shape
+            dtype = self.__get_summed_area_table_dtype(data_and_metadata.data_dtype)
+            table_shape = (data_shape[0] + 1, data_shape[1] + 1, data_shape[2])
+            table_size = numpy.prod(table_shape, dtype=numpy.int64) * numpy.dtype(dtype).itemsize
+            if table_size > max_size:
+                return None
+            available_memory = Utility.get_available_memory()
+            if available_memory is not None and table_size > available_memory // 2:
+                return None
+            summed_area_table_thread = self.__summed_area_table_thread
+            if summed_area_table_thread is None or summed_area_table_thread[0] is not data_and_metadata:
+                thread = threading.Thread(target=self.__make_summed_area_table, args=(data_and_metadata, table_shape, dtype), daemon=True)
+                self.__summed_area_table_thread = data_and_metadata, thread
+                thread.start()
+            else:
+                thread = summed_area_table_thread[1]
+        if wait:
+            thread.join()
+            with self.__summed_area_table_lock:
+                summed_area_table = self.__summed_area_table
+                if summed_area_table is not None and summed_area_table[0] is data_and_metadata:
+                    return summed_area_table[1]
+        return None
+
+    @staticmethod
+    def __get_summed_area_table_dtype(data_dtype: numpy.dtype) -> numpy.dtype:
+        data_dtype = numpy.dtype(data_dtype)
+        if numpy.issubdtype(data_dtype, numpy.complexfloating):
+            return numpy.dtype(numpy.complex128)
+        if numpy.issubdtype(data_dtype, numpy.integer) or numpy.issubdtype(data_dtype, numpy.bool_):
+            return numpy.dtype(numpy.uint64) if numpy.issubdtype(data_dtype, numpy.unsignedinteger) else numpy.dtype(numpy.int64)
+        return numpy.dtype(numpy.float64)
+
+    def __make_summed_area_table(self, data_and_metadata: DataAndMetadata.DataAndMetadata, table_shape: typing.Tuple[int, int, int], dtype: numpy.dtype) -> None:
+        try:
+            data = data_and_metadata.data
+            if data is None:
+                return
+            table = numpy.zeros(table_shape, dtype)
+            numpy.cumsum(data, axis=0, dtype=dtype, out=table[1:, 1:])
+            numpy.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+            table.flags.writeable = False
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return
+        # a table made from data which has since changed is not kept.
+        with self.__summed_area_table_lock:
+            if data_and_metadata is self.__data_and_metadata and not self._closed:
+                self.__summed_area_table = data_and_metadata, table
+
     @property
     def dimensional_shape(self):
         return self.__data_and_metadata.dimensional_shape if self.__data_and_metadata else list()
@@ -586,10 +743,7 @@ class LibraryItem(Observable.Observable, Persistence.PersistentObject):
         self.__pending_write = True
         self.__write_delay_modified_count = 0
         self.persistent_object_context = None
-        self.define_property("created", datetime.datetime.utcnow(), converter=DatetimeToStringConverter(), changed=self.__description_property_changed)
-        # windows utcnow has a resolution of 1ms, this sleep can guarantee unique times for all created times during a particular test.
-        # this is not my favorite solution since it limits library item creation to 1000/s but until I find a better solution, this is my compromise.
-        time.sleep(0.001)
+        self.define_property("created", utcnow_unique(), converter=DatetimeToStringConverter(), changed=self.__description_property_changed)
         self.define_property("description", dict(), hidden=True, changed=self.__property_changed)
         self.define_property("source_file_path", validate=self.__validate_source_file_path, changed=self.__property_changed)
         self.define_property("session_id", validate=self.__validate_session_id, changed=self.__session_id_changed)
@@ -1071,10 +1225,19 @@ def computation_factory(lookup_id):
 
 
 class DataItem(LibraryItem):
+    """A data source and its displays.
 
-    def __init__(self, data=None, item_uuid=None, large_format=False):
+    A data item read with defer_displays reads its displays, and their graphics, when they are first used rather than
+    while the library is read. Objects in displays which have not been read are only found by get_graphic_by_uuid on
+    the document if may_contain_object says so.
+    """
+
+    def __init__(self, data=None, item_uuid=None, large_format=False, create_display=True):
         super().__init__(item_uuid)
         self.large_format = large_format
+        self.__deferred_displays_properties = None  # the list of display properties to read on first use
+        self.__deferred_uuids = None  # the uuids of the objects in the deferred displays
+        self.__deferred_displays_lock = threading.RLock()
         self.define_item("data_source", data_source_factory, item_changed=self.__data_source_changed)
         self.define_item("computation", computation_factory)
         self.define_relationship("displays", Display.display_factory, insert=self.__insert_display, remove=self.__remove_display)
@@ -1092,9 +1255,11 @@ class DataItem(LibraryItem):
         self.__change_data_changed = False
         self.__pending_xdata_lock = threading.RLock()
         self.__pending_xdata = None
+        self.__pending_sub_area = None
         if data is not None:
             self.set_data_source(BufferedDataSource(data))
-        self.add_display(Display.Display())  # always have one display, for now
+        if create_display:  # items about to be read get their displays from storage
+            self.add_display(Display.Display())  # always have one display, for now
         self.__update_displays()
 
     def __deepcopy__(self, memo):
@@ -1114,7 +1279,7 @@ class DataItem(LibraryItem):
         return data_item_copy
 
     def close(self):
-        for display in self.displays:
+        for display in self.__loaded_displays:
             display.close()
         data_source = self.data_source
         if data_source:
@@ -1123,11 +1288,18 @@ class DataItem(LibraryItem):
         super().close()
 
     def about_to_be_removed(self):
-        for display in self.displays:
+        # displays which have not been read are not needed any more.
+        with self.__deferred_displays_lock:
+            self.__deferred_displays_properties = None
+            self.__deferred_uuids = None
+        for display in self.__loaded_displays:
             display.about_to_be_removed()
         data_source = self.data_source
         if data_source:
             data_source.about_to_be_removed()
+        computation = self.computation
+        if computation:
+            computation.about_to_be_removed()
         super().about_to_be_removed()
 
     def clone(self) -> "DataItem":
@@ -1159,7 +1331,7 @@ class DataItem(LibraryItem):
 
     def set_storage_cache(self, storage_cache):
         super().set_storage_cache(storage_cache)
-        for display in self.displays:
+        for display in self.__loaded_displays:
             display.set_storage_cache(self._suspendable_storage_cache)
 
     def _enter_transaction_state(self):
@@ -1177,12 +1349,66 @@ class DataItem(LibraryItem):
         if data_source:
             data_source.decrement_data_ref_count()
 
+    def read_from_dict(self, properties, defer_displays: bool=False) -> None:
+        """Read the data item from properties, deferring reading the displays until first use if defer_displays."""
+        if defer_displays and properties.get("displays"):
+            with self.__deferred_displays_lock:
+                self.__deferred_displays_properties = properties["displays"]
+                self.__deferred_uuids = Utility.get_nested_strings(properties["displays"], ("uuid", ))
+            properties = {key: value for key, value in properties.items() if key != "displays"}
+        super().read_from_dict(properties)
+
     def _read_from_dict_inner(self, properties):
-        for display in copy.copy(self.displays):
+        for display in copy.copy(self.__loaded_displays):
             self.remove_display(display)
         super()._read_from_dict_inner(properties)
         self.__update_displays()  # this ensures that the display will validate
 
+    def write_to_dict(self):
+        self.__read_deferred_displays()
+        return super().write_to_dict()
+
+    @property
+    def displays(self) -> typing.List[Display.Display]:
+        self.__read_deferred_displays()
+        return self.__loaded_displays
+
+    @property
+    def __loaded_displays(self) -> typing.List[Display.Display]:
+        return Persistence.PersistentObject.__getattr__(self, "displays")
+
+    # used for testing
+    @property
+    def _are_displays_deferred(self) -> bool:
+        return self.__deferred_displays_properties is not None
+
+    def may_contain_object(self, object_uuid: uuid.UUID) -> bool:
+        """Return whether the object with object_uuid may be in the displays, without reading deferred displays."""
+        deferred_uuids = self.__deferred_uuids
+        return deferred_uuids is None or str(object_uuid) in deferred_uuids
+
+    def __read_deferred_displays(self):
+        if self.__deferred_displays_properties is None:
+            return
+        with self.__deferred_displays_lock:
+            displays_properties = self.__deferred_displays_properties
+            if displays_properties is None:
+                return
+            # read only the displays; the rest of the data item has been read already.
+            Persistence.PersistentObject.read_from_dict(self, {"displays": displays_properties})
+            displays = self.__loaded_displays
+            suspendable_storage_cache = self._suspendable_storage_cache
+            for display in displays:
+                if not self._is_reading:
+                    display.finish_reading()
+                if suspendable_storage_cache:
+                    display.set_storage_cache(suspendable_storage_cache)
+                if self.__display_ref_count > 0:
+                    display.increment_display_ref_count()
+            self.__deferred_displays_properties = None
+            self.__deferred_uuids = None
+        self.__update_displays()
+
     def finish_reading(self):
         super().finish_reading()
 
@@ -1255,23 +1481,42 @@ class DataItem(LibraryItem):
             return max(data_modified_list)
         return super().date_for_sorting
 
-    def update_data_and_metadata(self, data_and_metadata: DataAndMetadata.DataAndMetadata) -> None:
+    def update_data_and_metadata(self, data_and_metadata: DataAndMetadata.DataAndMetadata, sub_area=None) -> None:
         assert threading.current_thread() == threading.main_thread()
         with self.data_item_changes():
-            self.set_xdata(data_and_metadata)
+            with self.data_source_changes():
+                if self.data_source:
+                    self.data_source.set_data_and_metadata(data_and_metadata, sub_area=sub_area)
             self.timezone = Utility.get_local_timezone()
             self.timezone_offset = Utility.TimezoneMinutesToStringConverter().convert(Utility.local_utcoffset_minutes())
 
-    def set_pending_xdata(self, xd: DataAndMetadata.DataAndMetadata) -> None:
+    def set_pending_xdata(self, xd: DataAndMetadata.DataAndMetadata, sub_area=None) -> typing.Optional[DataAndMetadata.DataAndMetadata]:
+        """Set the xdata to be applied by update_to_pending_xdata. Return the pending xdata it replaces, if any."""
         with self.__pending_xdata_lock:
+            replaced_xdata = self.__pending_xdata
+            if self.__pending_xdata is not None:
+                # the pending update replaces an earlier one; the changed area includes both.
+                pending_sub_area = self.__pending_sub_area
+                if pending_sub_area is not None and sub_area is not None:
+                    top = min(pending_sub_area[0][0], sub_area[0][0])
+                    left = min(pending_sub_area[0][1], sub_area[0][1])
+                    bottom = max(pending_sub_area[0][0] + pending_sub_area[1][0], sub_area[0][0] + sub_area[1][0])
+                    right = max(pending_sub_area[0][1] + pending_sub_area[1][1], sub_area[0][1] + sub_area[1][1])
+                    sub_area = (top, left), (bottom - top, right - left)
+                else:
+                    sub_area = None
             self.__pending_xdata = xd
+            self.__pending_sub_area = sub_area
+        return replaced_xdata
 
     def update_to_pending_xdata(self):
         with self.__pending_xdata_lock:
             pending_xdata = self.__pending_xdata
+            pending_sub_area = self.__pending_sub_area
             self.__pending_xdata = None
+            self.__pending_sub_area = None
         if pending_xdata:
-            self.update_data_and_metadata(pending_xdata)
+            self.update_data_and_metadata(pending_xdata, pending_sub_area)
 
     def __handle_data_changed(self, data_source):
         self.__change_changed = True
@@ -1333,6 +1578,7 @@ class DataItem(LibraryItem):
 
     def add_display(self, display):
         """Add a display, but do it through the container, so dependencies can be tracked."""
+        self.__read_deferred_displays()
         self.insert_model_item(self, "displays", self.item_count("displays"), display)
         if self.__display_ref_count > 0:
             display.increment_display_ref_count()
@@ -1367,7 +1613,7 @@ class DataItem(LibraryItem):
         self.increment_data_ref_count()
         self.__display_ref_count += 1
         if self.__display_ref_count == 1:
-            for display in self.displays:
+            for display in self.__loaded_displays:
                 display.increment_display_ref_count()
 
     def decrement_display_ref_count(self):
@@ -1375,7 +1621,7 @@ class DataItem(LibraryItem):
         self.decrement_data_ref_count()
         self.__display_ref_count -= 1
         if self.__display_ref_count == 0:
-            for display in self.displays:
+            for display in self.__loaded_displays:
                 display.decrement_display_ref_count()
 
     def increment_data_ref_count(self):
@@ -1431,6 +1677,11 @@ class DataItem(LibraryItem):
             if self.data_source:
                 self.data_source.set_data_and_metadata(xdata, data_modified)
 
+    def set_stored_data_metadata(self, data_metadata: DataAndMetadata.DataMetadata, data_modified: datetime.datetime=None) -> None:
+        with self.data_source_changes():
+            if self.data_source:
+                self.data_source.set_stored_data_metadata(data_metadata, data_modified)
+
     # grab a data reference as a context manager. the object
     # returned defines data and data properties. reading data
     # should use the data property. writing data (if allowed) should
@@ -1523,7 +1774,7 @@ class DataItem(LibraryItem):
 
     def __update_displays(self):
         data_and_metadata = self.xdata
-        for display in self.displays:
+        for display in self.__loaded_displays:
             display.update_data(data_and_metadata)
 
     @property
@@ -409,6 +409,8 @@ class Display(Observable.Observable, Persistence.PersistentObject):
             self.__disconnect_graphic(graphic, 0)
             graphic.close()
         self.graphic_selection = None
+        # release the cached values held in memory for this display; stored values are kept.
+        self.__cache.release_cached_values(self)
         assert self._about_to_be_removed
         assert not self._closed
         self._closed = True
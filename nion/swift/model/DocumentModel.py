@@ -1,6 +1,8 @@
 # standard libraries
 import asyncio
 import collections
+import concurrent.futures
+import contextlib
 import copy
 import datetime
 import functools
@@ -10,6 +12,7 @@ import logging
 import numbers
 import os.path
 import shutil
+import sqlite3
 import threading
 import time
 import typing
@@ -30,6 +33,7 @@ from nion.swift.model import DataItem
 from nion.swift.model import Graphics
 from nion.swift.model import HardwareSource
 from nion.swift.model import ImportExportManager
+from nion.swift.model import PipelineStatistics
 from nion.swift.model import PlugInManager
 from nion.swift.model import Symbolic
 from nion.swift.model import Utility
@@ -45,14 +49,112 @@ from nion.utils import ThreadPool
 _ = gettext.gettext
 
 
+class PersistentStorageWriter:
+    """Write persistent storage on a background thread, merging repeated writes to the same storage.
+
+    Each storage has at most one pending write. A new write for a storage replaces its pending write function but
+    keeps its due time, so writes made within the delay of each other are merged into one. Writes run one at a time,
+    so writes to a single file are never reordered or run concurrently.
+    """
+
+    def __init__(self, delay: float=0.0):
+        self.__delay = delay
+        self.__condition = threading.Condition()
+        self.__pending = collections.OrderedDict()  # type: typing.Dict[typing.Any, typing.Tuple[float, typing.Callable]]
+        self.__active_key = None
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def close(self) -> None:
+        self.flush()
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+        self.__thread.join()
+
+    def write(self, key, write_fn: typing.Callable[[], None]) -> None:
+        """Schedule write_fn as the pending write for key. Writes immediately if the writer is closed."""
+        with self.__condition:
+            if not self.__closed:
+                due_time = self.__pending[key][0] if key in self.__pending else time.perf_counter() + self.__delay
+                self.__pending[key] = (due_time, write_fn)
+                self.__condition.notify_all()
+                return
+        write_fn()
+
+    def flush(self, key=None) -> None:
+        """Perform the pending write for key, or all pending writes if key is None, and wait for it to finish."""
+        with self.__condition:
+            for pending_key, (due_time, write_fn) in self.__pending.items():
+                if key is None or pending_key == key:
+                    self.__pending[pending_key] = (0.0, write_fn)
+            self.__condition.notify_all()
+            if key is None:
+                self.__condition.wait_for(lambda: not self.__pending and self.__active_key is None)
+            else:
+                self.__condition.wait_for(lambda: key not in self.__pending and self.__active_key is not key)
+
+    def discard(self, key) -> None:
+        """Drop the pending write for key and wait for any write for key in progress to finish."""
+        with self.__condition:
+            self.__pending.pop(key, None)
+            self.__condition.wait_for(lambda: self.__active_key is not key)
+
+    def __run(self) -> None:
+        while True:
+            with self.__condition:
+                while True:
+                    if self.__pending:
+                        key = min(self.__pending, key=lambda k: self.__pending[k][0])
+                        due_time, write_fn = self.__pending[key]
+                        current_time = time.perf_counter()
+                        if due_time <= current_time:
+                            self.__pending.pop(key)
+                            self.__active_key = key
+                            break
+                        self.__condition.wait(due_time - current_time)
+                    elif self.__closed:
+                        return
+                    else:
+                        self.__condition.wait()
+            try:
+                write_fn()
+            except Exception as e:
+                import traceback
+                logging.debug("Write Error: %s", e)
+                traceback.print_exc()
+            finally:
+                with self.__condition:
+                    self.__active_key = None
+                    self.__condition.notify_all()
+
+
 class FilePersistentStorage:
     # this class is used to store the data for the library itself.
     # it is not used for library items.
+    #
+    # the library is stored as a snapshot file of the full properties and a journal file of the changes made since the
+    # snapshot, one json line per change. the journal begins with the id of the snapshot to which it applies. changes
+    # are appended to the journal; the journal is compacted into a new snapshot when it grows larger than the snapshot.
+    # compaction is a write of its own which replays the journal onto the snapshot file, so it does not hold up the write
+    # which crosses the threshold and does not hold the properties lock while the library is serialized.
+
+    journal_min_compaction_size = 64 * 1024
 
     def __init__(self, filepath=None):
         self.__filepath = filepath
-        self.__properties = self.__read_properties()
+        self.__journal_filepath = filepath + ".journal" if filepath else None
         self.__properties_lock = threading.RLock()
+        self.__journal_id = None  # id of the snapshot the journal applies to; None if a snapshot must be written
+        self.__journal_size = 0
+        self.__snapshot_size = 0
+        self.__pending_journal_lines = list()
+        self.__compaction_pending = False
+        self.__properties = self.__read_properties()
+        self.__properties_snapshot = None  # deep copy of the properties returned by properties; None when out of date
+        self.persistent_storage_writer = None  # type: PersistentStorageWriter
 
     def get_version(self):
         return 0
@@ -61,82 +163,249 @@ class FilePersistentStorage:
         properties = dict()
         if self.__filepath and os.path.exists(self.__filepath):
             try:
-                with open(self.__filepath, "r") as fp:
-                    properties = json.load(fp)
+                properties = self.__read_snapshot()
+                self.__snapshot_size = os.path.getsize(self.__filepath)
             except Exception:
                 os.replace(self.__filepath, self.__filepath + ".bak")
+        journal_id = properties.pop("journal_id", None)
+        if journal_id and os.path.exists(self.__journal_filepath):
+            # replay the changes made since the snapshot. a journal for another snapshot is left over from a
+            # compaction that did not finish and is already contained in the snapshot. a partial last line is left
+            # over from a write that did not finish. replay stops at the first line which cannot be applied; the
+            # properties are those of the lines before it and the journal is compacted upon the next write.
+            with open(self.__journal_filepath, "r") as fp:
+                lines = fp.readlines()
+            try:
+                journal_header = json.loads(lines[0]) if lines else dict()
+            except Exception:
+                journal_header = dict()
+            if journal_header.get("journal_id") == journal_id:
+                for line_index, line in enumerate(lines[1:], 2):
+                    try:
+                        changes = json.loads(line)
+                    except Exception:
+                        if line_index == len(lines) and not line.endswith("\n"):
+                            logging.warning("Ignoring partially written last line of journal %s", self.__journal_filepath)
+                        else:
+                            logging.error("Ignoring journal %s from unreadable line %s", self.__journal_filepath, line_index)
+                        break
+                    try:
+                        for change in changes:
+                            self.__apply_change(properties, change)
+                    except Exception as e:
+                        logging.error("Ignoring journal %s from line %s which cannot be applied", self.__journal_filepath, line_index)
+                        logging.error(str(e))
+                        # the line may be partly applied; replay the lines before it onto the snapshot again.
+                        properties = self.__read_snapshot()
+                        properties.pop("journal_id", None)
+                        for good_line in lines[1:line_index - 1]:
+                            for change in json.loads(good_line):
+                                self.__apply_change(properties, change)
+                        break
+                else:
+                    self.__journal_id = journal_id
+                    self.__journal_size = os.path.getsize(self.__journal_filepath)
         # migrations go here
         return properties
 
+    def __read_snapshot(self):
+        with open(self.__filepath, "r") as fp:
+            return json.load(fp)
+
     def __write_properties(self):
         if self.__filepath:
-            # atomically overwrite
+            if self.persistent_storage_writer:
+                self.persistent_storage_writer.write(self, self.__write_properties_file)
+            else:
+                self.__write_properties_file()
+
+    def __write_properties_file(self):
+        compact = False
+        with self.__properties_lock:
+            journal_lines = self.__pending_journal_lines
+            self.__pending_journal_lines = list()
+            journal_size = self.__journal_size + sum(len(journal_line) for journal_line in journal_lines)
+            snapshot_str = None
+            if not self.__journal_id:
+                # there is no journal to append to; write a snapshot of the properties.
+                self.__journal_id = str(uuid.uuid4())
+                properties = dict(self.__properties)
+                properties["journal_id"] = self.__journal_id
+                snapshot_str = json.dumps(properties)
+                journal_lines = [json.dumps({"journal_id": self.__journal_id}) + "\n"]
+                journal_size = len(journal_lines[0])
+                self.__snapshot_size = len(snapshot_str)
+            elif journal_size > max(self.__snapshot_size, FilePersistentStorage.journal_min_compaction_size) and not self.__compaction_pending:
+                self.__compaction_pending = True
+                compact = True
+            self.__journal_size = journal_size
+        if snapshot_str is not None:
+            # atomically overwrite the snapshot, then start a new journal. the old journal does not match the new
+            # snapshot, so it is ignored if writing the new journal does not finish.
             temp_filepath = self.__filepath + ".temp"
             with open(temp_filepath, "w") as fp:
-                json.dump(self.__properties, fp)
+                fp.write(snapshot_str)
             os.replace(temp_filepath, self.__filepath)
+            temp_filepath = self.__journal_filepath + ".temp"
+            with open(temp_filepath, "w") as fp:
+                fp.writelines(journal_lines)
+            os.replace(temp_filepath, self.__journal_filepath)
+        elif journal_lines:
+            with open(self.__journal_filepath, "a") as fp:
+                fp.writelines(journal_lines)
+        if compact:
+            if self.persistent_storage_writer:
+                self.persistent_storage_writer.write((self, "compact"), self.__compact_properties_file)
+            else:
+                self.__compact_properties_file()
+
+    def __compact_properties_file(self):
+        # replay the journal onto the snapshot file and start a new journal. this runs as a write of its own, so no
+        # other write to the files runs at the same time; changes made meanwhile are appended to the new journal.
+        with self.__properties_lock:
+            self.__compaction_pending = False
+            journal_id = self.__journal_id
+        if not journal_id:
+            return  # the next write writes a snapshot of the properties
+        try:
+            properties = self.__read_snapshot()
+            with open(self.__journal_filepath, "r") as fp:
+                lines = fp.readlines()
+            if properties.get("journal_id") != journal_id or json.loads(lines[0]).get("journal_id") != journal_id:
+                raise ValueError("Journal does not apply to snapshot")
+            for line in lines[1:]:
+                for change in json.loads(line):
+                    self.__apply_change(properties, change)
+        except Exception as e:
+            logging.error("Unable to compact journal %s", self.__journal_filepath)
+            logging.error(str(e))
+            with self.__properties_lock:
+                if self.__journal_id == journal_id:
+                    self.__journal_id = None  # the next write writes a snapshot of the properties
+            return
+        new_journal_id = str(uuid.uuid4())
+        properties["journal_id"] = new_journal_id
+        snapshot_str = json.dumps(properties)
+        journal_line = json.dumps({"journal_id": new_journal_id}) + "\n"
+        temp_filepath = self.__filepath + ".temp"
+        with open(temp_filepath, "w") as fp:
+            fp.write(snapshot_str)
+        os.replace(temp_filepath, self.__filepath)
+        temp_filepath = self.__journal_filepath + ".temp"
+        with open(temp_filepath, "w") as fp:
+            fp.write(journal_line)
+        os.replace(temp_filepath, self.__journal_filepath)
+        with self.__properties_lock:
+            if self.__journal_id == journal_id:
+                self.__journal_id = new_journal_id
+                self.__journal_size = len(journal_line)
+                self.__snapshot_size = len(snapshot_str)
 
     @property
     def properties(self):
+        """Return a snapshot of the properties. The snapshot is shared until the properties change; do not modify it."""
         with self.__properties_lock:
-            return copy.deepcopy(self.__properties)
+            if self.__properties_snapshot is None:
+                self.__properties_snapshot = copy.deepcopy(self.__properties)
+            return self.__properties_snapshot
 
     def _set_properties(self, properties):
         """Set the properties; used for testing."""
         with self.__properties_lock:
             self.__properties = properties
+            self.__properties_snapshot = None
+            self.__journal_id = None
 
-    def __get_storage_dict(self, object):
+    def __get_storage_path(self, object):
+        # return the path of the storage dict of the object as a list of [item_name] or [relationship_name, index].
         persistent_object_parent = object.persistent_object_parent
         if not persistent_object_parent:
-            return self.__properties
+            return list()
         else:
-            parent_storage_dict = self.__get_storage_dict(persistent_object_parent.parent)
-            return object.get_accessor_in_parent()(parent_storage_dict)
+            storage_path = self.__get_storage_path(persistent_object_parent.parent)
+            if persistent_object_parent.item_name:
+                storage_path.append([persistent_object_parent.item_name])
+            else:
+                relationship_name = persistent_object_parent.relationship_name
+                index = getattr(persistent_object_parent.parent, relationship_name).index(object)
+                storage_path.append([relationship_name, index])
+            return storage_path
+
+    @staticmethod
+    def __get_storage_dict(properties, storage_path):
+        storage_dict = properties
+        for path_item in storage_path:
+            if len(path_item) == 1:
+                storage_dict = storage_dict.get(path_item[0], dict())
+            else:
+                storage_dict = storage_dict[path_item[0]][path_item[1]]
+        return storage_dict
 
-    def __update_modified_and_get_storage_dict(self, object):
-        storage_dict = self.__get_storage_dict(object)
-        with self.__properties_lock:
-            storage_dict["modified"] = object.modified.isoformat()
+    @classmethod
+    def __apply_change(cls, properties, change):
+        action, storage_path, name = change[0:3]
+        storage_dict = cls.__get_storage_dict(properties, storage_path)
+        if action == "set":
+            storage_dict[name] = change[3]
+        elif action == "insert":
+            storage_dict.setdefault(name, list()).insert(change[3], change[4])
+        elif action == "remove":
+            del storage_dict[name][change[3]]
+        elif action == "clear":
+            storage_dict.pop(name, None)
+
+    def __update_modified_changes(self, object, changes):
+        changes.append(["set", self.__get_storage_path(object), "modified", object.modified.isoformat()])
         persistent_object_parent = object.persistent_object_parent
         parent = persistent_object_parent.parent if persistent_object_parent else None
         if parent:
-            self.__update_modified_and_get_storage_dict(parent)
-        return storage_dict
+            self.__update_modified_changes(parent, changes)
+
+    def __commit_changes(self, changes):
+        # apply the changes to the properties and journal them. call with the properties lock held.
+        for change in changes:
+            self.__apply_change(self.__properties, change)
+        self.__properties_snapshot = None
+        if self.__filepath:
+            self.__pending_journal_lines.append(json.dumps(changes) + "\n")
 
     def insert_item(self, parent, name, before_index, item):
-        storage_dict = self.__update_modified_and_get_storage_dict(parent)
         with self.__properties_lock:
-            item_list = storage_dict.setdefault(name, list())
-            item_dict = item.write_to_dict()
-            item_list.insert(before_index, item_dict)
+            changes = list()
+            self.__update_modified_changes(parent, changes)
+            changes.append(["insert", self.__get_storage_path(parent), name, before_index, item.write_to_dict()])
+            self.__commit_changes(changes)
             item.persistent_object_context = parent.persistent_object_context
         self.__write_properties()
 
     def remove_item(self, parent, name, index, item):
-        storage_dict = self.__update_modified_and_get_storage_dict(parent)
         with self.__properties_lock:
-            item_list = storage_dict[name]
-            del item_list[index]
+            changes = list()
+            self.__update_modified_changes(parent, changes)
+            changes.append(["remove", self.__get_storage_path(parent), name, index])
+            self.__commit_changes(changes)
         self.__write_properties()
         item.persistent_object_context = None
 
     def set_item(self, parent, name, item):
-        storage_dict = self.__update_modified_and_get_storage_dict(parent)
         with self.__properties_lock:
+            changes = list()
+            self.__update_modified_changes(parent, changes)
             if item:
-                item_dict = item.write_to_dict()
-                storage_dict[name] = item_dict
+                changes.append(["set", self.__get_storage_path(parent), name, item.write_to_dict()])
+                self.__commit_changes(changes)
                 item.persistent_object_context = parent.persistent_object_context
             else:
-                if name in storage_dict:
-                    del storage_dict[name]
+                changes.append(["clear", self.__get_storage_path(parent), name])
+                self.__commit_changes(changes)
         self.__write_properties()
 
     def set_property(self, object, name, value):
-        storage_dict = self.__update_modified_and_get_storage_dict(object)
         with self.__properties_lock:
-            storage_dict[name] = value
+            changes = list()
+            self.__update_modified_changes(object, changes)
+            changes.append(["set", self.__get_storage_path(object), name, value])
+            self.__commit_changes(changes)
         self.__write_properties()
 
 
@@ -153,14 +422,17 @@ class DataItemStorage:
             write_data(data, file_datetime)
     """
 
-    def __init__(self, storage_handler=None, data_item=None, properties=None):
+    def __init__(self, storage_handler=None, data_item=None, properties=None, persistent_storage_writer=None):
         self.__storage_handler = storage_handler
-        self.__properties = Utility.clean_dict(copy.deepcopy(properties) if properties else dict())
+        self.__properties = Utility.clean_dict(properties) if properties else dict()  # clean_dict builds a new dict
         self.__properties_lock = threading.RLock()
         self.__weak_data_item = weakref.ref(data_item) if data_item else None
         self.write_delayed = False
+        self.persistent_storage_writer = persistent_storage_writer  # type: PersistentStorageWriter
 
     def close(self):
+        if self.persistent_storage_writer:
+            self.persistent_storage_writer.flush(self)
         if self.__storage_handler:
             self.__storage_handler.close()
             self.__storage_handler = None
@@ -203,7 +475,15 @@ class DataItemStorage:
     def update_properties(self):
         if not self.write_delayed:
             file_datetime = self.data_item.created_local
-            self.__storage_handler.write_properties(self.properties, file_datetime)
+            write_fn = functools.partial(self.__write_properties, self.__storage_handler, file_datetime)
+            if self.persistent_storage_writer:
+                # the write reads the properties when it runs, so merged writes store the latest properties.
+                self.persistent_storage_writer.write(self, write_fn)
+            else:
+                write_fn()
+
+    def __write_properties(self, storage_handler, file_datetime):
+        storage_handler.write_properties(self.properties, file_datetime)
 
     def insert_item(self, parent, name, before_index, item):
         storage_dict = self.__update_modified_and_get_storage_dict(parent)
@@ -235,11 +515,30 @@ class DataItemStorage:
                     del storage_dict[name]
         self.update_properties()
 
-    def update_data(self, data):
+    def update_data(self, data, sub_area=None):
         if not self.write_delayed:
             file_datetime = self.data_item.created_local
             if data is not None:
-                self.__storage_handler.write_data(data, file_datetime)
+                if self.persistent_storage_writer:
+                    self.persistent_storage_writer.flush(self)
+                with PipelineStatistics.measure_active("persist"):
+                    if sub_area is not None:
+                        # only the sub area has changed; the storage handler writes as little as it can.
+                        (top, left), (height, width) = sub_area
+                        region = slice(top, top + height), slice(left, left + width)
+                        self.__storage_handler.write_data_region(data, region, file_datetime)
+                    else:
+                        self.__storage_handler.write_data(data, file_datetime)
+
+    def reserve_data(self, data_shape, data_dtype):
+        file_datetime = self.data_item.created_local
+        if self.persistent_storage_writer:
+            self.persistent_storage_writer.flush(self)
+        self.__storage_handler.reserve_data(data_shape, data_dtype, file_datetime)
+
+    def update_data_frame(self, data, index):
+        file_datetime = self.data_item.created_local
+        self.__storage_handler.write_data_frame(data, index, file_datetime)
 
     def load_data(self):
         assert self.data_item.has_data
@@ -252,6 +551,8 @@ class DataItemStorage:
         self.update_properties()
 
     def remove(self):
+        if self.persistent_storage_writer:
+            self.persistent_storage_writer.discard(self)
         self.__storage_handler.remove()
 
 
@@ -292,6 +593,24 @@ class MemoryStorageSystem:
         def write_data(self, data, file_datetime):
             self.__data[self.__uuid] = data.copy()
 
+        def write_data_region(self, data, region, file_datetime):
+            old_data = self.__data.get(self.__uuid)
+            if old_data is not None and old_data.shape == data.shape and old_data.dtype == data.dtype:
+                old_data[region] = data[region]
+            else:
+                self.write_data(data, file_datetime)
+
+        def reserve_data(self, data_shape, data_dtype, file_datetime):
+            old_data = self.__data.get(self.__uuid)
+            data = numpy.zeros(data_shape, data_dtype)
+            if old_data is not None and old_data.shape[1:] == data.shape[1:] and old_data.dtype == data.dtype:
+                frame_count = min(old_data.shape[0], data.shape[0])
+                data[:frame_count] = old_data[:frame_count]
+            self.__data[self.__uuid] = data
+
+        def write_data_frame(self, data, index, file_datetime):
+            self.__data[self.__uuid][index] = data
+
         def remove(self):
             self.__data.pop(self.__uuid, None)
             self.__properties.pop(self.__uuid, None)
@@ -311,32 +630,137 @@ class MemoryStorageSystem:
 from nion.swift.model import NDataHandler
 from nion.swift.model import HDF5Handler
 
+class FileStorageIndex:
+    """An sqlite index of the properties of the files in a file storage system, keyed by path, mtime, ctime and size.
+
+    Lets a file storage system find its data items without parsing the files that are unchanged since they were last
+    scanned. Since the key does not change with every write, files are also removed from the index when they are
+    written. The index is only a cache; it is safe to delete.
+    """
+
+    def __init__(self, index_path: str, file_handlers: typing.Sequence):
+        self.__index_path = index_path
+        self.__file_handlers = {file_handler.__name__: file_handler for file_handler in file_handlers}
+
+    def __connect(self):
+        conn = sqlite3.connect(self.__index_path)
+        conn.execute("CREATE TABLE IF NOT EXISTS files(path STRING, mtime INTEGER, ctime INTEGER, size INTEGER, handler STRING, properties STRING, PRIMARY KEY(path))")
+        return conn
+
+    def read_entries(self) -> typing.Dict[str, typing.Tuple[typing.Tuple[int, int, int], typing.Any, dict]]:
+        entries = dict()
+        try:
+            with contextlib.closing(self.__connect()) as conn:
+                for file_path, mtime, ctime, size, handler_name, properties_str in conn.execute("SELECT path, mtime, ctime, size, handler, properties FROM files"):
+                    file_handler = self.__file_handlers.get(handler_name)
+                    if file_handler:
+                        entries[file_path] = ((mtime, ctime, size), file_handler, json.loads(properties_str))
+        except Exception as e:
+            logging.error("Exception reading library index: %s", self.__index_path)
+            logging.error(str(e))
+        return entries
+
+    def write_entries(self, entries, removed_paths) -> None:
+        with contextlib.closing(self.__connect()) as conn:
+            with conn:
+                conn.executemany("DELETE FROM files WHERE path = ?", [(file_path, ) for file_path in removed_paths])
+                conn.executemany("INSERT OR REPLACE INTO files (path, mtime, ctime, size, handler, properties) VALUES (?, ?, ?, ?, ?, ?)",
+                                 [(file_path, mtime, ctime, size, file_handler.__name__, json.dumps(properties)) for file_path, ((mtime, ctime, size), file_handler, properties) in entries.items()])
+
+
 class FileStorageSystem:
 
     _file_handlers = [NDataHandler.NDataHandler, HDF5Handler.HDF5Handler]
 
-    def __init__(self, directories):
+    scan_thread_count = 8
+
+    def __init__(self, directories, index_path=None):
         self.__directories = directories
         self.__file_handlers = FileStorageSystem._file_handlers
+        self.__scan_cache = dict()  # type: typing.Dict[str, typing.Tuple[typing.Tuple[int, int, int], typing.Any, dict]]
+        self.__scan_cache_lock = threading.RLock()
+        self.__scan_cache_changed_paths = set()
+        self.__index = FileStorageIndex(index_path, self.__file_handlers) if index_path else None
+        if self.__index:
+            self.__scan_cache.update(self.__index.read_entries())
 
     def find_data_items(self):
-        storage_handlers = list()
         absolute_file_paths = set()
         for directory in self.__directories:
             for root, dirs, files in os.walk(directory):
                 absolute_file_paths.update([os.path.join(root, data_file) for data_file in files])
+        # each file is parsed once, on a pool of threads. files that are unchanged since the last scan are not parsed.
+        absolute_file_paths = sorted(absolute_file_paths)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(FileStorageSystem.scan_thread_count, 1)) as executor:
+            scan_results = list(executor.map(self.__scan_file, absolute_file_paths))
+        self.__update_index(absolute_file_paths)
+        storage_handlers = list()
         for file_handler in self.__file_handlers:
-            for data_file in filter(file_handler.is_matching, absolute_file_paths):
-                try:
-                    storage_handler = file_handler(data_file)
-                    assert storage_handler.is_valid
-                    storage_handlers.append(storage_handler)
-                except Exception as e:
-                    logging.error("Exception reading file: %s", data_file)
-                    logging.error(str(e))
-                    raise
+            for data_file, scan_result in zip(absolute_file_paths, scan_results):
+                if scan_result and scan_result[0] == file_handler:
+                    try:
+                        storage_handler = file_handler(data_file, properties=copy.deepcopy(scan_result[1]))
+                        assert storage_handler.is_valid
+                        storage_handler.on_write = self.__file_written
+                        storage_handlers.append(storage_handler)
+                    except Exception as e:
+                        logging.error("Exception reading file: %s", data_file)
+                        logging.error(str(e))
+                        raise
         return storage_handlers
 
+    def __scan_file(self, file_path):
+        # return the file handler and properties of the file, or None if no file handler matches the file. the ctime
+        # is part of the key since writing properties restores the mtime of the file to the data item creation time.
+        # the key does not change for every write (on Windows the ctime is the creation time and in place writes keep
+        # the size), so the storage handlers also forget the files they write; see __file_written.
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        scan_key = (stat.st_mtime_ns, stat.st_ctime_ns, stat.st_size)
+        with self.__scan_cache_lock:
+            cached_scan = self.__scan_cache.get(file_path)
+        if cached_scan and cached_scan[0] == scan_key:
+            return cached_scan[1], cached_scan[2]
+        for file_handler in self.__file_handlers:
+            properties = file_handler.read_properties_if_matching(file_path)
+            if properties is not None:
+                with self.__scan_cache_lock:
+                    self.__scan_cache[file_path] = (scan_key, file_handler, properties)
+                    self.__scan_cache_changed_paths.add(file_path)
+                return file_handler, properties
+        return None
+
+    def __file_written(self, file_path):
+        # called by the storage handlers after writing the file; the file is parsed again by the next scan, in this
+        # session or, since it is also removed from the index, in a later one. only the first write after a scan
+        # touches the index.
+        with self.__scan_cache_lock:
+            cached_scan = self.__scan_cache.pop(file_path, None)
+            self.__scan_cache_changed_paths.discard(file_path)
+        if self.__index and cached_scan:
+            try:
+                self.__index.write_entries(dict(), [file_path])
+            except Exception as e:
+                logging.error("Exception writing library index")
+                logging.error(str(e))
+
+    def __update_index(self, absolute_file_paths):
+        # forget files that no longer exist and write the files parsed by this scan to the index.
+        with self.__scan_cache_lock:
+            removed_paths = set(self.__scan_cache) - set(absolute_file_paths)
+            for file_path in removed_paths:
+                self.__scan_cache.pop(file_path)
+            changed_entries = {file_path: self.__scan_cache[file_path] for file_path in self.__scan_cache_changed_paths if file_path in self.__scan_cache}
+            self.__scan_cache_changed_paths = set()
+        if self.__index and (removed_paths or changed_entries):
+            try:
+                self.__index.write_entries(changed_entries, removed_paths)
+            except Exception as e:
+                logging.error("Exception writing library index")
+                logging.error(str(e))
+
     def __get_default_path(self, data_item):
         uuid_ = data_item.uuid
         created_local = data_item.created_local
@@ -368,7 +792,9 @@ class FileStorageSystem:
         # if there are two handlers, first is small, second is large
         # if there is only one handler, it is used in all cases
         file_handler = file_handler if file_handler else (self.__file_handlers[-1] if data_item.large_format else self.__file_handlers[0])
-        return file_handler.make(os.path.join(self.__directories[0], self.__get_default_path(data_item)))
+        storage_handler = file_handler.make(os.path.join(self.__directories[0], self.__get_default_path(data_item)))
+        storage_handler.on_write = self.__file_written
+        return storage_handler
 
 
 class PersistentDataItemContext(Persistence.PersistentObjectContext):
@@ -391,6 +817,7 @@ class PersistentDataItemContext(Persistence.PersistentObjectContext):
         self.__ignore_older_files = ignore_older_files
         self.__log_migrations = log_migrations
         self.__log_copying = log_copying
+        self.persistent_storage_writer = None  # type: PersistentStorageWriter
 
     @property
     def persistent_storage_systems(self):
@@ -438,6 +865,12 @@ class PersistentDataItemContext(Persistence.PersistentObjectContext):
                 traceback.print_stack()
         if not self.__ignore_older_files:
             self.__migrate_to_latest(reader_info_list)
+        # displays and graphics referenced by computations or connections are needed while the document is read; the
+        # displays of other data items are read when first used.
+        referenced_uuid_strs = set()
+        for reader_info in reader_info_list:
+            for key in ("computation", "connections"):
+                referenced_uuid_strs.update(Utility.get_nested_strings(reader_info.properties.get(key)))
         for reader_info in reader_info_list:
             properties = reader_info.properties
             changed_ref = reader_info.changed_ref
@@ -462,8 +895,8 @@ class PersistentDataItemContext(Persistence.PersistentObjectContext):
                         if len(properties.get("data_item_uuids", list())) > 0:
                             data_item = DataItem.CompositeLibraryItem(item_uuid=data_item_uuid)
                             data_item.begin_reading()
-                            persistent_storage = DataItemStorage(storage_handler=storage_handler, data_item=data_item, properties=properties)
-                            data_item.read_from_dict(persistent_storage.properties)
+                            persistent_storage = DataItemStorage(storage_handler=storage_handler, data_item=data_item, properties=properties, persistent_storage_writer=self.persistent_storage_writer)
+                            data_item.read_from_dict(properties)  # storage holds its own copy
                             self._set_persistent_storage_for_object(data_item, persistent_storage)
                             data_item.persistent_object_context = self
                             if self.__log_migrations and data_item.uuid in data_items_by_uuid:
@@ -471,10 +904,11 @@ class PersistentDataItemContext(Persistence.PersistentObjectContext):
                             data_items_by_uuid[data_item.uuid] = data_item
                         else:
                             large_format = isinstance(storage_handler, HDF5Handler.HDF5Handler)
-                            data_item = DataItem.DataItem(item_uuid=data_item_uuid, large_format=large_format)
+                            data_item = DataItem.DataItem(item_uuid=data_item_uuid, large_format=large_format, create_display=False)
                             data_item.begin_reading()
-                            persistent_storage = DataItemStorage(storage_handler=storage_handler, data_item=data_item, properties=properties)
-                            data_item.read_from_dict(persistent_storage.properties)
+                            persistent_storage = DataItemStorage(storage_handler=storage_handler, data_item=data_item, properties=properties, persistent_storage_writer=self.persistent_storage_writer)
+                            defer_displays = referenced_uuid_strs.isdisjoint(Utility.get_nested_strings(properties.get("displays"), ("uuid", )))
+                            data_item.read_from_dict(properties, defer_displays=defer_displays)  # storage holds its own copy
                             self._set_persistent_storage_for_object(data_item, persistent_storage)
                             data_item.persistent_object_context = self
                             if self.__log_migrations and data_item.uuid in data_items_by_uuid:
@@ -511,7 +945,7 @@ class PersistentDataItemContext(Persistence.PersistentObjectContext):
             target_storage_handler.write_properties(copy.deepcopy(properties), datetime.datetime.now())
             new_data_item = DataItem.DataItem(item_uuid=data_item_uuid)
             new_data_item.begin_reading()
-            persistent_storage = DataItemStorage(storage_handler=target_storage_handler, data_item=new_data_item, properties=properties)
+            persistent_storage = DataItemStorage(storage_handler=target_storage_handler, data_item=new_data_item, properties=properties, persistent_storage_writer=target_document.persistent_object_context.persistent_storage_writer)
             new_data_item.read_from_dict(persistent_storage.properties)
             target_document.persistent_object_context._set_persistent_storage_for_object(new_data_item, persistent_storage)
             new_data_item.persistent_object_context = target_document.persistent_object_context
@@ -1066,7 +1500,7 @@ class PersistentDataItemContext(Persistence.PersistentObjectContext):
                 if storage_handler:
                     break
             properties = data_item.write_to_dict()
-            persistent_storage = DataItemStorage(storage_handler=storage_handler, data_item=data_item, properties=properties)
+            persistent_storage = DataItemStorage(storage_handler=storage_handler, data_item=data_item, properties=properties, persistent_storage_writer=self.persistent_storage_writer)
             self._set_persistent_storage_for_object(data_item, persistent_storage)
             data_item.persistent_object_context_changed()
         return persistent_storage
@@ -1083,9 +1517,17 @@ class PersistentDataItemContext(Persistence.PersistentObjectContext):
         persistent_storage = self._get_persistent_storage_for_object(data_item)
         persistent_storage.update_properties()
 
-    def rewrite_data_item_data(self, data_item, data: numpy.ndarray) -> None:
+    def rewrite_data_item_data(self, data_item, data: numpy.ndarray, sub_area=None) -> None:
+        persistent_storage = self._get_persistent_storage_for_object(data_item)
+        persistent_storage.update_data(data, sub_area)
+
+    def reserve_data_item_data(self, data_item, data_shape, data_dtype) -> None:
         persistent_storage = self._get_persistent_storage_for_object(data_item)
-        persistent_storage.update_data(data)
+        persistent_storage.reserve_data(data_shape, data_dtype)
+
+    def rewrite_data_item_data_frame(self, data_item, data: numpy.ndarray, index: int) -> None:
+        persistent_storage = self._get_persistent_storage_for_object(data_item)
+        persistent_storage.update_data_frame(data, index)
 
     def erase_data_item(self, data_item):
         persistent_storage = self._get_persistent_storage_for_object(data_item)
@@ -1101,10 +1543,143 @@ class PersistentDataItemContext(Persistence.PersistentObjectContext):
         return persistent_storage._storage_handler.reference
 
 
+class DataItemComputationTarget:
+    """A write-only target for a computation evaluated on a thread.
+
+    Collects the new data and the property changes made by the computation so that they can be merged into the data
+    item on the main thread without cloning the data item. The cost is independent of the number of displays and
+    graphics on the data item.
+
+    Any access beyond the write-only interface falls back to an API object on a clone of the data item (the original
+    behavior); changes to the clone are recorded and merged too.
+    """
+
+    def __init__(self, api, data_item: DataItem.DataItem):
+        self.__api = api
+        self.__data_item = data_item
+        self.__data_item_data_modified = data_item.data_modified or datetime.datetime.min
+        self.__xdata = None  # type: DataAndMetadata.DataAndMetadata
+        self.__xdata_changed = False
+        self.__title = None  # type: str
+        self.__changes = list()  # type: typing.List[typing.Callable[[DataItem.DataItem], None]]
+        self.__data_item_clone = None  # type: DataItem.DataItem
+        self.__data_item_clone_recorder = None
+        self.__api_data_item_clone = None
+
+    def __getattr__(self, name):
+        return getattr(self.__get_api_data_item_clone(), name)
+
+    def __get_api_data_item_clone(self):
+        if not self.__api_data_item_clone:
+            self.__data_item_clone = self.__data_item.clone()
+            # bring the clone up to date with what has been written so far; from here on the clone is the target.
+            # the changes are kept and applied before the ones recorded on the clone, since the recorder only sees
+            # changes made after it is attached.
+            for change in self.__changes:
+                change(self.__data_item_clone)
+            if self.__xdata_changed:
+                self.__data_item_clone.set_xdata(self.__xdata)
+            self.__xdata_changed = False
+            self.__data_item_clone_recorder = Recorder.Recorder(self.__data_item_clone)
+            self.__api_data_item_clone = self.__api._new_api_object(self.__data_item_clone)
+        return self.__api_data_item_clone
+
+    @property
+    def uuid(self) -> uuid.UUID:
+        return self.__data_item.uuid
+
+    @property
+    def title(self) -> str:
+        if self.__api_data_item_clone:
+            return self.__api_data_item_clone.title
+        return self.__title if self.__title is not None else self.__data_item.title
+
+    @title.setter
+    def title(self, value: str) -> None:
+        if self.__api_data_item_clone:
+            self.__api_data_item_clone.title = value
+        else:
+            self.__title = value
+            self.__changes.append(lambda data_item: setattr(data_item, "title", value))
+
+    @property
+    def xdata(self) -> DataAndMetadata.DataAndMetadata:
+        if self.__api_data_item_clone:
+            return self.__api_data_item_clone.xdata
+        return self.__xdata
+
+    @xdata.setter
+    def xdata(self, xdata: DataAndMetadata.DataAndMetadata) -> None:
+        if self.__api_data_item_clone:
+            self.__api_data_item_clone.xdata = xdata
+        else:
+            self.__xdata = xdata
+            self.__xdata_changed = True
+
+    @property
+    def data_and_metadata(self) -> DataAndMetadata.DataAndMetadata:
+        return self.xdata
+
+    def set_data_and_metadata(self, xdata: DataAndMetadata.DataAndMetadata) -> None:
+        self.xdata = xdata
+
+    @property
+    def data(self) -> numpy.ndarray:
+        xdata = self.xdata
+        return xdata.data if xdata else None
+
+    @data.setter
+    def data(self, data: numpy.ndarray) -> None:
+        self.xdata = DataAndMetadata.new_data_and_metadata(numpy.copy(data))
+
+    def set_data(self, data: numpy.ndarray) -> None:
+        self.data = data
+
+    def __set_xdata_metadata(self, name: str, value) -> None:
+        if self.__xdata:
+            xdata = self.__xdata
+            metadata = {"intensity_calibration": xdata.intensity_calibration, "dimensional_calibrations": xdata.dimensional_calibrations, "metadata": xdata.metadata}
+            metadata[name] = value
+            self.__xdata = DataAndMetadata.new_data_and_metadata(xdata.data, timestamp=xdata.timestamp, data_descriptor=xdata.data_descriptor, **metadata)
+        else:
+            self.__changes.append(lambda data_item: setattr(data_item, name, value))
+
+    def set_intensity_calibration(self, intensity_calibration) -> None:
+        if self.__api_data_item_clone:
+            self.__api_data_item_clone.set_intensity_calibration(intensity_calibration)
+        else:
+            self.__set_xdata_metadata("intensity_calibration", copy.deepcopy(intensity_calibration))
+
+    def set_dimensional_calibrations(self, dimensional_calibrations) -> None:
+        if self.__api_data_item_clone:
+            self.__api_data_item_clone.set_dimensional_calibrations(dimensional_calibrations)
+        else:
+            self.__set_xdata_metadata("dimensional_calibrations", copy.deepcopy(dimensional_calibrations))
+
+    def set_metadata(self, metadata: dict) -> None:
+        if self.__api_data_item_clone:
+            self.__api_data_item_clone.set_metadata(metadata)
+        else:
+            self.__set_xdata_metadata("metadata", copy.deepcopy(metadata))
+
+    def apply(self, data_item: DataItem.DataItem) -> None:
+        """Apply the collected changes to the data item. Call on the main thread."""
+        for change in self.__changes:
+            change(data_item)
+        if self.__xdata_changed:
+            data_item.set_xdata(self.__xdata)
+        if self.__data_item_clone:
+            data_item_data_clone_modified = self.__data_item_clone.data_modified or datetime.datetime.min
+            if data_item_data_clone_modified > self.__data_item_data_modified:
+                data_item.set_xdata(self.__api_data_item_clone.data_and_metadata)
+            self.__data_item_clone_recorder.apply(data_item)
+
+
 class ComputationQueueItem:
     def __init__(self, data_item):
         self.data_item = data_item
         self.valid = True
+        self.evaluated = False
 
     def recompute(self) -> typing.Sequence[typing.Callable[[], None]]:
         # evaluate the computation in a thread safe manner
@@ -1116,25 +1691,20 @@ class ComputationQueueItem:
         if computation:
             try:
                 api = PlugInManager.api_broker_fn("~1.0", None)
-                data_item_clone = data_item.clone()
-                data_item_data_modified = data_item.data_modified or datetime.datetime.min
-                data_item_clone_recorder = Recorder.Recorder(data_item_clone)
-                api_data_item = api._new_api_object(data_item_clone)
+                computation_target = DataItemComputationTarget(api, data_item)
                 error_text = computation.error_text
                 if computation.needs_update:
-                    error_text = computation.evaluate_with_target(api, api_data_item)
-                    throttle_time = max(DocumentModel.computation_min_period - (time.perf_counter() - computation.last_evaluate_data_time), 0)
-                    time.sleep(max(throttle_time, 0.0))
+                    error_text = computation.evaluate_with_target(api, computation_target)
+                    self.evaluated = True
                 if self.valid:  # TODO: race condition for 'valid'
-                    def data_item_merge(data_item, data_item_clone, data_item_clone_recorder):
-                        data_item_data_clone_modified = data_item_clone.data_modified or datetime.datetime.min
+                    def data_item_merge(data_item, computation_target):
+                        start_time = time.perf_counter()
                         with data_item.data_item_changes(), data_item.data_source_changes():
-                            if data_item_data_clone_modified > data_item_data_modified:
-                                data_item.set_xdata(api_data_item.data_and_metadata)
-                            data_item_clone_recorder.apply(data_item)
+                            computation_target.apply(data_item)
                             if computation.error_text != error_text:
                                 computation.error_text = error_text
-                    pending_data_item_merges.append(functools.partial(data_item_merge, data_item, data_item_clone, data_item_clone_recorder))
+                        computation.record_timing("merge", time.perf_counter() - start_time)
+                    pending_data_item_merges.append(functools.partial(data_item_merge, data_item, computation_target))
             except Exception as e:
                 import traceback
                 traceback.print_exc()
@@ -1156,6 +1726,9 @@ class DocumentModel(Observable.Observable, ReferenceCounting.ReferenceCounted, P
     """
 
     computation_min_period = 0.0
+    computation_max_load = None  # fraction of a computation thread a single computation may use; None for no limit
+    computation_thread_count = 1
+    persistent_storage_write_delay = None  # seconds to merge property writes before writing them on a background thread; None to write immediately
 
     def __init__(self, library_storage=None, persistent_storage_systems=None, storage_cache=None, log_migrations=True, ignore_older_files=False, auto_migrations=None):
         super(DocumentModel, self).__init__()
@@ -1172,8 +1745,13 @@ class DocumentModel(Observable.Observable, ReferenceCounting.ReferenceCounted, P
 
         self.__thread_pool = ThreadPool.ThreadPool()
         self.__computation_thread_pool = ThreadPool.ThreadPool()
+        self.__persistent_storage_writer = None
+        if DocumentModel.persistent_storage_write_delay is not None:
+            self.__persistent_storage_writer = PersistentStorageWriter(DocumentModel.persistent_storage_write_delay)
         self.persistent_object_context = PersistentDataItemContext(persistent_storage_systems, ignore_older_files, log_migrations)
+        self.persistent_object_context.persistent_storage_writer = self.__persistent_storage_writer
         self.__library_storage = library_storage if library_storage else FilePersistentStorage()
+        self.__library_storage.persistent_storage_writer = self.__persistent_storage_writer
         self.persistent_object_context._set_persistent_storage_for_object(self, self.__library_storage)
         self.storage_cache = storage_cache if storage_cache else Cache.DictStorageCache()
         self.__auto_migrations = auto_migrations or list()
@@ -1193,6 +1771,12 @@ class DocumentModel(Observable.Observable, ReferenceCounting.ReferenceCounted, P
         self.__computation_queue_lock = threading.RLock()
         self.__computation_pending_queue = list()  # type: typing.List[ComputationQueueItem]
         self.__computation_active_items = list()  # type: typing.List[ComputationQueueItem]
+        self.__computation_merging_items = list()  # type: typing.List[ComputationQueueItem]
+        self.__computation_deferred_count = 0
+        self.__computation_timer = None  # type: threading.Timer
+        self.__computation_timer_time = 0.0
+        self.__computation_rate_control = False
+        self.__computation_statistics = {"requested": 0, "coalesced": 0, "evaluated": 0, "throttled": 0}
         self.define_type("library")
         self.define_relationship("data_groups", DataGroup.data_group_factory)
         self.define_relationship("workspaces", WorkspaceLayout.factory)  # TODO: file format. Rename workspaces to workspace_layouts.
@@ -1217,6 +1801,8 @@ class DocumentModel(Observable.Observable, ReferenceCounting.ReferenceCounted, P
 
         self.__pending_data_item_updates_lock = threading.RLock()
         self.__pending_data_item_updates = list()
+        self.__pending_data_item_statistics = dict()  # maps data item to statistics and time queued
+        self.__pending_data_item_data_channels = dict()  # maps data item to the data channel of its pending update
 
         self.__pending_data_item_merges_lock = threading.RLock()
         self.__pending_data_item_merges = list()
@@ -1294,6 +1880,11 @@ class DocumentModel(Observable.Observable, ReferenceCounting.ReferenceCounted, P
             for computation_queue_item in self.__computation_active_items:
                 computation_queue_item.valid = False
             self.__computation_active_items.clear()
+            self.__computation_merging_items.clear()
+            self.__computation_deferred_count = 0
+            if self.__computation_timer:
+                self.__computation_timer.cancel()
+                self.__computation_timer = None
 
         # close hardware source related stuff
         self.__hardware_source_added_event_listener.close()
@@ -1330,6 +1921,9 @@ class DocumentModel(Observable.Observable, ReferenceCounting.ReferenceCounted, P
             data_item.about_to_be_removed()
             data_item.close()
         self.storage_cache.close()
+        # write anything still pending; writes after this point are performed immediately.
+        if self.__persistent_storage_writer:
+            self.__persistent_storage_writer.close()
 
     def __call_soon(self, fn):
         self.call_soon_event.fire_any(fn)
@@ -1566,8 +2160,11 @@ class DocumentModel(Observable.Observable, ReferenceCounting.ReferenceCounted, P
 
     def __computation_needs_update(self, data_item):
         with self.__computation_queue_lock:
+            self.__computation_statistics["requested"] += 1
             for computation_queue_item in self.__computation_pending_queue:
                 if computation_queue_item.data_item == data_item:
+                    # coalesce with the pending request; it has not started and will see the latest inputs.
+                    self.__computation_statistics["coalesced"] += 1
                     return
             computation_queue_item = ComputationQueueItem(data_item)
             self.__computation_pending_queue.append(computation_queue_item)
@@ -1889,45 +2486,150 @@ class DocumentModel(Observable.Observable, ReferenceCounting.ReferenceCounted, P
 
     def start_dispatcher(self):
         self.__thread_pool.start()
-        self.__computation_thread_pool.start(1)
+        self.__computation_thread_pool.start(max(DocumentModel.computation_thread_count, 1))
+        # computation periods only apply to the dispatcher; recompute_all and recompute_one evaluate immediately.
+        self.__computation_rate_control = True
+
+    def __get_upstream_data_items(self, data_item: DataItem.DataItem) -> typing.Set[DataItem.DataItem]:
+        # return all data items from which data_item is computed, directly or indirectly.
+        upstream_data_items = set()
+        with self.__dependency_tree_lock:
+            items = list(self.__dependency_tree_target_to_source_map.get(weakref.ref(data_item), list()))
+            while items:
+                item = items.pop()
+                if isinstance(item, DataItem.DataItem) and item not in upstream_data_items and item != data_item:
+                    upstream_data_items.add(item)
+                    items.extend(self.__dependency_tree_target_to_source_map.get(weakref.ref(item), list()))
+        return upstream_data_items
+
+    def __is_computation_queue_item_ready(self, computation_queue_item: ComputationQueueItem) -> bool:
+        # an item is ready if its data item is not already being computed and none of the data items it depends
+        # upon, directly or indirectly, are pending, being computed, or waiting for their results to be merged. this
+        # evaluates the dirty part of the dependency graph in topological order so that each target is computed once
+        # from its final inputs. call with the computation queue lock held.
+        busy_data_items = [item.data_item for item in self.__computation_active_items]
+        if computation_queue_item.data_item in busy_data_items:
+            return False
+        busy_data_items.extend(item.data_item for item in self.__computation_merging_items)
+        busy_data_items.extend(item.data_item for item in self.__computation_pending_queue if item is not computation_queue_item)
+        upstream_data_items = self.__get_upstream_data_items(computation_queue_item.data_item)
+        return not any(data_item in upstream_data_items for data_item in busy_data_items)
+
+    def get_computation_period(self, computation: Symbolic.Computation) -> float:
+        """Return the minimum time between the end of one evaluation of the computation and the start of the next.
+
+        The period is the longest of the document minimum period, the period of the computation target rate, and,
+        if computation_max_load is set, a period proportional to the measured evaluation cost of the computation.
+        """
+        period = DocumentModel.computation_min_period
+        if computation.target_rate:
+            period = max(period, 1.0 / computation.target_rate)
+        if DocumentModel.computation_max_load:
+            # slow computations are evaluated less often so that they leave time for the others.
+            period = max(period, computation.evaluation_cost * (1.0 / DocumentModel.computation_max_load - 1.0))
+        return period
+
+    def __get_computation_queue_item_due_time(self, computation_queue_item: ComputationQueueItem) -> float:
+        computation = computation_queue_item.data_item.computation
+        if self.__computation_rate_control and computation and computation.last_evaluate_data_time:
+            return computation.last_evaluate_data_time + self.get_computation_period(computation)
+        return 0.0
 
     def __recompute(self):
         computation_queue_item = None
-        skipped_pending = False
         with self.__computation_queue_lock:
-            # loop through the items in the pending queue
+            # find the first item in the pending queue that can be computed now. items are computed concurrently by
+            # the computation thread pool; items for the same data item are serialized and items are computed after
+            # the items they depend upon. items evaluated more recently than their period stay pending, absorbing
+            # further requests, until they are due.
+            current_time = time.perf_counter()
+            due_time = None
             for i, _computation_queue_item in enumerate(self.__computation_pending_queue):
-                # first check to see if the item in the pending queue matches an item in the active list
-                match = None
-                for active_computation_item in self.__computation_active_items:
-                    if _computation_queue_item.data_item == active_computation_item.data_item:
-                        match = _computation_queue_item
+                if self.__is_computation_queue_item_ready(_computation_queue_item):
+                    item_due_time = self.__get_computation_queue_item_due_time(_computation_queue_item)
+                    if item_due_time <= current_time:
+                        computation_queue_item = self.__computation_pending_queue.pop(i)
                         break
-                # if it doesn't match, move it to active, and break out of this loop
-                # other items in the queue will be serviced by future calls to __recompute.
-                # there is one __recompute for each item put into the pending queue.
-                if not match:
-                    computation_queue_item = self.__computation_pending_queue.pop(i)
-                    self.__computation_active_items.append(computation_queue_item)
-                    break
-                # otherwise, mark it as skipped so that __recompute is called again.
-                # so that it eventually gets serviced.
-                else:
-                    skipped_pending = True
+                    due_time = min(due_time, item_due_time) if due_time is not None else item_due_time
+            # if nothing is ready and nothing is active, the dependencies are circular; compute the first due item.
+            if not computation_queue_item and due_time is None and not self.__computation_active_items and not self.__computation_merging_items:
+                for i, _computation_queue_item in enumerate(self.__computation_pending_queue):
+                    item_due_time = self.__get_computation_queue_item_due_time(_computation_queue_item)
+                    if item_due_time <= current_time:
+                        computation_queue_item = self.__computation_pending_queue.pop(i)
+                        break
+                    due_time = min(due_time, item_due_time) if due_time is not None else item_due_time
+            if computation_queue_item:
+                self.__computation_active_items.append(computation_queue_item)
+            elif self.__computation_pending_queue:
+                # there is one __recompute for each item put into the pending queue. defer this one until an active
+                # item finishes or a pending item is due rather than spinning or sleeping on the thread pool.
+                self.__computation_deferred_count += 1
+                if due_time is not None:
+                    self.__computation_statistics["throttled"] += 1
+                    self.__schedule_computation_timer(due_time)
 
         if computation_queue_item:
             # an item was put into the active queue, so compute it, then merge
-            pending_data_item_merges = computation_queue_item.recompute()
-            with self.__pending_data_item_merges_lock:
-                self.__pending_data_item_merges.extend(pending_data_item_merges)
-            self.__call_soon(self.perform_data_item_merges)
-            # it is now merged, so remove it from the active queue
+            pending_data_item_merges = list(computation_queue_item.recompute())
+            # it is now computed, so move it from the active queue to the merging queue. dependents wait until it is
+            # merged on the main thread so that they see its result.
             with self.__computation_queue_lock:
-                self.__computation_active_items.remove(computation_queue_item)
+                if computation_queue_item.evaluated:
+                    self.__computation_statistics["evaluated"] += 1
+                if computation_queue_item in self.__computation_active_items:
+                    self.__computation_active_items.remove(computation_queue_item)
+                    if pending_data_item_merges:
+                        self.__computation_merging_items.append(computation_queue_item)
+            if pending_data_item_merges:
+                pending_data_item_merges.append(functools.partial(self.__computation_merged, computation_queue_item))
+                with self.__pending_data_item_merges_lock:
+                    self.__pending_data_item_merges.extend(pending_data_item_merges)
+                self.__call_soon(self.perform_data_item_merges)
+            else:
+                self.__computation_merged(computation_queue_item)
 
-        if skipped_pending:
+    def __computation_merged(self, computation_queue_item: ComputationQueueItem) -> None:
+        # release any computations deferred while this item was being computed or merged
+        with self.__computation_queue_lock:
+            if computation_queue_item in self.__computation_merging_items:
+                self.__computation_merging_items.remove(computation_queue_item)
+        self.__release_deferred_computations()
+
+    def __release_deferred_computations(self) -> None:
+        with self.__computation_queue_lock:
+            deferred_count = self.__computation_deferred_count
+            self.__computation_deferred_count = 0
+        for _ in range(deferred_count):
             self.dispatch_task2(self.__recompute)
 
+    def __schedule_computation_timer(self, due_time: float) -> None:
+        # call with the computation queue lock held. keeps a single timer for the earliest due time.
+        if self.__computation_timer and self.__computation_timer_time <= due_time:
+            return
+        if self.__computation_timer:
+            self.__computation_timer.cancel()
+
+        def computation_timer_fired():
+            with self.__computation_queue_lock:
+                self.__computation_timer = None
+            self.__release_deferred_computations()
+
+        self.__computation_timer = threading.Timer(max(due_time - time.perf_counter(), 0.0), computation_timer_fired)
+        self.__computation_timer.daemon = True
+        self.__computation_timer_time = due_time
+        self.__computation_timer.start()
+
+    @property
+    def computation_statistics(self) -> typing.Mapping[str, int]:
+        """Return counts of computation requests, requests coalesced into pending ones, evaluations performed, and
+        times a pending computation was held back by its period.
+
+        The difference between requested and evaluated is the number of redundant evaluations avoided.
+        """
+        with self.__computation_queue_lock:
+            return copy.copy(self.__computation_statistics)
+
     def perform_data_item_merges(self):
         with self.__pending_data_item_merges_lock:
             pending_data_item_merges = self.__pending_data_item_merges
@@ -1953,6 +2655,8 @@ class DocumentModel(Observable.Observable, ReferenceCounting.ReferenceCounted, P
 
     def get_graphic_by_uuid(self, object_uuid: uuid.UUID) -> typing.Optional[Graphics.Graphic]:
         for data_item in self.data_items:
+            if isinstance(data_item, DataItem.DataItem) and not data_item.may_contain_object(object_uuid):
+                continue
             for display in data_item.displays:
                 for graphic in display.graphics:
                     if graphic.uuid == object_uuid:
@@ -2100,36 +2804,70 @@ class DocumentModel(Observable.Observable, ReferenceCounting.ReferenceCounted, P
                     self.__pending_starts = 0
                     self.data_item_changed_event.fire()
 
-    def __queue_data_item_update(self, data_item, data_and_metadata):
+    def __queue_data_item_update(self, data_item, data_and_metadata, sub_area=None, statistics=None, data_channel=None):
         # put the data update to data_item into the pending_data_item_updates list.
         # the pending_data_item_updates will be serviced when the main thread calls
-        # perform_data_item_updates.
+        # perform_data_item_updates. sub_area, if not None, is the only area that changed
+        # since the previous update. statistics, if not None, receives the latencies of
+        # the update and counts of merged and dropped updates. data_channel, if not None,
+        # is the channel which published the data; frames which are dropped or replaced
+        # are released back to it so that their buffers can be reused.
         if data_item:
             with self.__pending_data_item_updates_lock:
+                if statistics:
+                    if data_item in self.__pending_data_item_statistics:
+                        statistics.add_count("merged")
+                        # the wait is measured from the first of the merged updates.
+                        queue_time = self.__pending_data_item_statistics[data_item][1]
+                    else:
+                        queue_time = time.perf_counter()
+                    self.__pending_data_item_statistics[data_item] = statistics, queue_time
+                replaced_data_channel = self.__pending_data_item_data_channels.pop(data_item, None)
+                if data_channel:
+                    self.__pending_data_item_data_channels[data_item] = data_channel
                 found = False
+                replaced_data_and_metadata = None
                 pending_data_item_updates = list()
                 for data_item_ in self.__pending_data_item_updates:
                     # does it match? if so and not yet found, put the new data into the matching
                     # slot; but then filter the rest of the matches.
                     if data_item_ == data_item:
                         if not found:
-                            data_item.set_pending_xdata(data_and_metadata)
+                            replaced_data_and_metadata = data_item.set_pending_xdata(data_and_metadata, sub_area)
                             pending_data_item_updates.append(data_item)
                             found = True
                     else:
                         pending_data_item_updates.append(data_item_)
                 if not found:  # if not added yet, add it
-                    data_item.set_pending_xdata(data_and_metadata)
+                    replaced_data_and_metadata = data_item.set_pending_xdata(data_and_metadata, sub_area)
                     pending_data_item_updates.append(data_item)
                 self.__pending_data_item_updates = pending_data_item_updates
+            # the replaced data never reached the data item, so nothing else refers to it.
+            if replaced_data_and_metadata and replaced_data_channel:
+                replaced_data_channel.release_data(replaced_data_and_metadata)
+        else:
+            if statistics:
+                statistics.add_count("dropped")
+            if data_channel:
+                data_channel.release_data(data_and_metadata)
 
     def perform_data_item_updates(self):
         assert threading.current_thread() == threading.main_thread()
         with self.__pending_data_item_updates_lock:
             pending_data_item_updates = self.__pending_data_item_updates
             self.__pending_data_item_updates = list()
+            pending_data_item_statistics = self.__pending_data_item_statistics
+            self.__pending_data_item_statistics = dict()
+            # frames given to data items are never released; anything which reads a data item may keep its data.
+            self.__pending_data_item_data_channels = dict()
         for data_item in pending_data_item_updates:
-            data_item.update_to_pending_xdata()
+            statistics, queue_time = pending_data_item_statistics.get(data_item, (None, None))
+            if statistics:
+                statistics.add_latency("wait", time.perf_counter() - queue_time)
+                with statistics.measure("apply"), PipelineStatistics.activate(statistics):
+                    data_item.update_to_pending_xdata()
+            else:
+                data_item.update_to_pending_xdata()
 
     # for testing
     def _get_pending_data_item_updates_count(self):
@@ -2220,7 +2958,8 @@ class DocumentModel(Observable.Observable, ReferenceCounting.ReferenceCounted, P
 
     def __data_channel_updated(self, hardware_source, data_channel, data_and_metadata):
         data_item_reference = self.__construct_data_item_reference(hardware_source, data_channel)
-        self.__queue_data_item_update(data_item_reference.data_item, data_and_metadata)
+        with data_channel.statistics.measure("queue"):
+            self.__queue_data_item_update(data_item_reference.data_item, data_and_metadata, data_channel.updated_sub_area, data_channel.statistics, data_channel)
 
     def __data_channel_states_updated(self, hardware_source, data_channels):
         data_item_states = list()
@@ -0,0 +1,241 @@
+"""
+Fourier transforms and correlations of 2d data, computed in cached workspaces.
+
+The results are the same as from Core.function_fft, Core.function_ifft, Core.function_autocorrelate, and
+Core.function_crosscorrelate. Those make a copy of the data, transform it, scale it, and shift it, allocating several
+arrays the size of the data for each frame. Here the data is copied into a workspace which is kept for each shape and
+dtype, transformed, and shifted into the result, so that live data allocates only the result, and the transform if it
+cannot be done in place, for each frame. Correlations also allocate the half size spectra of the real transforms.
+
+The dtype and calibrations of the transforms are taken from transforms of small data made by Core.
+
+Facade.initialize dispatches xd.fft, xd.ifft, xd.autocorrelate, and xd.crosscorrelate of the data api to these.
+
+The transforms run in place on several threads with scipy.fft when it is available (scipy 1.4 and later) and more
+than one thread is allowed, and with numpy.fft otherwise. Both cache their plans for each size internally.
+"""
+
+# standard libraries
+import collections
+import contextlib
+import os
+import threading
+import typing
+
+# third party libraries
+import numpy
+
+# local libraries
+from nion.data import Calibration
+from nion.data import Core
+from nion.data import DataAndMetadata
+from nion.data import Image
+
+try:
+    import scipy.fft as scipy_fft
+except ImportError:
+    scipy_fft = None
+
+# the number of threads used for each transform.
+thread_count = min(max(os.cpu_count() or 1, 1), 8)
+
+# the number of workspaces kept in the cache.
+cache_size = 4
+
+
+def _roll_into(source: numpy.ndarray, target: numpy.ndarray, shifts: typing.Tuple[int, int]) -> None:
+    # the same as target[...] = numpy.roll(source, shifts, (0, 1)) without the temporary arrays.
+    height, width = source.shape
+    shift_y, shift_x = shifts
+    for target_y, source_y in ((slice(shift_y, None), slice(0, height - shift_y)), (slice(0, shift_y), slice(height - shift_y, None))):
+        for target_x, source_x in ((slice(shift_x, None), slice(0, width - shift_x)), (slice(0, shift_x), slice(width - shift_x, None))):
+            target[target_y, target_x] = source[source_y, source_x]
+
+
+def _is_transform_in_place() -> bool:
+    # scipy.fft transforms in place on several threads; numpy.fft is faster on one thread but returns a new array.
+    return scipy_fft is not None and thread_count > 1
+
+
+def _transform(buffer: numpy.ndarray, forward: bool) -> numpy.ndarray:
+    # transform the buffer in place if possible and return the transform, which may be a new array. overwrite_x is
+    # only a hint to scipy.fft, so always use the returned array.
+    if _is_transform_in_place():
+        if forward:
+            return scipy_fft.fft2(buffer, norm="ortho", overwrite_x=True, workers=thread_count)
+        return scipy_fft.ifft2(buffer, norm="ortho", overwrite_x=True, workers=thread_count)
+    if forward:
+        return numpy.fft.fft2(buffer, norm="ortho")
+    return numpy.fft.ifft2(buffer, norm="ortho")
+
+
+def _real_transform(data: numpy.ndarray, forward: bool) -> numpy.ndarray:
+    # the transforms of real data are never in place since the spectrum has a different shape and dtype.
+    if _is_transform_in_place():
+        if forward:
+            return scipy_fft.rfft2(data, workers=thread_count)
+        return scipy_fft.irfft2(data, workers=thread_count)
+    if forward:
+        return numpy.fft.rfft2(data)
+    return numpy.fft.irfft2(data)
+
+
+class FourierTransformWorkspace:
+    """The buffer used to transform 2d data with a shape and dtype.
+
+    The dtype is complex for the forward and inverse transforms and float64 for correlations, which use the buffer for
+    the normalized data.
+
+    The buffer is used by one transform at a time; transforms on other threads while it is in use allocate their own.
+    """
+
+    def __init__(self, data_shape: typing.Tuple[int, int], dtype: numpy.dtype):
+        self.data_shape = data_shape
+        self.dtype = dtype
+        self.__buffer = None  # type: typing.Optional[numpy.ndarray]
+        self.__lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def __get_buffer(self):
+        if self.__lock.acquire(blocking=False):
+            try:
+                if self.__buffer is None:
+                    self.__buffer = numpy.empty(self.data_shape, self.dtype)
+                yield self.__buffer
+            finally:
+                self.__lock.release()
+        else:
+            yield numpy.empty(self.data_shape, self.dtype)
+
+    def fft(self, data: numpy.ndarray) -> numpy.ndarray:
+        """Return the shifted forward transform of data, scaled to keep the root mean square the same."""
+        with self.__get_buffer() as buffer:
+            buffer[...] = data
+            transformed = _transform(buffer, True)
+            # numpy.fft returns the transform in column major order; keep the order so the shift copies sequentially.
+            result = numpy.empty_like(transformed, self.dtype)
+            _roll_into(transformed, result, (self.data_shape[0] // 2, self.data_shape[1] // 2))
+        return result
+
+    def ifft(self, data: numpy.ndarray) -> numpy.ndarray:
+        """Return the inverse transform of the shifted data, scaled to keep the root mean square the same."""
+        shifts = (self.data_shape[0] + 1) // 2, (self.data_shape[1] + 1) // 2
+        if _is_transform_in_place():
+            # the result is its own workspace: the data is shifted into it and transformed, usually in place.
+            result = numpy.empty(self.data_shape, self.dtype)
+            _roll_into(data, result, shifts)
+            return _transform(result, False)
+        with self.__get_buffer() as buffer:
+            _roll_into(data, buffer, shifts)
+            return _transform(buffer, False).astype(self.dtype, copy=False)
+
+    def __normalized_spectrum(self, data: numpy.ndarray) -> numpy.ndarray:
+        # return the spectrum of the data normalized to a mean of zero and a standard deviation of one.
+        with self.__get_buffer() as buffer:
+            data_std = data.std(dtype=numpy.float64)
+            if data_std != 0.0:
+                numpy.subtract(data, data.mean(dtype=numpy.float64), out=buffer)
+                buffer /= data_std
+            else:
+                buffer[...] = data
+            return _real_transform(buffer, True)
+
+    def __correlation(self, spectrum: numpy.ndarray) -> numpy.ndarray:
+        # return the shifted, scaled inverse transform of the correlation spectrum.
+        correlation = _real_transform(spectrum, False)
+        result = numpy.empty_like(correlation)
+        _roll_into(correlation, result, (correlation.shape[0] // 2, correlation.shape[1] // 2))
+        result *= 1.0 / (self.data_shape[0] * self.data_shape[1])
+        return result
+
+    def autocorrelate(self, data: numpy.ndarray) -> numpy.ndarray:
+        """Return the autocorrelation of the normalized data."""
+        spectrum = self.__normalized_spectrum(data)
+        numpy.multiply(spectrum, numpy.conjugate(spectrum), out=spectrum)
+        return self.__correlation(spectrum)
+
+    def crosscorrelate(self, data1: numpy.ndarray, data2: numpy.ndarray) -> numpy.ndarray:
+        """Return the cross correlation of the normalized data."""
+        spectrum = self.__normalized_spectrum(data1)
+        spectrum2 = self.__normalized_spectrum(data2)
+        numpy.multiply(spectrum, numpy.conjugate(spectrum2, out=spectrum2), out=spectrum)
+        return self.__correlation(spectrum)
+
+
+_workspaces = collections.OrderedDict()  # type: typing.MutableMapping[typing.Tuple, FourierTransformWorkspace]
+_workspaces_lock = threading.RLock()
+
+
+def get_workspace(data_shape: typing.Tuple[int, int], dtype: numpy.dtype) -> FourierTransformWorkspace:
+    """Return the workspace for the data shape and dtype, using the cache if possible. Thread safe."""
+    key = tuple(data_shape), numpy.dtype(dtype)
+    with _workspaces_lock:
+        workspace = _workspaces.get(key)
+        if workspace is None:
+            workspace = FourierTransformWorkspace(*key)
+            _workspaces[key] = workspace
+            while len(_workspaces) > cache_size:
+                _workspaces.popitem(last=False)
+        else:
+            _workspaces.move_to_end(key)
+        return workspace
+
+
+def _get_core_transform_metadata(core_function: typing.Callable, data_and_metadata: DataAndMetadata.DataAndMetadata) -> typing.Tuple[numpy.dtype, Calibration.Calibration, typing.List[Calibration.Calibration]]:
+    # Core takes the dtype of a transform from the dtype of the data and the calibration of each axis from the length
+    # and calibration of that axis alone. return the dtype and intensity calibration of the transform Core makes of 2x2
+    # zeros with the dtype of the data, and the calibrations of the transforms Core makes of zeros with the length and
+    # calibration of each axis.
+    square_xdata = core_function(DataAndMetadata.new_data_and_metadata(numpy.zeros((2, 2), data_and_metadata.data_dtype)))
+    dimensional_calibrations = list()
+    for data_shape_n, dimensional_calibration in zip(data_and_metadata.data_shape, data_and_metadata.dimensional_calibrations):
+        axis_xdata = core_function(DataAndMetadata.new_data_and_metadata(numpy.zeros((data_shape_n, )), dimensional_calibrations=[dimensional_calibration]))
+        dimensional_calibrations.append(axis_xdata.dimensional_calibrations[0])
+    return square_xdata.data_dtype, square_xdata.intensity_calibration, dimensional_calibrations
+
+
+def fft(data_and_metadata: DataAndMetadata.DataAndMetadata) -> typing.Optional[DataAndMetadata.DataAndMetadata]:
+    """Return the forward transform of the data. The same as Core.function_fft."""
+    data = data_and_metadata.data if data_and_metadata else None
+    if data is None or not Image.is_data_valid(data) or not Image.is_data_2d(data) or Image.is_data_rgb_type(data):
+        return Core.function_fft(data_and_metadata)
+    if data_and_metadata.dimensional_calibrations is None:
+        return None
+    dtype, intensity_calibration, dimensional_calibrations = _get_core_transform_metadata(Core.function_fft, data_and_metadata)
+    result_data = get_workspace(data.shape, dtype).fft(data)
+    return DataAndMetadata.new_data_and_metadata(result_data, intensity_calibration, dimensional_calibrations)
+
+
+def ifft(data_and_metadata: DataAndMetadata.DataAndMetadata) -> typing.Optional[DataAndMetadata.DataAndMetadata]:
+    """Return the inverse transform of the data. The same as Core.function_ifft."""
+    data = data_and_metadata.data if data_and_metadata else None
+    if data is None or not Image.is_data_valid(data) or not Image.is_data_2d(data) or Image.is_data_rgb_type(data):
+        return Core.function_ifft(data_and_metadata)
+    if data_and_metadata.dimensional_calibrations is None:
+        return None
+    dtype, intensity_calibration, dimensional_calibrations = _get_core_transform_metadata(Core.function_ifft, data_and_metadata)
+    result_data = get_workspace(data.shape, dtype).ifft(data)
+    return DataAndMetadata.new_data_and_metadata(result_data, intensity_calibration, dimensional_calibrations)
+
+
+def _is_real_2d_data(data: numpy.ndarray) -> bool:
+    return data is not None and Image.is_data_valid(data) and Image.is_data_2d(data) and not Image.is_data_rgb_type(data) and not numpy.iscomplexobj(data)
+
+
+def autocorrelate(data_and_metadata: DataAndMetadata.DataAndMetadata) -> typing.Optional[DataAndMetadata.DataAndMetadata]:
+    """Return the autocorrelation of the data. The same as Core.function_autocorrelate."""
+    data = data_and_metadata.data if data_and_metadata else None
+    if not _is_real_2d_data(data):
+        return Core.function_autocorrelate(data_and_metadata)
+    result_data = get_workspace(data.shape, numpy.float64).autocorrelate(data)
+    return DataAndMetadata.new_data_and_metadata(result_data, Calibration.Calibration(), data_and_metadata.dimensional_calibrations)
+
+
+def crosscorrelate(data_and_metadata1: DataAndMetadata.DataAndMetadata, data_and_metadata2: DataAndMetadata.DataAndMetadata) -> typing.Optional[DataAndMetadata.DataAndMetadata]:
+    """Return the cross correlation of the data. The same as Core.function_crosscorrelate."""
+    data1 = data_and_metadata1.data if data_and_metadata1 else None
+    data2 = data_and_metadata2.data if data_and_metadata2 else None
+    if not _is_real_2d_data(data1) or not _is_real_2d_data(data2) or data1.shape != data2.shape:
+        return Core.function_crosscorrelate(data_and_metadata1, data_and_metadata2)
+    result_data = get_workspace(data1.shape, numpy.float64).crosscorrelate(data1, data2)
+    return DataAndMetadata.new_data_and_metadata(result_data, Calibration.Calibration(), data_and_metadata1.dimensional_calibrations)
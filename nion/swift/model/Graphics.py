@@ -2,6 +2,7 @@
 import copy
 import gettext
 import math
+import threading
 import weakref
 
 # third party libraries
@@ -313,12 +314,16 @@ class Graphic(Observable.Observable, Persistence.PersistentObject):
         self.label_font = "normal 11px serif"
         self._about_to_be_removed = False
         self._closed = False
+        self.__mask_lock = threading.RLock()
+        self.__mask_cache = None  # tuple of mask key and mask
+        self.__mask_generation = 0  # incremented whenever a property which may change the mask changes
 
     def close(self):
         assert self._about_to_be_removed
         assert not self._closed
         self._closed = True
         self.__container_weak_ref = None
+        self.__mask_cache = None
 
     @property
     def container(self):
@@ -390,9 +395,52 @@ class Graphic(Observable.Observable, Persistence.PersistentObject):
             constraints.add("bounds")
         return constraints
 
-    def get_mask(self, data_shape: typing.Sequence[int]) -> numpy.ndarray:
+    @property
+    def _mask_key(self) -> typing.Any:
+        """Return a hashable description of the geometry which determines the mask, or None if it is not cached."""
+        return None
+
+    def _get_mask_extent(self, data_shape: typing.Tuple[int, ...]) -> typing.Optional[typing.Tuple[slice, ...]]:
+        """Return the slices outside of which the mask is zero, or None to always make the whole mask."""
+        return None
+
+    def _make_mask(self, data_shape: typing.Tuple[int, ...], mask_extent: typing.Optional[typing.Tuple[slice, ...]]) -> numpy.ndarray:
+        """Return the mask, or the part of the mask within mask_extent if mask_extent is not None."""
         return numpy.zeros(data_shape)
 
+    def get_mask(self, data_shape: typing.Sequence[int]) -> numpy.ndarray:
+        """Return the mask of this graphic for data with data_shape.
+
+        Masks of graphics with a mask key are read only and are cached until the geometry of the graphic or the data
+        shape changes. A mask is cached only if no property changed while it was being made; otherwise it is returned
+        without being cached.
+
+        Cached masks are never updated in place, since callers may still hold them. Each change of geometry or data shape
+        allocates a new mask; graphics with a mask extent then make only the part of the mask within the extent.
+        """
+        data_shape = tuple(data_shape)
+        with self.__mask_lock:
+            mask_generation = self.__mask_generation
+            mask_key = self._mask_key
+            if mask_key is None:
+                return self._make_mask(data_shape, None)
+            mask_key = data_shape, mask_key
+            mask_cache = self.__mask_cache
+            if mask_cache is not None and mask_cache[0] == mask_key:
+                return mask_cache[1]
+            mask_extent = self._get_mask_extent(data_shape)
+        # make the mask outside of the lock so that property changes are not held up by it.
+        if mask_extent is not None:
+            mask = numpy.zeros(data_shape)
+            mask[mask_extent] = self._make_mask(data_shape, mask_extent)
+        else:
+            mask = self._make_mask(data_shape, None)
+        mask.flags.writeable = False
+        with self.__mask_lock:
+            if self.__mask_generation == mask_generation:
+                self.__mask_cache = mask_key, mask
+        return mask
+
     # test whether points are close
     def test_point(self, p1, p2, radius):
         return math.sqrt(pow(p1[0] - p2[0], 2) + pow(p1[1] - p2[1], 2)) < radius
@@ -488,6 +536,9 @@ class Graphic(Observable.Observable, Persistence.PersistentObject):
                 ctx.fill_text(self.label, text_pos.x, text_pos.y)
 
     def notify_property_changed(self, key):
+        with self.__mask_lock:
+            self.__mask_generation += 1
+            self.__mask_cache = None
         super().notify_property_changed(key)
         self.graphic_changed_event.fire()
 
@@ -561,12 +612,24 @@ class RectangleTypeGraphic(Graphic):
         self.center = bounds[0][0] + bounds[1][0] * 0.5, bounds[0][1] + bounds[1][1] * 0.5
         self.size = bounds[1]
 
-    def get_mask(self, data_shape: typing.Sequence[int]) -> numpy.ndarray:
+    @property
+    def _mask_key(self) -> typing.Any:
+        return self.bounds
+
+    def _get_bounds_int(self, data_shape: typing.Sequence[int]) -> typing.Tuple[typing.Tuple[int, int], typing.Tuple[int, int]]:
+        return ((int(data_shape[0] * self.bounds[0][0]), int(data_shape[1] * self.bounds[0][1])),
+                (int(data_shape[0] * self.bounds[1][0]), int(data_shape[1] * self.bounds[1][1])))
+
+    def _get_mask_extent(self, data_shape: typing.Tuple[int, ...]) -> typing.Optional[typing.Tuple[slice, ...]]:
+        bounds_int = self._get_bounds_int(data_shape)
+        return (slice(bounds_int[0][0], bounds_int[0][0] + bounds_int[1][0] + 1),
+                slice(bounds_int[0][1], bounds_int[0][1] + bounds_int[1][1] + 1))
+
+    def _make_mask(self, data_shape: typing.Tuple[int, ...], mask_extent: typing.Optional[typing.Tuple[slice, ...]]) -> numpy.ndarray:
+        if mask_extent is not None:
+            return numpy.ones(1)
         mask = numpy.zeros(data_shape)
-        bounds_int = ((int(data_shape[0] * self.bounds[0][0]), int(data_shape[1] * self.bounds[0][1])),
-                      (int(data_shape[0] * self.bounds[1][0]), int(data_shape[1] * self.bounds[1][1])))
-        mask[bounds_int[0][0]:bounds_int[0][0] + bounds_int[1][0] + 1,
-             bounds_int[0][1]:bounds_int[0][1] + bounds_int[1][1] + 1] = 1
+        mask[self._get_mask_extent(data_shape)] = 1
         return mask
 
     # test point hit
@@ -688,13 +751,22 @@ class EllipseGraphic(RectangleTypeGraphic):
     def __init__(self):
         super().__init__("ellipse-graphic", _("Ellipse"))
 
-    def get_mask(self, data_shape: typing.Sequence[int]) -> numpy.ndarray:
-        mask = numpy.zeros(data_shape)
-        bounds_int = ((int(data_shape[0] * self.bounds[0][0]), int(data_shape[1] * self.bounds[0][1])),
-                      (int(data_shape[0] * self.bounds[1][0]), int(data_shape[1] * self.bounds[1][1])))
+    def _get_mask_extent(self, data_shape: typing.Tuple[int, ...]) -> typing.Optional[typing.Tuple[slice, ...]]:
+        # the rows and columns of the bounding box of the ellipse which are within the data
+        bounds_int = self._get_bounds_int(data_shape)
         a, b = bounds_int[0][0] + bounds_int[1][0] * 0.5, bounds_int[0][1] + bounds_int[1][1] * 0.5
-        y, x = numpy.ogrid[-a:data_shape[0] - a, -b:data_shape[1] - b]
+        top, bottom = max(int(math.floor(a - bounds_int[1][0] * 0.5)), 0), min(int(math.ceil(a + bounds_int[1][0] * 0.5)) + 1, data_shape[0])
+        left, right = max(int(math.floor(b - bounds_int[1][1] * 0.5)), 0), min(int(math.ceil(b + bounds_int[1][1] * 0.5)) + 1, data_shape[1])
+        return slice(top, max(top, bottom)), slice(left, max(left, right))
+
+    def _make_mask(self, data_shape: typing.Tuple[int, ...], mask_extent: typing.Optional[typing.Tuple[slice, ...]]) -> numpy.ndarray:
+        if mask_extent is None:
+            mask_extent = slice(0, data_shape[0]), slice(0, data_shape[1])
+        bounds_int = self._get_bounds_int(data_shape)
+        a, b = bounds_int[0][0] + bounds_int[1][0] * 0.5, bounds_int[0][1] + bounds_int[1][1] * 0.5
+        y, x = numpy.ogrid[mask_extent[0].start - a:mask_extent[0].stop - a, mask_extent[1].start - b:mask_extent[1].stop - b]
         mask_eq = x*x / ((bounds_int[1][1] / 2) * (bounds_int[1][1] / 2)) + y*y / ((bounds_int[1][0] / 2) * (bounds_int[1][0] / 2)) <= 1
+        mask = numpy.zeros(mask_eq.shape)
         mask[mask_eq] = 1
         return mask
 
@@ -1377,7 +1449,11 @@ class SpotGraphic(Graphic):
         self.center = bounds[0][0] + bounds[1][0] * 0.5, bounds[0][1] + bounds[1][1] * 0.5
         self.size = bounds[1]
 
-    def get_mask(self, data_shape: typing.Sequence[int]) -> numpy.ndarray:
+    @property
+    def _mask_key(self) -> typing.Any:
+        return self.bounds
+
+    def _make_mask(self, data_shape: typing.Tuple[int, ...], mask_extent: typing.Optional[typing.Tuple[slice, ...]]) -> numpy.ndarray:
         mask = numpy.zeros(data_shape)
         bounds_int = ((int(data_shape[0] * self.bounds[0][0]), int(data_shape[1] * self.bounds[0][1])),
                       (int(data_shape[0] * self.bounds[1][0]), int(data_shape[1] * self.bounds[1][1])))
@@ -1676,7 +1752,11 @@ class WedgeGraphic(Graphic):
             self.__inverted_drag = not self.__inverted_drag
         return None, None
 
-    def get_mask(self, data_shape: typing.Sequence[int]) -> numpy.ndarray:
+    @property
+    def _mask_key(self) -> typing.Any:
+        return self.angle_interval
+
+    def _make_mask(self, data_shape: typing.Tuple[int, ...], mask_extent: typing.Optional[typing.Tuple[slice, ...]]) -> numpy.ndarray:
         mask1 = numpy.zeros(data_shape)
         mask2 = numpy.zeros(data_shape)
         bounds_int = ((0, 0), (int(data_shape[0]), int(data_shape[1])))
@@ -1812,7 +1892,11 @@ class RingGraphic(Graphic):
             self.radius_2 = radius
         return None, None
 
-    def get_mask(self, data_shape: typing.Tuple[int]):
+    @property
+    def _mask_key(self) -> typing.Any:
+        return self.radius_1, self.radius_2, self.mode
+
+    def _make_mask(self, data_shape: typing.Tuple[int, ...], mask_extent: typing.Optional[typing.Tuple[slice, ...]]) -> numpy.ndarray:
         mask = numpy.zeros(data_shape, dtype=numpy.float)
         bounds_int = ((0, 0), (int(data_shape[0]), int(data_shape[1])))
         a, b = bounds_int[0][0] + bounds_int[1][0] * 0.5, bounds_int[0][1] + bounds_int[1][1] * 0.5
@@ -4,6 +4,7 @@
 
 import io
 import json
+import logging
 import os
 import threading
 
@@ -25,19 +26,63 @@ def make_directory_if_needed(directory_path):
         os.makedirs(directory_path)
 
 
+def get_chunk_shape(shape, itemsize, is_sequence=False, collection_dimension_count=None, max_chunk_bytes=1024 * 1024):
+    """
+        Return the chunk shape for data with the shape, item size and data descriptor.
+
+        Each chunk holds at most one frame of a sequence and one row of a collection so that writing a frame
+        or a scan row only writes the chunks it touches. Chunks are split further until they are no larger
+        than max_chunk_bytes.
+    """
+    if collection_dimension_count is None:
+        collection_dimension_count = 2 if len(shape) == 3 and not is_sequence else 0
+    chunk_shape = list(shape)
+    index = 0
+    if is_sequence and index < len(chunk_shape):
+        chunk_shape[index] = 1
+        index += 1
+    if collection_dimension_count > 0 and index < len(chunk_shape):
+        chunk_shape[index] = 1
+    while numpy.prod(chunk_shape) * itemsize > max_chunk_bytes:
+        largest_index = int(numpy.argmax(chunk_shape))
+        chunk_shape[largest_index] = (chunk_shape[largest_index] + 1) // 2
+    return tuple(max(chunk_length, 1) for chunk_length in chunk_shape)
+
+
 class HDF5Handler:
+    """
+        A handler object for h5 files, used for large format data items.
+
+        Data is stored in a chunked dataset (see get_chunk_shape) so that partial reads and region writes only
+        touch the affected chunks. Set compression (and compression_opts) to an h5py lossless filter such as
+        "gzip" or "lzf" to compress new datasets.
+
+        :param file_path: The path of the h5 file
+        :param properties: Optional properties already read from the file, returned by the first read_properties
+
+        on_write, if set, is called with the file path after each change to the file.
+    """
 
-    def __init__(self, file_path):
+    compression = None
+    compression_opts = None
+
+    def __init__(self, file_path, properties=None):
         self.__file_path = str(file_path)
         self.__lock = threading.RLock()
         self.__fp = None
         self.__dataset = None
+        self.__properties = properties  # properties read when the file was found; returned by the first read_properties
+        self.on_write = None
 
     def close(self):
         if self.__fp:
             self.__fp.close()
             self.__fp = None
 
+    def __notify_write(self):
+        if callable(self.on_write):
+            self.on_write(self.__file_path)
+
     @property
     def reference(self):
         return self.__file_path
@@ -52,6 +97,19 @@ class HDF5Handler:
             return True
         return False
 
+    @classmethod
+    def read_properties_if_matching(cls, file_path):
+        if cls.is_matching(file_path):
+            try:
+                with h5py.File(file_path, "r") as fp:
+                    dataset = fp.get("data")
+                    json_properties = dataset.attrs.get("properties", "") if dataset is not None else ""
+                return json.loads(json_properties) if json_properties else dict()
+            except Exception as e:
+                logging.error("Exception reading h5 file: %s", file_path)
+                logging.error(str(e))
+        return None
+
     @classmethod
     def make(cls, file_path):
         return cls(file_path + ".h5")
@@ -90,18 +148,30 @@ class HDF5Handler:
             else:
                 self.__dataset = self.__fp.create_dataset("data", data=numpy.empty((0,)))
 
+    def __create_dataset(self, data, json_properties):
+        # the data descriptor, if known, determines the chunk layout.
+        properties = json.loads(json_properties) if json_properties else dict()
+        data_source_properties = properties.get("data_source", dict())
+        is_sequence = data_source_properties.get("is_sequence", False)
+        collection_dimension_count = data_source_properties.get("collection_dimension_count")
+        if data.ndim > 0 and data.size > 0:
+            chunks = get_chunk_shape(data.shape, data.dtype.itemsize, is_sequence, collection_dimension_count)
+            return self.__fp.create_dataset("data", data=data, chunks=chunks, compression=self.compression, compression_opts=self.compression_opts)
+        return self.__fp.create_dataset("data", data=data)
+
     def write_data(self, data, file_datetime):
         with self.__lock:
             assert data is not None
+            self.__properties = None
             self.__ensure_open()
             json_properties = None
             # handle three cases:
-            #   1 - 'data' doesn't yet exist (require_dataset)
-            #   2 - 'data' exists but is a different size (delete, then require_dataset)
+            #   1 - 'data' doesn't yet exist (create)
+            #   2 - 'data' exists but is a different size (delete file to reclaim its space, then create)
             #   3 - 'data' exists and is the same size (overwrite)
             if not "data" in self.__fp:
                 # case 1
-                self.__dataset = self.__fp.require_dataset("data", shape=data.shape, dtype=data.dtype, data=data)
+                self.__dataset = self.__create_dataset(data, None)
             else:
                 self.__dataset = self.__fp["data"]
                 if self.__dataset.shape != data.shape or self.__dataset.dtype != data.dtype:
@@ -112,23 +182,97 @@ class HDF5Handler:
                     self.__fp = None
                     os.remove(self.__file_path)
                     self.__ensure_open()
-                    self.__dataset = self.__fp.require_dataset("data", shape=data.shape, dtype=data.dtype, data=data)
+                    self.__dataset = self.__create_dataset(data, json_properties)
                 else:
                     # case 3
                     self.__dataset[:] = data
             if json_properties is not None:
                 self.__dataset.attrs["properties"] = json_properties
             self.__fp.flush()
+            self.__notify_write()
+
+    def write_data_region(self, data, region, file_datetime):
+        """
+            Write the region of data, a tuple of slices, to the file.
+
+            Only the chunks touched by the region are written. Writes all of data if the stored data has a
+            different shape or dtype.
+        """
+        with self.__lock:
+            assert data is not None
+            self.__properties = None
+            self.__ensure_open()
+            dataset = self.__fp.get("data")
+            if dataset is None or dataset.shape != data.shape or dataset.dtype != data.dtype:
+                self.write_data(data, file_datetime)
+            else:
+                self.__dataset = dataset
+                self.__dataset[region] = data[region]
+                self.__fp.flush()
+                self.__notify_write()
+
+    def reserve_data(self, data_shape, data_dtype, file_datetime):
+        """
+            Reserve a sequence dataset with the shape and dtype, to be written frame by frame with write_data_frame.
+
+            The dataset is chunked by frame and can be resized along its first dimension; chunks are only allocated
+            in the file when they are written. Reserving the same frame shape and dtype again resizes the dataset,
+            keeping the frames already written.
+        """
+        with self.__lock:
+            self.__properties = None
+            self.__ensure_open()
+            data_shape = tuple(data_shape)
+            data_dtype = numpy.dtype(data_dtype)
+            dataset = self.__fp.get("data")
+            if dataset is not None and dataset.maxshape[0] is None and dataset.shape[1:] == data_shape[1:] and dataset.dtype == data_dtype:
+                dataset.resize(data_shape[0], axis=0)
+                self.__dataset = dataset
+            else:
+                json_properties = None
+                if dataset is not None:
+                    # delete the file to reclaim its space, then create
+                    json_properties = dataset.attrs.get("properties", "")
+                    self.__dataset = None
+                    self.__fp.close()
+                    self.__fp = None
+                    os.remove(self.__file_path)
+                    self.__ensure_open()
+                chunks = get_chunk_shape(data_shape, data_dtype.itemsize, is_sequence=True)
+                self.__dataset = self.__fp.create_dataset("data", shape=data_shape, dtype=data_dtype, maxshape=(None, ) + data_shape[1:], chunks=chunks, compression=self.compression, compression_opts=self.compression_opts)
+                if json_properties is not None:
+                    self.__dataset.attrs["properties"] = json_properties
+            self.__fp.flush()
+            self.__notify_write()
+
+    def write_data_frame(self, data, index, file_datetime):
+        """
+            Write data as the frame at index of the dataset reserved with reserve_data.
+
+            The file is flushed when the dataset is reserved again or closed, not after each frame.
+        """
+        with self.__lock:
+            assert data is not None
+            self.__properties = None
+            self.__ensure_open()
+            self.__dataset = self.__fp["data"]
+            self.__dataset[index] = data
+            self.__notify_write()
 
     def write_properties(self, properties, file_datetime):
         with self.__lock:
+            self.__properties = None
             self.__ensure_open()
             self.__ensure_dataset()
             self.__write_properties_to_dataset(properties)
             self.__fp.flush()
+            self.__notify_write()
 
     def read_properties(self):
         with self.__lock:
+            if self.__properties is not None:
+                properties, self.__properties = self.__properties, None
+                return properties
             self.__ensure_open()
             self.__ensure_dataset()
             json_properties = self.__dataset.attrs.get("properties", "")
@@ -143,6 +287,8 @@ class HDF5Handler:
             return self.__dataset
 
     def remove(self):
+        self.__properties = None
         self.close()
         if os.path.isfile(self.__file_path):
             os.remove(self.__file_path)
+        self.__notify_write()
@@ -11,6 +11,7 @@ This module also defines individual functions that can be used to collect data f
 """
 
 # system imports
+import collections
 import configparser
 import contextlib
 import copy
@@ -24,16 +25,19 @@ import time
 import typing
 import traceback
 import uuid
+import weakref
 
 # library imports
 import numpy
 
 # local imports
+from nion.data import Calibration
 from nion.data import Core
 from nion.data import DataAndMetadata
 from nion.swift.model import DataItem
 from nion.swift.model import Graphics
 from nion.swift.model import ImportExportManager
+from nion.swift.model import PipelineStatistics
 from nion.swift.model import Utility
 from nion.utils import Event
 from nion.utils import Observable
@@ -222,6 +226,7 @@ class AcquisitionTask:
         self.__view_id = str(uuid.uuid4()) if not continuous else None
         self._test_acquire_exception = None
         self._test_acquire_hook = None
+        self.acquire_duration = 0.0  # duration of the last call to _acquire_data_elements
         self.start_event = Event.Event()
         self.stop_event = Event.Event()
         self.data_elements_changed_event = Event.Event()
@@ -313,7 +318,9 @@ class AcquisitionTask:
         if self._test_acquire_hook:
             self._test_acquire_hook()
 
+        acquire_start = time.perf_counter()
         partial_data_elements = self._acquire_data_elements()
+        self.acquire_duration = time.perf_counter() - acquire_start
         assert partial_data_elements is not None  # data_elements should never be empty
 
         # update frame_index if not supplied
@@ -411,6 +418,38 @@ class AcquisitionTask:
         raise NotImplementedError()
 
 
+class FrameBufferPool:
+    """A pool of free frame buffers.
+
+    Buffers are given back to the pool with release by their owner once nothing refers to them or to views of them.
+    Buffers which are never released are not reused.
+    """
+
+    def __init__(self, max_count: int=4):
+        self.__lock = threading.RLock()
+        self.__buffers = list()
+        self.__max_count = max_count
+
+    def take(self, shape, dtype) -> numpy.ndarray:
+        """Return a writeable buffer with shape and dtype, reusing a released buffer if possible."""
+        shape = tuple(shape)
+        dtype = numpy.dtype(dtype)
+        with self.__lock:
+            for index, buffer in enumerate(self.__buffers):
+                if buffer.shape == shape and buffer.dtype == dtype:
+                    del self.__buffers[index]
+                    buffer.flags.writeable = True
+                    return buffer
+        return numpy.empty(shape, dtype)
+
+    def release(self, buffer: numpy.ndarray) -> None:
+        """Give the buffer back to the pool. The caller must not use it, or any view of it, afterwards."""
+        with self.__lock:
+            if len(self.__buffers) >= self.__max_count:
+                self.__buffers.pop(0)
+            self.__buffers.append(buffer)
+
+
 class DataChannel:
     """A channel of raw data from a hardware source.
 
@@ -430,6 +469,13 @@ class DataChannel:
         * state
         * src_channel_index
         * sub_area
+        * updated_sub_area
+        * statistics
+
+    The data of each update is published read-only and shared by all listeners; listeners which need to modify it
+    must copy it. The data is not changed after it is published unless every listener of the update has called
+    release_data to say that it no longer refers to the data; the frame buffer is then reused for a later update.
+    Listeners which keep the data, or which do not know, do not call release_data, and the frame buffer is not reused.
     """
     def __init__(self, hardware_source: "HardwareSource", index: int, channel_id: str=None, name: str=None, src_channel_index: int=None, processor=None):
         self.__hardware_source = hardware_source
@@ -441,7 +487,12 @@ class DataChannel:
         self.__start_count = False
         self.__state = None
         self.__sub_area = None
+        self.__updated_sub_area = None
         self.__data_and_metadata = None
+        self.__frame_buffer_pool = FrameBufferPool()
+        self.__frames = dict()  # map id of published data to its weak reference and the count of releases to come
+        self.__frames_lock = threading.RLock()
+        self.__statistics = PipelineStatistics.PipelineStatistics()
         self.is_dirty = False
         self.data_channel_updated_event = Event.Event()
         self.data_channel_start_event = Event.Event()
@@ -467,10 +518,20 @@ class DataChannel:
     def sub_area(self):
         return self.__sub_area
 
+    @property
+    def updated_sub_area(self):
+        """Return the area that changed in the last update, or None if all of the data may have changed."""
+        return self.__updated_sub_area
+
     @property
     def src_channel_index(self):
         return self.__src_channel_index
 
+    @property
+    def statistics(self) -> PipelineStatistics.PipelineStatistics:
+        """Return the statistics of the stages of the acquisition pipeline for this channel."""
+        return self.__statistics
+
     @property
     def processor(self):
         return self.__processor
@@ -485,15 +546,18 @@ class DataChannel:
 
     def update(self, data_and_metadata: DataAndMetadata.DataAndMetadata, state: str, sub_area, view_id) -> None:
         """Called from hardware source when new data arrives."""
+        update_start = time.perf_counter()
         self.__state = state
         self.__sub_area = sub_area
+        updated_sub_area = None
 
         hardware_source_id = self.__hardware_source.hardware_source_id
         channel_index = self.index
         channel_id = self.channel_id
         channel_name = self.name
-        metadata = copy.deepcopy(data_and_metadata.metadata)
-        hardware_source_metadata = dict()
+        # copy only the dicts that change; new_data_and_metadata makes the one deep copy.
+        metadata = dict(data_and_metadata.metadata)
+        hardware_source_metadata = dict(metadata.get("hardware_source", dict()))
         hardware_source_metadata["hardware_source_id"] = hardware_source_id
         hardware_source_metadata["channel_index"] = channel_index
         if channel_id is not None:
@@ -502,7 +566,7 @@ class DataChannel:
             hardware_source_metadata["channel_name"] = channel_name
         if view_id:
             hardware_source_metadata["view_id"] = view_id
-        metadata.setdefault("hardware_source", dict()).update(hardware_source_metadata)
+        metadata["hardware_source"] = hardware_source_metadata
 
         data = data_and_metadata.data
         master_data = self.__data_and_metadata.data if self.__data_and_metadata else None
@@ -513,12 +577,18 @@ class DataChannel:
             left = sub_area[0][1]
             right = sub_area[0][1] + sub_area[1][1]
             if top > 0 or left > 0 or bottom < data.shape[0] or right < data.shape[1]:
-                master_data = numpy.copy(master_data)
-                master_data[top:bottom, left:right] = data[top:bottom, left:right]
+                new_master_data = self.__frame_buffer_pool.take(data.shape, data.dtype)
+                numpy.copyto(new_master_data, master_data)
+                new_master_data[top:bottom, left:right] = data[top:bottom, left:right]
+                master_data = new_master_data
+                updated_sub_area = sub_area
             else:
-                master_data = numpy.copy(data)
+                master_data = self.__frame_buffer_pool.take(data.shape, data.dtype)
+                numpy.copyto(master_data, data)
         else:
-            master_data = numpy.copy(data)
+            master_data = self.__frame_buffer_pool.take(data.shape, data.dtype)
+            numpy.copyto(master_data, data)
+        master_data.flags.writeable = False
 
         data_descriptor = data_and_metadata.data_descriptor
         intensity_calibration = data_and_metadata.intensity_calibration if data_and_metadata else None
@@ -526,11 +596,54 @@ class DataChannel:
         timestamp = data_and_metadata.timestamp
         new_extended_data = DataAndMetadata.new_data_and_metadata(master_data, intensity_calibration, dimensional_calibrations, metadata, timestamp=timestamp, data_descriptor=data_descriptor)
 
+        old_master_data = self.__data_and_metadata.data if self.__data_and_metadata else None
         self.__data_and_metadata = new_extended_data
+        self.__updated_sub_area = updated_sub_area
+
+        self.__statistics.add_latency("update", time.perf_counter() - update_start)
+        self.__statistics.add_count("frames" if state == "complete" else "partial_frames")
+
+        # the channel releases the data when it is replaced; each listener given the data may release it too.
+        self.__add_frame(master_data, self.data_channel_updated_event.listener_count + 1)
+        if old_master_data is not None:
+            self.__release_frame(old_master_data)
 
         self.data_channel_updated_event.fire(new_extended_data)
         self.is_dirty = True
 
+    def release_data(self, data_and_metadata: DataAndMetadata.DataAndMetadata) -> None:
+        """Called by a listener once it no longer refers to the data of an update, or to views of it.
+
+        The frame buffer of the update is reused once the channel and every listener given the update release it.
+        Thread safe.
+        """
+        self.__release_frame(data_and_metadata.data)
+
+    def __add_frame(self, data: numpy.ndarray, release_count: int) -> None:
+        frame_id = id(data)
+        frames = self.__frames
+        frames_lock = self.__frames_lock
+
+        def frame_deleted(weak_data):
+            with frames_lock:
+                frame = frames.get(frame_id)
+                if frame is not None and frame[0] is weak_data:
+                    del frames[frame_id]
+
+        with frames_lock:
+            frames[frame_id] = [weakref.ref(data, frame_deleted), release_count]
+
+    def __release_frame(self, data: numpy.ndarray) -> None:
+        with self.__frames_lock:
+            frame = self.__frames.get(id(data))
+            if frame is None or frame[0]() is not data:
+                return
+            frame[1] -= 1
+            if frame[1] > 0:
+                return
+            del self.__frames[id(data)]
+        self.__frame_buffer_pool.release(data)
+
     def start(self):
         """Called from hardware source when data starts streaming."""
         old_start_count = self.__start_count
@@ -684,11 +797,16 @@ class HardwareSource:
             channel_id = data_element.get("channel_id")
             # find channel_index for channel_id
             channel_index = next((data_channel.index for data_channel in self.__data_channels if data_channel.channel_id == channel_id), 0)
-            data_and_metadata = ImportExportManager.convert_data_element_to_data_and_metadata(data_element)
+            statistics = self.__data_channels[channel_index].statistics
+            statistics.add_latency("acquire", task.acquire_duration)
+            with statistics.measure("convert"):
+                data_and_metadata = ImportExportManager.convert_data_element_to_data_and_metadata(data_element)
             # data_and_metadata data may still point to low level code memory at this point.
             channel_state = data_element.get("state", "complete")
             if channel_state != "complete" and is_stopping:
                 channel_state = "marked"
+                # the rest of the frame will not be acquired
+                statistics.add_count("dropped")
             sub_area = data_element.get("sub_area")
             data_channel = self.__data_channels[channel_index]
             # data_channel.update will make a copy of the data_and_metadata
@@ -701,7 +819,8 @@ class HardwareSource:
             if src_channel_index is not None:
                 src_data_channel = self.__data_channels[src_channel_index]
                 if src_data_channel.is_dirty and src_data_channel.state == "complete":
-                    processed_data_and_metadata = data_channel.processor.process(src_data_channel.data_and_metadata)
+                    with data_channel.statistics.measure("process"):
+                        processed_data_and_metadata = data_channel.processor.process(src_data_channel.data_and_metadata)
                     data_channel.update(processed_data_and_metadata, "complete", None, view_id)
                 data_channels.append(data_channel)
                 xdatas.append(data_channel.data_and_metadata)
@@ -894,6 +1013,20 @@ class HardwareSource:
     def data_channels(self) -> typing.List[DataChannel]:
         return self.__data_channels
 
+    def get_pipeline_statistics(self) -> dict:
+        """Return a dict mapping channel ids (or indexes, for channels without an id) to pipeline statistics dicts.
+
+        See PipelineStatistics.PipelineStatistics.as_dict."""
+        return {str(data_channel.channel_id if data_channel.channel_id is not None else data_channel.index): data_channel.statistics.as_dict() for data_channel in self.__data_channels}
+
+    def reset_pipeline_statistics(self) -> None:
+        for data_channel in self.__data_channels:
+            data_channel.statistics.reset()
+
+    def write_pipeline_statistics(self, file_path: str) -> None:
+        """Write the pipeline statistics of each channel to a JSON file."""
+        PipelineStatistics.write_statistics({"hardware_source_id": self.hardware_source_id, "channels": self.get_pipeline_statistics()}, file_path)
+
     def add_data_channel(self, channel_id: str=None, name: str=None):
         self.__data_channels.append(DataChannel(self, len(self.__data_channels), channel_id, name))
 
@@ -1020,6 +1153,176 @@ class SumProcessor(Observable.Observable, Persistence.PersistentObject):
             self.__crop_graphic = crop_graphic
 
 
+class AccumulatingProcessor:
+    """Base class for channel processors which accumulate frames in preallocated accumulators.
+
+    Accumulators are allocated by _allocate when the first frame arrives and again when the frame shape or dtype
+    changes or after reset. _accumulate updates them in place and returns the processed data, which the processor
+    owns and may change on the next frame; the data channel copies it when publishing.
+
+    Processors are added to a hardware source with add_channel_processor and run in the acquisition thread.
+    """
+
+    def __init__(self, processor_id, label):
+        self.__processor_id = processor_id
+        self.__label = label
+        self.__lock = threading.RLock()
+        self.__data_shape_and_dtype = None
+        self.__frame_count = 0
+
+    @property
+    def label(self):
+        return self.__label
+
+    @property
+    def processor_id(self):
+        return self.__processor_id
+
+    @property
+    def frame_count(self) -> int:
+        """Return the number of frames accumulated since the accumulators were allocated."""
+        return self.__frame_count
+
+    def reset(self) -> None:
+        """Discard the accumulated frames.
+
+        Thread safe and UI safe."""
+        with self.__lock:
+            self.__data_shape_and_dtype = None
+            self.__frame_count = 0
+
+    def process(self, data_and_metadata: DataAndMetadata.DataAndMetadata) -> DataAndMetadata.DataAndMetadata:
+        data = data_and_metadata.data
+        with self.__lock:
+            if self.__data_shape_and_dtype != (data.shape, data.dtype):
+                self._allocate(data.shape, data.dtype)
+                self.__data_shape_and_dtype = data.shape, data.dtype
+                self.__frame_count = 0
+            self.__frame_count += 1
+            processed_data = self._accumulate(data, self.__frame_count)
+        return DataAndMetadata.new_data_and_metadata(processed_data, data_and_metadata.intensity_calibration, data_and_metadata.dimensional_calibrations,
+                                                     data_and_metadata.metadata, data_and_metadata.timestamp, data_and_metadata.data_descriptor)
+
+    def connect(self, data_item_reference):
+        pass
+
+    def _allocate(self, data_shape, data_dtype) -> None:
+        raise NotImplementedError()
+
+    def _accumulate(self, data: numpy.ndarray, frame_count: int) -> numpy.ndarray:
+        raise NotImplementedError()
+
+
+class RunningAverageProcessor(AccumulatingProcessor):
+    """Average all frames since the processor was reset."""
+
+    def __init__(self, processor_id=None, label=None):
+        super().__init__(processor_id or "average", label or _("Average"))
+        self.__sum = None
+        self.__average = None
+
+    def _allocate(self, data_shape, data_dtype) -> None:
+        self.__sum = numpy.zeros(data_shape, numpy.float64)
+        self.__average = numpy.empty(data_shape, numpy.float64)
+
+    def _accumulate(self, data: numpy.ndarray, frame_count: int) -> numpy.ndarray:
+        numpy.add(self.__sum, data, out=self.__sum)
+        numpy.divide(self.__sum, frame_count, out=self.__average)
+        return self.__average
+
+
+class ExponentialAverageProcessor(AccumulatingProcessor):
+    """Exponential moving average of the frames; each new frame has the weight alpha."""
+
+    def __init__(self, alpha, processor_id=None, label=None):
+        super().__init__(processor_id or "exponential_average", label or _("Exponential Average"))
+        self.__alpha = alpha
+        self.__average = None
+        self.__scratch = None
+
+    def _allocate(self, data_shape, data_dtype) -> None:
+        self.__average = numpy.empty(data_shape, numpy.float64)
+        self.__scratch = numpy.empty(data_shape, numpy.float64)
+
+    def _accumulate(self, data: numpy.ndarray, frame_count: int) -> numpy.ndarray:
+        if frame_count == 1:
+            numpy.copyto(self.__average, data)
+        else:
+            numpy.subtract(data, self.__average, out=self.__scratch)
+            numpy.multiply(self.__scratch, self.__alpha, out=self.__scratch)
+            numpy.add(self.__average, self.__scratch, out=self.__average)
+        return self.__average
+
+
+class FrameSumProcessor(AccumulatingProcessor):
+    """Sum of the most recent count frames.
+
+    The frames are kept in a preallocated ring buffer and the sum is updated by adding the new frame and subtracting
+    the frame it replaces. The sum is recalculated from the ring buffer each time it wraps around so that rounding
+    errors do not build up.
+    """
+
+    def __init__(self, count, processor_id=None, label=None):
+        super().__init__(processor_id or "frame_sum", label or _("Frame Sum"))
+        self.__count = count
+        self.__frames = None
+        self.__sum = None
+
+    def _allocate(self, data_shape, data_dtype) -> None:
+        self.__frames = numpy.zeros((self.__count, ) + tuple(data_shape), data_dtype)
+        sum_dtype = numpy.int64 if numpy.issubdtype(data_dtype, numpy.integer) or data_dtype == numpy.bool_ else numpy.float64
+        sum_dtype = numpy.complex128 if numpy.issubdtype(data_dtype, numpy.complexfloating) else sum_dtype
+        self.__sum = numpy.zeros(data_shape, sum_dtype)
+
+    def _accumulate(self, data: numpy.ndarray, frame_count: int) -> numpy.ndarray:
+        slot = (frame_count - 1) % self.__count
+        frame = self.__frames[slot]
+        if frame_count > self.__count and slot == 0:
+            numpy.copyto(frame, data)
+            numpy.sum(self.__frames, axis=0, out=self.__sum)
+        else:
+            numpy.subtract(self.__sum, frame, out=self.__sum)
+            numpy.copyto(frame, data)
+            numpy.add(self.__sum, frame, out=self.__sum)
+        return self.__sum
+
+
+class MaximumHoldProcessor(AccumulatingProcessor):
+    """Hold the maximum of each pixel over the frames since the processor was reset."""
+
+    def __init__(self, processor_id=None, label=None):
+        super().__init__(processor_id or "maximum_hold", label or _("Maximum Hold"))
+        self.__maximum = None
+
+    def _allocate(self, data_shape, data_dtype) -> None:
+        self.__maximum = numpy.empty(data_shape, data_dtype)
+
+    def _accumulate(self, data: numpy.ndarray, frame_count: int) -> numpy.ndarray:
+        if frame_count == 1:
+            numpy.copyto(self.__maximum, data)
+        else:
+            numpy.maximum(self.__maximum, data, out=self.__maximum)
+        return self.__maximum
+
+
+class MinimumHoldProcessor(AccumulatingProcessor):
+    """Hold the minimum of each pixel over the frames since the processor was reset."""
+
+    def __init__(self, processor_id=None, label=None):
+        super().__init__(processor_id or "minimum_hold", label or _("Minimum Hold"))
+        self.__minimum = None
+
+    def _allocate(self, data_shape, data_dtype) -> None:
+        self.__minimum = numpy.empty(data_shape, data_dtype)
+
+    def _accumulate(self, data: numpy.ndarray, frame_count: int) -> numpy.ndarray:
+        if frame_count == 1:
+            numpy.copyto(self.__minimum, data)
+        else:
+            numpy.minimum(self.__minimum, data, out=self.__minimum)
+        return self.__minimum
+
+
 @contextlib.contextmanager
 def get_data_generator_by_id(hardware_source_id, sync=True):
     """
@@ -1081,6 +1384,14 @@ class DataChannelBuffer:
 
     Possible uses: record every frame, record every nth frame, record frame periodically,
       frame averaging, spectrum imaging.
+
+    The buffer holds at most buffer_size frames and, if max_bytes is specified, at most max_bytes of data
+    (but always at least one frame).
+
+    If preallocate is True, the buffer is a ring buffer: it allocates one contiguous block per channel when the
+    first frame arrives and copies each frame into the next slot of the block. The grab methods then return
+    read-only views of the slots, which are only valid until the buffer wraps around to the slot again; clients
+    must copy data they want to keep. Otherwise the buffer shares the read-only data published by the channels.
     """
 
     class State(enum.Enum):
@@ -1088,12 +1399,18 @@ class DataChannelBuffer:
         started = 1
         paused = 2
 
-    def __init__(self, data_channels: typing.List[DataChannel], buffer_size=16):
+    def __init__(self, data_channels: typing.List[DataChannel], buffer_size=16, max_bytes=None, preallocate=False):
         self.__state_lock = threading.RLock()
         self.__state = DataChannelBuffer.State.idle
         self.__buffer_size = buffer_size
+        self.__max_bytes = max_bytes
+        self.__preallocate = preallocate
         self.__buffer_lock = threading.RLock()
-        self.__buffer = list()
+        self.__buffer = collections.deque()
+        self.__buffer_byte_count = 0
+        self.__blocks = dict()
+        self.__slot_count = 0
+        self.__slot_index = 0
         self.__done_events = list()
         self.__active_channel_ids = set()
         self.__latest = dict()
@@ -1121,24 +1438,83 @@ class DataChannelBuffer:
         self.__data_channel_updated_listeners = None
         self.__data_channel_start_listeners = None
         self.__data_channel_stop_listeners = None
+        self.__blocks = dict()
+
+    @property
+    def slot_count(self) -> int:
+        """Return the number of slots in the ring buffer; zero until the first frame arrives or if not preallocated."""
+        return self.__slot_count
+
+    def __prepare_blocks(self, xdata_dict: typing.Mapping[str, DataAndMetadata.DataAndMetadata]) -> None:
+        # allocate the blocks if the channels or their frame shapes and dtypes have changed.
+        # must be called with buffer lock held.
+        if self.__blocks.keys() == xdata_dict.keys() and all(block.shape[1:] == xdata_dict[channel_id].data.shape and block.dtype == xdata_dict[channel_id].data.dtype for channel_id, block in self.__blocks.items()):
+            return
+        frame_byte_count = sum(xdata.data.nbytes for xdata in xdata_dict.values())
+        slot_count = self.__buffer_size
+        if self.__max_bytes is not None and frame_byte_count > 0:
+            slot_count = min(slot_count, self.__max_bytes // frame_byte_count)
+        slot_count = max(slot_count, 1)
+        self.__blocks = {channel_id: numpy.empty((slot_count, ) + xdata.data.shape, xdata.data.dtype) for channel_id, xdata in xdata_dict.items()}
+        self.__slot_count = slot_count
+        self.__slot_index = 0
+        self.__buffer.clear()
+        self.__buffer_byte_count = 0
 
     def __data_channel_updated(self, data_channel: DataChannel, data_and_metadata: DataAndMetadata.DataAndMetadata) -> None:
-        if self.__state == DataChannelBuffer.State.started:
-            if data_channel.state == "complete":
-                with self.__buffer_lock:
-                    self.__latest[data_channel.channel_id] = data_and_metadata
-                    if set(self.__latest.keys()).issuperset(self.__active_channel_ids):
-                        data_and_metadata_list = list()
-                        for data_channel in self.__data_channels:
-                            if data_channel.channel_id in self.__latest:
-                                data_and_metadata_list.append(copy.deepcopy(self.__latest[data_channel.channel_id]))
-                        self.__buffer.append(data_and_metadata_list)
-                        self.__latest = dict()
-                        if len(self.__buffer) > self.__buffer_size:
-                            self.__buffer.pop(0)
-                        for done_event in self.__done_events:
-                            done_event.set()
-                        self.__done_events = list()
+        # the buffer keeps published data unless it is preallocated, in which case it copies the data into a slot.
+        # data which is not kept is released so that the data channel can reuse its frame buffer.
+        if self.__state == DataChannelBuffer.State.started and data_channel.state == "complete":
+            with self.__buffer_lock:
+                replaced_data_and_metadata = self.__latest.get(data_channel.channel_id)
+                if self.__preallocate and replaced_data_and_metadata is not None:
+                    data_channel.release_data(replaced_data_and_metadata)
+                self.__latest[data_channel.channel_id] = data_and_metadata
+                if set(self.__latest.keys()).issuperset(self.__active_channel_ids):
+                    if self.__preallocate:
+                        self.__prepare_blocks(self.__latest)
+                        slot = self.__slot_index % self.__slot_count
+                        self.__slot_index += 1
+                        # the oldest entry uses the slot about to be written; drop it first.
+                        if len(self.__buffer) == self.__slot_count:
+                            self.__pop_earliest()
+                    data_and_metadata_list = list()
+                    byte_count = 0
+                    for data_channel in self.__data_channels:
+                        if data_channel.channel_id in self.__latest:
+                            xdata = self.__latest[data_channel.channel_id]
+                            if self.__preallocate:
+                                data = self.__blocks[data_channel.channel_id][slot]
+                                data.flags.writeable = True
+                                numpy.copyto(data, xdata.data)
+                                data.flags.writeable = False
+                                data_channel.release_data(xdata)
+                            else:
+                                # published data is read-only, so the buffered data shares it.
+                                data = xdata.data
+                            data_and_metadata_list.append(DataAndMetadata.new_data_and_metadata(data, xdata.intensity_calibration, xdata.dimensional_calibrations, xdata.metadata, xdata.timestamp, xdata.data_descriptor))
+                            byte_count += data.nbytes
+                    self.__buffer.append((data_and_metadata_list, byte_count))
+                    self.__buffer_byte_count += byte_count
+                    self.__latest = dict()
+                    while len(self.__buffer) > 1 and (len(self.__buffer) > self.__buffer_size or (self.__max_bytes is not None and self.__buffer_byte_count > self.__max_bytes)):
+                        self.__pop_earliest()
+                    for done_event in self.__done_events:
+                        done_event.set()
+                    self.__done_events = list()
+        else:
+            data_channel.release_data(data_and_metadata)
+
+    def __pop_earliest(self) -> typing.List[DataAndMetadata.DataAndMetadata]:
+        # must be called with buffer lock held.
+        data_and_metadata_list, byte_count = self.__buffer.popleft()
+        self.__buffer_byte_count -= byte_count
+        return data_and_metadata_list
+
+    def __clear(self) -> None:
+        # must be called with buffer lock held.
+        self.__buffer.clear()
+        self.__buffer_byte_count = 0
 
     def __data_channel_start(self, data_channel: DataChannel) -> None:
         self.__active_channel_ids.add(data_channel.channel_id)
@@ -1158,8 +1534,8 @@ class DataChannelBuffer:
                 self.__buffer_lock.acquire()
                 if not done:
                     raise Exception("Could not grab latest.")
-            result = self.__buffer[-1]
-            self.__buffer = list()
+            result = self.__buffer[-1][0]
+            self.__clear()
             return result
 
     def grab_earliest(self, timeout: float=None) -> typing.List[DataAndMetadata.DataAndMetadata]:
@@ -1174,12 +1550,12 @@ class DataChannelBuffer:
                 self.__buffer_lock.acquire()
                 if not done:
                     raise Exception("Could not grab latest.")
-            return self.__buffer.pop(0)
+            return self.__pop_earliest()
 
     def grab_next(self, timeout: float=None) -> typing.List[DataAndMetadata.DataAndMetadata]:
         """Grab the next data to finish from the buffer, blocking until one is available."""
         with self.__buffer_lock:
-            self.__buffer = list()
+            self.__clear()
         return self.grab_latest(timeout)
 
     def grab_following(self, timeout: float=None) -> typing.List[DataAndMetadata.DataAndMetadata]:
@@ -1218,6 +1594,111 @@ class DataChannelBuffer:
             self.__state = DataChannelBuffer.State.idle
 
 
+class SequenceRecorder:
+    """Record the complete frames of a data channel to storage as a sequence data item, as they arrive.
+
+    The data item must be in a document and its storage must support writing frame by frame (large format data
+    items). Storage for frame_count frames is reserved when the first frame arrives and each frame is written to
+    storage in the acquisition thread, so only the current frame is held in memory however long the recording is.
+    Frames with a different shape or dtype than the first frame are skipped.
+
+    Call stop from the UI thread to finish the recording. The data item then describes the recorded frames and
+    loads its data from storage when needed.
+
+    Scripts record sequences with the create_sequence_record_task method of the API hardware source, which makes a
+    sequence recorder for each data channel.
+    """
+
+    def __init__(self, data_channel: DataChannel, data_item: DataItem.DataItem, frame_count: int):
+        # frames are written from the acquisition thread; check here that the storage can write them.
+        assert data_item.large_format
+        assert data_item.persistent_object_context is not None
+        self.__data_channel = data_channel
+        self.__data_item = data_item
+        self.__frame_count = frame_count
+        self.__lock = threading.RLock()
+        self.__is_recording = False
+        self.__frame_index = 0
+        self.__skipped_count = 0
+        self.__frame_data_metadata = None
+        self.finished_event = threading.Event()
+        self.__data_item.ensure_data_source()
+        self.__data_channel_updated_listener = data_channel.data_channel_updated_event.listen(self.__data_channel_updated)
+
+    def close(self) -> None:
+        self.stop()
+        self.__data_channel_updated_listener.close()
+        self.__data_channel_updated_listener = None
+
+    @property
+    def frame_index(self) -> int:
+        """Return the number of frames recorded."""
+        return self.__frame_index
+
+    @property
+    def skipped_count(self) -> int:
+        """Return the number of frames skipped because they do not match the first frame."""
+        return self.__skipped_count
+
+    @property
+    def is_recording(self) -> bool:
+        return self.__is_recording
+
+    def start(self) -> None:
+        """Start recording.
+
+        Thread safe and UI safe."""
+        with self.__lock:
+            self.__is_recording = self.__frame_index < self.__frame_count
+
+    def stop(self) -> None:
+        """Stop recording and describe the recorded frames in the data item.
+
+        Must be called from the UI thread."""
+        with self.__lock:
+            self.__is_recording = False
+            frame_data_metadata = self.__frame_data_metadata
+            frame_index = self.__frame_index
+            self.__frame_data_metadata = None
+        if frame_data_metadata and frame_index > 0:
+            frame_shape, data_dtype = frame_data_metadata.data_shape_and_dtype
+            data_shape = (frame_index, ) + tuple(frame_shape)
+            data_source = self.__data_item.data_source
+            data_source.reserve_stored_data(data_shape, data_dtype)
+            dimensional_calibrations = [Calibration.Calibration()] + list(frame_data_metadata.dimensional_calibrations)
+            data_descriptor = DataAndMetadata.DataDescriptor(True, frame_data_metadata.collection_dimension_count, frame_data_metadata.datum_dimension_count)
+            data_metadata = DataAndMetadata.DataMetadata((data_shape, data_dtype), frame_data_metadata.intensity_calibration, dimensional_calibrations, frame_data_metadata.metadata, frame_data_metadata.timestamp, data_descriptor=data_descriptor)
+            self.__data_item.set_stored_data_metadata(data_metadata)
+
+    def __data_channel_updated(self, data_and_metadata: DataAndMetadata.DataAndMetadata) -> None:
+        # frames are copied into storage, so the recorder never keeps the published data.
+        try:
+            self.__record_frame(data_and_metadata)
+        finally:
+            self.__data_channel.release_data(data_and_metadata)
+
+    def __record_frame(self, data_and_metadata: DataAndMetadata.DataAndMetadata) -> None:
+        with self.__lock:
+            if not self.__is_recording or self.__data_channel.state != "complete":
+                return
+            data_source = self.__data_item.data_source
+            if self.__frame_data_metadata is None:
+                if data_and_metadata.is_sequence:
+                    self.__skipped_count += 1
+                    return
+                self.__frame_data_metadata = data_and_metadata.data_metadata
+                data_shape = (self.__frame_count, ) + tuple(data_and_metadata.data_shape)
+                data_source.reserve_stored_data(data_shape, data_and_metadata.data_dtype)
+            elif data_and_metadata.data_shape_and_dtype != self.__frame_data_metadata.data_shape_and_dtype:
+                self.__skipped_count += 1
+                return
+            data_source.write_stored_data_frame(data_and_metadata.data, self.__frame_index)
+            self.__frame_index += 1
+            if self.__frame_index >= self.__frame_count:
+                self.__is_recording = False
+                self.finished_event.set()
+
+
 def matches_hardware_source(hardware_source_id, channel_id, data_item):
     if data_item.computation is None:
         hardware_source_metadata = data_item.metadata.get("hardware_source", dict())
@@ -0,0 +1,216 @@
+"""
+Line profiles of 2d data, computed from cached sampling indexes.
+
+The result is the same as from Core.function_line_profile, which samples the data with nearest neighbor interpolation
+at points along the line and across its width, then sums across the width. The points depend only on the data shape,
+the line vector, and the width, so the indexes of the sampled pixels are computed once and cached. Profiles of new
+data with the same shape then only gather and sum the sampled pixels. Wide profiles, and several profiles of the same
+data, are summed in chunks on several threads. The dtype and calibrations of the result are taken from a profile of
+small data made by Core.
+
+Facade.initialize dispatches xd.line_profile of the data api to line_profile.
+"""
+
+# standard libraries
+import collections
+import concurrent.futures
+import math
+import os
+import threading
+import typing
+
+# third party libraries
+import numpy
+import scipy.ndimage
+
+# local libraries
+from nion.data import Core
+from nion.data import DataAndMetadata
+from nion.data import Image
+
+NormVectorType = typing.Tuple[typing.Tuple[float, float], typing.Tuple[float, float]]
+
+# the number of sampled pixels above which a profile is summed on several threads.
+parallel_sample_count = 1024 * 1024
+
+# the number of threads used to sum wide profiles.
+thread_count = min(max(os.cpu_count() or 1, 1), 8)
+
+# the number of sampling indexes kept in the cache.
+cache_size = 32
+
+_executor = None
+_executor_lock = threading.RLock()
+
+
+def _get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=thread_count)
+        return _executor
+
+
+class LineProfileSampler:
+    """The indexes of the pixels sampled for a line profile of data with a shape.
+
+    Indexes is an array of flat indexes into the data with one row for each line across the width of the profile.
+    Outside is a mask of the points outside of the data, which are zero in the profile, or None if there are none.
+    """
+
+    def __init__(self, data_shape: typing.Tuple[int, int], vector: NormVectorType, integration_width: int):
+        start, end = vector
+        start_data = (int(data_shape[0] * start[0]), int(data_shape[1] * start[1]))
+        end_data = (int(data_shape[0] * end[0]), int(data_shape[1] * end[1]))
+        length = math.sqrt(math.pow(end_data[1] - start_data[1], 2) + math.pow(end_data[0] - start_data[0], 2))
+        self.data_shape = data_shape
+        self.indexes = None  # type: typing.Optional[numpy.ndarray]
+        self.outside = None  # type: typing.Optional[numpy.ndarray]
+        if length > 1.0:
+            yy, xx = self.__get_coordinates(start_data, end_data, integration_width)
+            # sample row and column numbers the same way as the data is sampled so that the points match exactly,
+            # including at the edges. nearest neighbor sampling treats each axis separately.
+            rows = scipy.ndimage.map_coordinates(numpy.arange(data_shape[0], dtype=numpy.float64), (yy, ), order=0, cval=-1)
+            columns = scipy.ndimage.map_coordinates(numpy.arange(data_shape[1], dtype=numpy.float64), (xx, ), order=0, cval=-1)
+            outside = numpy.logical_or(rows < 0, columns < 0)
+            self.indexes = numpy.where(outside, 0, rows * data_shape[1] + columns).astype(numpy.intp)
+            self.outside = outside if numpy.any(outside) else None
+
+    @staticmethod
+    def __get_coordinates(start, end, n):
+        # n=1 => 0
+        # n=2 => -0.5, 0.5
+        # n=3 => -1, 0, 1
+        # n=4 => -1.5, -0.5, 0.5, 1.5
+        length_f = math.sqrt(math.pow(end[0] - start[0], 2) + math.pow(end[1] - start[1], 2))
+        samples = int(math.floor(length_f))
+        a = numpy.linspace(0, samples - 1, samples)  # along
+        t = numpy.linspace(-(n-1)*0.5, (n-1)*0.5, n)  # transverse
+        dy = (end[0] - start[0]) / samples
+        dx = (end[1] - start[1]) / samples
+        ix, iy = numpy.meshgrid(a, t)
+        yy = start[0] + dy * ix + dx * iy
+        xx = start[1] + dx * ix - dy * iy
+        return yy, xx
+
+    def get_row_slices(self) -> typing.List[slice]:
+        """Return the slices of the rows of indexes to sum separately, more than one if the profile is wide."""
+        indexes = self.indexes
+        if indexes is None:
+            return list()
+        if indexes.size <= parallel_sample_count or indexes.shape[0] < 2 or thread_count < 2:
+            return [slice(None)]
+        chunk_count = min(thread_count, indexes.shape[0])
+        chunk_bounds = numpy.linspace(0, indexes.shape[0], chunk_count + 1).astype(int)
+        return [slice(start, stop) for start, stop in zip(chunk_bounds[:-1], chunk_bounds[1:])]
+
+    def sum_rows(self, flat_data: numpy.ndarray, row_slice: slice) -> numpy.ndarray:
+        """Return the sum of the samples of the rows of indexes in the slice."""
+        samples = numpy.take(flat_data, self.indexes[row_slice])
+        if self.outside is not None:
+            samples[self.outside[row_slice]] = 0
+        return numpy.sum(samples, 0)
+
+    def sum(self, flat_data: numpy.ndarray) -> numpy.ndarray:
+        """Return the profile of the data, flattened to one dimension.
+
+        Profiles with more than parallel_sample_count samples are summed in chunks on several threads, which may
+        round floating point sums differently.
+        """
+        return sum_samplers([self], flat_data)[0]
+
+
+def sum_samplers(samplers: typing.Sequence[LineProfileSampler], flat_data: numpy.ndarray) -> typing.List[numpy.ndarray]:
+    """Return the profile of the data, flattened to one dimension, for each sampler.
+
+    The chunks of all of the profiles are summed together, on several threads if there is more than one.
+    """
+    chunks = [(sampler_index, row_slice) for sampler_index, sampler in enumerate(samplers) for row_slice in sampler.get_row_slices()]
+    if len(chunks) > 1:
+        # numpy releases the global interpreter lock while it gathers and sums, so the chunks sum in parallel.
+        futures = [_get_executor().submit(samplers[sampler_index].sum_rows, flat_data, row_slice) for sampler_index, row_slice in chunks]
+        chunk_sums = [future.result() for future in futures]
+    else:
+        chunk_sums = [samplers[sampler_index].sum_rows(flat_data, row_slice) for sampler_index, row_slice in chunks]
+    results = [None] * len(samplers)  # type: typing.List[typing.Optional[numpy.ndarray]]
+    for (sampler_index, row_slice), chunk_sum in zip(chunks, chunk_sums):
+        results[sampler_index] = chunk_sum if results[sampler_index] is None else results[sampler_index] + chunk_sum
+    return [result if result is not None else numpy.zeros((1)) for result in results]
+
+
+_samplers = collections.OrderedDict()  # type: typing.MutableMapping[typing.Tuple, LineProfileSampler]
+_samplers_lock = threading.RLock()
+
+
+def get_sampler(data_shape: typing.Tuple[int, int], vector: NormVectorType, integration_width: int) -> LineProfileSampler:
+    """Return the sampler for the data shape, vector, and width, using the cache if possible. Thread safe."""
+    key = tuple(data_shape), (tuple(vector[0]), tuple(vector[1])), integration_width
+    with _samplers_lock:
+        sampler = _samplers.get(key)
+        if sampler is not None:
+            _samplers.move_to_end(key)
+            return sampler
+    sampler = LineProfileSampler(tuple(data_shape), vector, integration_width)
+    with _samplers_lock:
+        _samplers[key] = sampler
+        while len(_samplers) > cache_size:
+            _samplers.popitem(last=False)
+    return sampler
+
+
+def _get_core_line_profile_metadata(data_and_metadata: DataAndMetadata.DataAndMetadata, integration_width: float) -> DataAndMetadata.DataAndMetadata:
+    # Core takes the calibrations of a profile from the calibrations of the data and the largest dimension of the data,
+    # which limits the width, and its dtype from the dtype of the data. return the short profile made by Core of a row
+    # of zeros with the same calibrations, largest dimension, and dtype.
+    data_shape = data_and_metadata.data_shape
+    row_length = max(data_shape[0], data_shape[1])
+    row_xdata = DataAndMetadata.new_data_and_metadata(numpy.zeros((1, row_length) + tuple(data_shape[2:]), data_and_metadata.data_dtype),
+                                                      data_and_metadata.intensity_calibration,
+                                                      data_and_metadata.dimensional_calibrations)
+    return Core.function_line_profile(row_xdata, ((0.0, 0.0), (0.0, 3.0 / row_length)), integration_width)
+
+
+def line_profiles(data_and_metadata: DataAndMetadata.DataAndMetadata, lines: typing.Sequence[typing.Tuple[NormVectorType, float]]) -> typing.List[typing.Optional[DataAndMetadata.DataAndMetadata]]:
+    """Return the line profile of 2d data for each vector and integration width in lines.
+
+    The data is prepared once and the profiles are summed together. Each profile is the same as the one from
+    Core.function_line_profile.
+    """
+    data_shape = data_and_metadata.data_shape
+    data_dtype = data_and_metadata.data_dtype
+    dimensional_calibrations = data_and_metadata.dimensional_calibrations
+
+    for vector, integration_width in lines:
+        assert int(integration_width) > 0  # the same requirement as Core.function_line_profile
+
+    if not Image.is_shape_and_dtype_valid(data_shape, data_dtype) or dimensional_calibrations is None or len(dimensional_calibrations) != 2:
+        return [None] * len(lines)
+
+    data = data_and_metadata.data
+    if not Image.is_data_valid(data):
+        return [Core.function_line_profile(data_and_metadata, vector, integration_width) for vector, integration_width in lines]
+    if Image.is_data_rgb_type(data):
+        data = Image.convert_to_grayscale(data, numpy.double)
+    flat_data = data.reshape(-1)
+
+    samplers = list()
+    for vector, integration_width in lines:
+        actual_integration_width = min(max(data_shape[0], data_shape[1]), int(integration_width))  # limit integration width to sensible value
+        samplers.append(get_sampler(data_shape[0:2], vector, actual_integration_width))
+    profiles = iter(sum_samplers([sampler for sampler in samplers if sampler.indexes is not None], flat_data))
+
+    results = list()
+    for (vector, integration_width), sampler in zip(lines, samplers):
+        if sampler.indexes is None:
+            # lines too short to sample are quick for Core.
+            results.append(Core.function_line_profile(data_and_metadata, vector, integration_width))
+        else:
+            metadata_xdata = _get_core_line_profile_metadata(data_and_metadata, integration_width)
+            result_data = next(profiles).astype(metadata_xdata.data_dtype, copy=False)
+            results.append(DataAndMetadata.new_data_and_metadata(result_data, metadata_xdata.intensity_calibration, metadata_xdata.dimensional_calibrations))
+    return results
+
+
+def line_profile(data_and_metadata: DataAndMetadata.DataAndMetadata, vector: NormVectorType, integration_width: float) -> typing.Optional[DataAndMetadata.DataAndMetadata]:
+    """Return the line profile of 2d data. The same as Core.function_line_profile."""
+    return line_profiles(data_and_metadata, [(vector, integration_width)])[0]
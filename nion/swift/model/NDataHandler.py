@@ -14,6 +14,7 @@ import os
 import struct
 import threading
 import time
+import weakref
 
 # local libraries
 from nion.swift.model import Utility
@@ -128,6 +129,47 @@ def write_end_of_directory(fp, dir_size, dir_offset, count):
     fp.write(struct.pack('H', 0))           # comment len
 
 
+def encode_json(properties):
+    """
+        Encode the properties as json bytes.
+
+        :param properties: the properties to encode
+        :return: the encoded bytes; empty if the properties cannot be encoded
+    """
+    json_str = str()
+    try:
+        class JSONEncoder(json.JSONEncoder):
+            def default(self, obj):
+                if isinstance(obj, Geometry.IntPoint) or isinstance(obj, Geometry.IntSize) or isinstance(obj, Geometry.IntRect) or isinstance(obj, Geometry.FloatPoint) or isinstance(obj, Geometry.FloatSize) or isinstance(obj, Geometry.FloatRect):
+                    return tuple(obj)
+                else:
+                    return json.JSONEncoder.default(self, obj)
+        json_io = io.StringIO()
+        json.dump(properties, json_io, cls=JSONEncoder)
+        json_str = json_io.getvalue()
+    except Exception as e:
+        # catch exceptions to avoid corrupt zip files
+        import traceback
+        logging.error("Exception writing zip file %s" + str(e))
+        traceback.print_exc()
+        traceback.print_stack()
+    return bytes(json_str, 'ISO-8859-1')
+
+
+def pad_json_bytes(json_bytes):
+    """
+        Pad the json bytes with trailing whitespace to leave room for the properties to grow.
+
+        :param json_bytes: the encoded json
+        :return: the padded json bytes
+
+        The padding lets later property writes of similar size update the metadata in place. Trailing whitespace
+        is valid json, so readers are not affected.
+    """
+    padded_len = (len(json_bytes) * 5 // 4 + 255) // 256 * 256
+    return json_bytes + b" " * (padded_len - len(json_bytes))
+
+
 def write_zip_fp(fp, data, properties, dir_data_list=None):
     """
         Write custom zip file of data and properties to fp
@@ -166,25 +208,8 @@ def write_zip_fp(fp, data, properties, dir_data_list=None):
         data_len, crc32 = write_local_file(fp, b"data.npy", write_data, dt)
         dir_data_list.append((offset_data, b"data.npy", data_len, crc32))
     if properties is not None:
-        json_str = str()
-        try:
-            class JSONEncoder(json.JSONEncoder):
-                def default(self, obj):
-                    if isinstance(obj, Geometry.IntPoint) or isinstance(obj, Geometry.IntSize) or isinstance(obj, Geometry.IntRect) or isinstance(obj, Geometry.FloatPoint) or isinstance(obj, Geometry.FloatSize) or isinstance(obj, Geometry.FloatRect):
-                        return tuple(obj)
-                    else:
-                        return json.JSONEncoder.default(self, obj)
-            json_io = io.StringIO()
-            json.dump(properties, json_io, cls=JSONEncoder)
-            json_str = json_io.getvalue()
-        except Exception as e:
-            # catch exceptions to avoid corrupt zip files
-            import traceback
-            logging.error("Exception writing zip file %s" + str(e))
-            traceback.print_exc()
-            traceback.print_stack()
+        json_bytes = pad_json_bytes(encode_json(properties))
         def write_json(fp):
-            json_bytes = bytes(json_str, 'ISO-8859-1')
             fp.write(json_bytes)
             return binascii.crc32(json_bytes) & 0xFFFFFFFF
         offset_json = fp.tell()
@@ -296,6 +321,50 @@ def read_data(fp, local_files, dir_files, name_bytes):
     return None
 
 
+def read_npy_header(fp):
+    """
+        Read the header of the npy file at fp
+
+        :param fp: a file pointer at the start of the npy file
+        :return: a tuple of shape, fortran order, and dtype; or None if the version is not recognized
+
+        The file pointer will be at the start of the array data after this method.
+    """
+    version = numpy.lib.format.read_magic(fp)
+    if version == (1, 0):
+        return numpy.lib.format.read_array_header_1_0(fp)
+    elif version == (2, 0):
+        return numpy.lib.format.read_array_header_2_0(fp)
+    return None
+
+
+def map_data(fp, local_files, dir_files, name_bytes):
+    """
+        Memory map a numpy data array from the zip file
+
+        :param fp: a file pointer
+        :param local_files: the local files structure
+        :param dir_files: the directory headers
+        :param name: the name of the data file to map
+        :return: the numpy memmap, if found and mappable; otherwise None
+
+        The memmap is copy-on-write: the file is never changed by writing to the array.
+
+        The local_files and dir_files should be passed from
+        the results of parse_zip.
+    """
+    if name_bytes in dir_files:
+        fp.seek(local_files[dir_files[name_bytes][1]][1])
+        header = read_npy_header(fp)
+        if header is None:
+            return None
+        shape, fortran_order, dtype = header
+        if dtype.hasobject or numpy.prod(shape) == 0:
+            return None
+        return numpy.memmap(fp, dtype=dtype, mode="c", offset=fp.tell(), shape=shape, order="F" if fortran_order else "C")
+    return None
+
+
 def read_json(fp, local_files, dir_files, name_bytes):
     """
         Read json properties from the zip file
@@ -321,31 +390,67 @@ def read_json(fp, local_files, dir_files, name_bytes):
     return None
 
 
+def is_ndata_directory(dir_files):
+    """
+        Return whether the directory headers are those of an ndata file
+
+        :param dir_files: the directory headers
+        :return: whether the directory has a data.npy file, a metadata.json file, or both, and nothing else
+
+        The dir_files should be passed from the results of parse_zip.
+    """
+    contains_data = b"data.npy" in dir_files
+    contains_metadata = b"metadata.json" in dir_files
+    file_count = contains_data + contains_metadata  # use fact that True is 1, False is 0
+    # TODO: make sure ndata isn't compressed, or handle it
+    return len(dir_files) == file_count and file_count > 0
+
+
 def rewrite_zip(file_path, properties):
     """
         Rewrite the json properties in the zip file
 
         :param file_path: the file path to the zip file
         :param properties: the updated properties to write to the zip file
+        :return: the number of unused bytes in the file that compact_zip can reclaim
 
-        This method will attempt to keep the data file within the zip
-        file intact without rewriting it. However, if the data file is not the
-        first item in the zip file, this method will rewrite it.
+        If the properties fit into the space of the existing metadata file, they are
+        written in place and only the crc32 values in the headers are updated.
+        Otherwise, the properties are written following the data file along with a
+        new directory. Either way, the data file is never read or rewritten. Only if
+        the zip file is not a recognized ndata file will this method rewrite it fully.
 
         The properties param must not change during this method. Callers should
         take care to ensure this does not happen.
     """
     with open(file_path, "r+b") as fp:
         local_files, dir_files, eocd = parse_zip(fp)
-        # check to make sure directory has two files, named data.npy and metadata.json, and that data.npy is first
+        # check to make sure directory has two files, named data.npy and metadata.json
         # TODO: check compression, etc.
-        if len(dir_files) == 2 and b"data.npy" in dir_files and b"metadata.json" in dir_files and dir_files[b"data.npy"][1] == 0:
-            fp.seek(dir_files[b"metadata.json"][1])
+        if len(dir_files) == 2 and b"data.npy" in dir_files and b"metadata.json" in dir_files:
+            json_dir_pos, json_local_file_pos = dir_files[b"metadata.json"]
+            json_pos, json_len = local_files[json_local_file_pos][1:3]
+            json_bytes = encode_json(properties)
+            if len(json_bytes) <= json_len:
+                json_bytes += b" " * (json_len - len(json_bytes))
+                json_crc32 = binascii.crc32(json_bytes) & 0xFFFFFFFF
+                fp.seek(json_pos)
+                fp.write(json_bytes)
+                fp.seek(json_local_file_pos + 14)
+                fp.write(struct.pack('I', json_crc32))  # local file header crc32
+                fp.seek(json_dir_pos + 16)
+                fp.write(struct.pack('I', json_crc32))  # directory header crc32
+                # anything before the data is unused once the metadata has been written after it.
+                data_local_file_pos = dir_files[b"data.npy"][1]
+                return data_local_file_pos if json_local_file_pos > data_local_file_pos else 0
             dir_data_list = list()
             local_file_pos = dir_files[b"data.npy"][1]
             local_file = local_files[local_file_pos]
             dir_data_list.append((local_file_pos, b"data.npy", local_file[2], local_file[3]))
+            # write over the old metadata if it follows the data; otherwise leave it unused and write after the data.
+            fp.seek(json_local_file_pos if json_local_file_pos > local_file_pos else eocd[1])
             write_zip_fp(fp, None, properties, dir_data_list)
+            return local_file_pos
         else:
             data = None
             if b"data.npy" in dir_files:
@@ -353,6 +458,113 @@ def rewrite_zip(file_path, properties):
                 data = numpy.load(fp)
             fp.seek(0)
             write_zip_fp(fp, data, properties)
+            return 0
+
+
+def rewrite_zip_data_region(file_path, data, region, update_crc32=True):
+    """
+        Rewrite a region of the data in the zip file in place
+
+        :param file_path: the file path to the zip file
+        :param data: the full data array, matching the shape and dtype of the data in the file
+        :param region: a tuple of slices; the rows selected by the first slice are written
+        :param update_crc32: whether to update the crc32 of the data
+        :return: whether the region was written; if not, the caller must write the data fully
+
+        Only the rows of the region and, if update_crc32 is True, the crc32 values in the
+        headers are written. The crc32 is calculated from the data in memory. Callers writing
+        several regions may update the crc32 with the last one only, or with rewrite_zip_data_crc32.
+    """
+    if data.ndim == 0 or not data.flags["C_CONTIGUOUS"] or data.dtype.hasobject:
+        return False
+    start, stop, step = region[0].indices(data.shape[0]) if len(region) > 0 else (0, data.shape[0], 1)
+    if step != 1:
+        return False
+    with open(file_path, "r+b") as fp:
+        local_files, dir_files, eocd = parse_zip(fp)
+        if b"data.npy" not in dir_files:
+            return False
+        data_dir_pos, data_local_file_pos = dir_files[b"data.npy"]
+        data_pos, data_len = local_files[data_local_file_pos][1:3]
+        fp.seek(data_pos)
+        header = read_npy_header(fp)
+        if header is None:
+            return False
+        shape, fortran_order, dtype = header
+        header_len = fp.tell() - data_pos
+        if tuple(shape) != data.shape or dtype != data.dtype or fortran_order or header_len + data.nbytes != data_len:
+            return False
+        if stop > start:
+            row_byte_count = data.nbytes // data.shape[0]
+            fp.seek(data_pos + header_len + start * row_byte_count)
+            fp.write(data[start:stop].data)
+        if update_crc32:
+            fp.seek(data_pos)
+            header_data = fp.read(header_len)
+            data_crc32 = binascii.crc32(data.data, binascii.crc32(header_data)) & 0xFFFFFFFF
+            fp.seek(data_local_file_pos + 14)
+            fp.write(struct.pack('I', data_crc32))  # local file header crc32
+            fp.seek(data_dir_pos + 16)
+            fp.write(struct.pack('I', data_crc32))  # directory header crc32
+    return True
+
+
+def rewrite_zip_data_crc32(file_path):
+    """
+        Rewrite the crc32 of the data file in the zip file
+
+        :param file_path: the file path to the zip file
+
+        The crc32 is calculated from the data in the file, which is read in chunks.
+    """
+    with open(file_path, "r+b") as fp:
+        local_files, dir_files, eocd = parse_zip(fp)
+        if b"data.npy" not in dir_files:
+            return
+        data_dir_pos, data_local_file_pos = dir_files[b"data.npy"]
+        data_pos, data_len = local_files[data_local_file_pos][1:3]
+        data_crc32 = 0
+        fp.seek(data_pos)
+        remaining = data_len
+        while remaining > 0:
+            chunk = fp.read(min(remaining, 16 * 1024 * 1024))
+            data_crc32 = binascii.crc32(chunk, data_crc32)
+            remaining -= len(chunk)
+        data_crc32 &= 0xFFFFFFFF
+        fp.seek(data_local_file_pos + 14)
+        fp.write(struct.pack('I', data_crc32))  # local file header crc32
+        fp.seek(data_dir_pos + 16)
+        fp.write(struct.pack('I', data_crc32))  # directory header crc32
+
+
+def compact_zip(file_path):
+    """
+        Rewrite the zip file so that the data file is first, removing unused space
+
+        :param file_path: the file path to the zip file
+
+        The data file is copied as raw bytes; it is not parsed or loaded. The file is
+        written to a temporary file and then replaces the original file.
+    """
+    with open(file_path, "rb") as fp:
+        local_files, dir_files, eocd = parse_zip(fp)
+        if b"data.npy" not in dir_files or dir_files[b"data.npy"][1] == 0:
+            return
+        properties = read_json(fp, local_files, dir_files, b"metadata.json")
+        local_file_pos = dir_files[b"data.npy"][1]
+        data_pos, data_len, crc32 = local_files[local_file_pos][1:4]
+        temp_file_path = file_path + ".temp"
+        file_stat = os.stat(file_path)
+        with open(temp_file_path, "w+b") as temp_fp:
+            fp.seek(local_file_pos)
+            remaining = data_pos + data_len - local_file_pos
+            while remaining > 0:
+                chunk = fp.read(min(remaining, 16 * 1024 * 1024))
+                temp_fp.write(chunk)
+                remaining -= len(chunk)
+            write_zip_fp(temp_fp, None, properties if properties is not None else dict(), [(0, b"data.npy", data_len, crc32)])
+        os.utime(temp_file_path, (file_stat.st_atime, file_stat.st_mtime))
+    os.replace(temp_file_path, file_path)
 
 
 class NDataHandler:
@@ -363,22 +575,78 @@ class NDataHandler:
         Both files must be uncompressed.
 
         The handler will read zip files where the metadata.json file is the first of the
-        two files; however it will always make sure data is the first file upon writing.
+        two files; however it will always make sure data is the first file upon writing
+        data. Writing properties never rewrites the data; if that leaves unused space in
+        the file, the file is compacted once the unused space is at least compaction_min_unused_ratio
+        of the file size, or otherwise when the handler is closed.
+
+        Writing a region of the data updates the crc32 of the data only when the region
+        reaches the last row of the data, which completes a frame of a scan; otherwise the
+        crc32 is updated when the handler is closed.
 
         The handler is meant to be fully independent so that it can easily be plugged into
         earlier versions of Swift as it evolves.
 
+        Data at least memory_map_min_size bytes is memory mapped rather than read, if memory_map_min_size is
+        not None. Mapped data is copy-on-write; data is written to a new file that replaces the old one while
+        maps of the file are in use, so existing maps remain valid.
+
         :param file_path: The basic directory from which reference are based
+        :param properties: Optional properties already read from the file, returned by the first read_properties
+
+        on_write, if set, is called with the file path after each change to the file. Writes restore the mtime of
+        the file to the file datetime, so the mtime does not show that the file changed.
 
         TODO: Move NDataHandler into a plug-in
     """
 
-    def __init__(self, file_path):
+    memory_map_min_size = None
+    compaction_min_unused_ratio = 0.25
+
+    def __init__(self, file_path, properties=None):
         self.__file_path = str(file_path)
         self.__lock = threading.RLock()
+        self.__needs_compaction = False
+        self.__needs_data_crc32 = False
+        self.__properties = properties
+        self.__data_maps = list()  # weak references to the memory maps of the file returned by read_data
+        self.on_write = None
 
     def close(self):
-        pass
+        with self.__lock:
+            self.__update_data_crc32()
+            if self.__needs_compaction:
+                self.__compact()
+                self.__notify_write()
+
+    def __update_data_crc32(self):
+        if self.__needs_data_crc32:
+            self.__needs_data_crc32 = False
+            try:
+                rewrite_zip_data_crc32(self.__file_path)
+            except Exception as e:
+                logging.error("Exception updating ndata file crc32: %s", self.__file_path)
+                logging.error(str(e))
+            self.__notify_write()
+
+    def __compact(self):
+        # the data crc32 is copied by compact_zip, so it must be up to date.
+        self.__update_data_crc32()
+        self.__needs_compaction = False
+        try:
+            compact_zip(self.__file_path)
+            self.__data_maps = list()  # existing maps are of the replaced file
+        except Exception as e:
+            logging.error("Exception compacting ndata file: %s", self.__file_path)
+            logging.error(str(e))
+
+    def __is_data_mapped(self):
+        self.__data_maps = [data_map for data_map in self.__data_maps if data_map() is not None]
+        return len(self.__data_maps) > 0
+
+    def __notify_write(self):
+        if callable(self.on_write):
+            self.on_write(self.__file_path)
 
     @property
     def reference(self):
@@ -395,20 +663,33 @@ class NDataHandler:
         """
         if file_path.endswith(".ndata") and os.path.exists(file_path):
             try:
-                with open(file_path, "r+b") as fp:
+                with open(file_path, "rb") as fp:
                     local_files, dir_files, eocd = parse_zip(fp)
-                    contains_data = b"data.npy" in dir_files
-                    contains_metadata = b"metadata.json" in dir_files
-                    file_count = contains_data + contains_metadata  # use fact that True is 1, False is 0
-                    # TODO: make sure ndata isn't compressed, or handle it
-                    if len(dir_files) != file_count or file_count == 0:
-                        return False
-                    return True
+                    return is_ndata_directory(dir_files)
             except Exception as e:
                 logging.error("Exception parsing ndata file: %s", file_path)
                 logging.error(str(e))
         return False
 
+    @classmethod
+    def read_properties_if_matching(cls, file_path):
+        """
+            Return the properties of the given absolute file path if it is an ndata file, otherwise None.
+
+            The file is parsed once, for both the check and the properties.
+        """
+        if file_path.endswith(".ndata") and os.path.exists(file_path):
+            try:
+                with open(file_path, "rb") as fp:
+                    local_files, dir_files, eocd = parse_zip(fp)
+                    if is_ndata_directory(dir_files):
+                        properties = read_json(fp, local_files, dir_files, b"metadata.json")
+                        return properties if properties is not None else dict()
+            except Exception as e:
+                logging.error("Exception parsing ndata file: %s", file_path)
+                logging.error(str(e))
+        return None
+
     @classmethod
     def make(cls, file_path):
         return cls(file_path + ".ndata")
@@ -426,15 +707,50 @@ class NDataHandler:
         """
         with self.__lock:
             assert data is not None
+            self.__properties = None
             absolute_file_path = self.__file_path
             #logging.debug("WRITE data file %s for %s", absolute_file_path, key)
             make_directory_if_needed(os.path.dirname(absolute_file_path))
             properties = self.read_properties() if os.path.exists(absolute_file_path) else dict()
-            write_zip(absolute_file_path, data, properties)
+            # write to a new file so that memory maps of the existing file remain valid.
+            temp_file_path = absolute_file_path + ".temp"
+            write_zip(temp_file_path, data, properties)
+            os.replace(temp_file_path, absolute_file_path)
+            self.__needs_compaction = False
+            self.__needs_data_crc32 = False
+            self.__data_maps = list()  # existing maps are of the replaced file
             # convert to utc time.
             tz_minutes = Utility.local_utcoffset_minutes(file_datetime)
             timestamp = calendar.timegm(file_datetime.timetuple()) - tz_minutes * 60
             os.utime(absolute_file_path, (time.time(), timestamp))
+            self.__notify_write()
+
+    def write_data_region(self, data, region, file_datetime):
+        """
+            Write a region of data to the ndata file specified by reference.
+
+            :param data: the full numpy array data to write
+            :param region: a tuple of slices; the rows selected by the first slice are written
+            :param file_datetime: the datetime for the file
+
+            The rows are written in place unless data read from the file is still memory mapped, since writing
+            in place would change the mapped data. Writes all of data if the stored data is mapped or has a
+            different shape or dtype. The crc32 of the data is updated only once the region reaches the last row.
+        """
+        with self.__lock:
+            assert data is not None
+            absolute_file_path = self.__file_path
+            is_frame_complete = data.ndim == 0 or len(region) == 0 or region[0].indices(data.shape[0])[1] >= data.shape[0]
+            if os.path.exists(absolute_file_path) and not self.__is_data_mapped() and rewrite_zip_data_region(absolute_file_path, data, region, is_frame_complete):
+                self.__needs_data_crc32 = not is_frame_complete
+                self.__properties = None
+                # convert to utc time.
+                tz_minutes = Utility.local_utcoffset_minutes(file_datetime)
+                timestamp = calendar.timegm(file_datetime.timetuple()) - tz_minutes * 60
+                os.utime(absolute_file_path, (time.time(), timestamp))
+                self.__notify_write()
+            else:
+                self.write_data(data, file_datetime)
 
     def write_properties(self, properties, file_datetime):
         """
@@ -448,18 +764,23 @@ class NDataHandler:
             take care to ensure this does not happen.
         """
         with self.__lock:
+            self.__properties = None
             absolute_file_path = self.__file_path
             #logging.debug("WRITE properties %s for %s", absolute_file_path, key)
             make_directory_if_needed(os.path.dirname(absolute_file_path))
             exists = os.path.exists(absolute_file_path)
             if exists:
-                rewrite_zip(absolute_file_path, Utility.clean_dict(properties))
+                unused_size = rewrite_zip(absolute_file_path, Utility.clean_dict(properties))
+                self.__needs_compaction = unused_size > 0
+                if unused_size > 0 and unused_size >= os.path.getsize(absolute_file_path) * self.compaction_min_unused_ratio:
+                    self.__compact()
             else:
                 write_zip(absolute_file_path, None, Utility.clean_dict(properties))
             # convert to utc time.
             tz_minutes = Utility.local_utcoffset_minutes(file_datetime)
             timestamp = calendar.timegm(file_datetime.timetuple()) - tz_minutes * 60
             os.utime(absolute_file_path, (time.time(), timestamp))
+            self.__notify_write()
 
     def read_properties(self):
         """
@@ -469,6 +790,10 @@ class NDataHandler:
             :return: a tuple of the item_uuid and a dict of the properties
         """
         with self.__lock:
+            if self.__properties is not None:
+                # properties read when the file was found; only used once since the file may change later.
+                properties, self.__properties = self.__properties, None
+                return properties
             absolute_file_path = self.__file_path
             with open(absolute_file_path, "rb") as fp:
                 local_files, dir_files, eocd = parse_zip(fp)
@@ -487,6 +812,13 @@ class NDataHandler:
             #logging.debug("READ data file %s", absolute_file_path)
             with open(absolute_file_path, "rb") as fp:
                 local_files, dir_files, eocd = parse_zip(fp)
+                memory_map_min_size = self.memory_map_min_size
+                if memory_map_min_size is not None and b"data.npy" in dir_files:
+                    if local_files[dir_files[b"data.npy"][1]][2] >= memory_map_min_size:
+                        data = map_data(fp, local_files, dir_files, b"data.npy")
+                        if data is not None:
+                            self.__data_maps.append(weakref.ref(data))
+                            return data
                 return read_data(fp, local_files, dir_files, b"data.npy")
             return None
 
@@ -499,5 +831,9 @@ class NDataHandler:
         with self.__lock:
             absolute_file_path = self.__file_path
             #logging.debug("DELETE data file %s", absolute_file_path)
+            self.__needs_compaction = False
+            self.__needs_data_crc32 = False
+            self.__properties = None
             if os.path.isfile(absolute_file_path):
                 os.remove(absolute_file_path)
+            self.__notify_write()
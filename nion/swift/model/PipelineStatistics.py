@@ -0,0 +1,157 @@
+"""
+Latency histograms and frame counts for the stages of the acquisition pipeline.
+
+Each data channel of a hardware source has a PipelineStatistics object. The stages of the pipeline add the time
+they take to it as they process each frame; the statistics can be read while acquisition runs and written to a
+file for later analysis.
+
+Stages which are nested within a larger step, such as writing to storage while updating a data item, can measure
+into the statistics activated for the current thread, since they do not know the data channel they work for.
+"""
+
+# standard libraries
+import contextlib
+import json
+import threading
+import time
+import typing
+
+# third party libraries
+# None
+
+# local libraries
+# None
+
+
+class LatencyHistogram:
+    """A histogram of latencies in power of two buckets.
+
+    Bucket i counts latencies of less than 2**i microseconds and at least 2**(i-1) microseconds; the last bucket
+    also counts all longer latencies.
+    """
+
+    bucket_count = 28  # the last bucket starts at about 67 seconds
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.buckets = [0] * LatencyHistogram.bucket_count
+
+    def add(self, elapsed: float) -> None:
+        index = min(int(elapsed * 1E6).bit_length() if elapsed > 0.0 else 0, LatencyHistogram.bucket_count - 1)
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += elapsed
+        self.minimum = min(self.minimum, elapsed) if self.minimum is not None else elapsed
+        self.maximum = max(self.maximum, elapsed) if self.maximum is not None else elapsed
+
+    def percentile(self, fraction: float) -> typing.Optional[float]:
+        """Return an upper bound in seconds for the latency below which the fraction of latencies fall."""
+        if self.count == 0:
+            return None
+        target_count = fraction * self.count
+        running_count = 0
+        for index, bucket in enumerate(self.buckets):
+            running_count += bucket
+            if running_count >= target_count:
+                return min((2 ** index) / 1E6, self.maximum)
+        return self.maximum
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count > 0 else None,
+            "min": self.minimum,
+            "max": self.maximum,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "buckets": list(self.buckets),
+        }
+
+
+class PipelineStatistics:
+    """Latency histograms for named pipeline stages and counts of named frame events.
+
+    Latencies are in seconds. Thread safe.
+    """
+
+    def __init__(self):
+        self.__lock = threading.RLock()
+        self.__histograms = dict()  # type: typing.Dict[str, LatencyHistogram]
+        self.__counts = dict()  # type: typing.Dict[str, int]
+
+    def add_latency(self, stage: str, elapsed: float) -> None:
+        with self.__lock:
+            histogram = self.__histograms.get(stage)
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self.__histograms[stage] = histogram
+            histogram.add(elapsed)
+
+    def add_count(self, name: str, count: int=1) -> None:
+        with self.__lock:
+            self.__counts[name] = self.__counts.get(name, 0) + count
+
+    @contextlib.contextmanager
+    def measure(self, stage: str):
+        """Add the time taken by the body of the with statement as a latency of stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_latency(stage, time.perf_counter() - start)
+
+    def get_count(self, name: str) -> int:
+        with self.__lock:
+            return self.__counts.get(name, 0)
+
+    def get_histogram(self, stage: str) -> typing.Optional[dict]:
+        with self.__lock:
+            histogram = self.__histograms.get(stage)
+            return histogram.as_dict() if histogram else None
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.__histograms = dict()
+            self.__counts = dict()
+
+    def as_dict(self) -> dict:
+        with self.__lock:
+            return {
+                "stages": {stage: histogram.as_dict() for stage, histogram in self.__histograms.items()},
+                "counts": dict(self.__counts),
+            }
+
+
+_active = threading.local()
+
+
+@contextlib.contextmanager
+def activate(statistics: typing.Optional[PipelineStatistics]):
+    """Make statistics the active statistics of the current thread during the with statement."""
+    old_statistics = getattr(_active, "statistics", None)
+    _active.statistics = statistics
+    try:
+        yield
+    finally:
+        _active.statistics = old_statistics
+
+
+@contextlib.contextmanager
+def measure_active(stage: str):
+    """Add the time taken by the body of the with statement to the active statistics of the thread, if any."""
+    statistics = getattr(_active, "statistics", None)
+    if statistics is not None:
+        with statistics.measure(stage):
+            yield
+    else:
+        yield
+
+
+def write_statistics(statistics_dict: dict, file_path: str) -> None:
+    """Write the statistics dict, for instance from PipelineStatistics.as_dict, to a JSON file."""
+    with open(file_path, "w") as fp:
+        json.dump(statistics_dict, fp, indent=2, sort_keys=True)
@@ -0,0 +1,56 @@
+"""
+Sums of 3d data over 2d masks, computed from the summed area table of the data source when possible.
+
+The results are the same as from Core.function_sum_region. When the mask is one inside a rectangle and zero outside
+of it and the data source of the data has made its summed area table, the sum for each channel is computed from four
+elements of the table, whatever the size of the rectangle. Otherwise the data is summed directly.
+
+Facade.initialize dispatches xd.sum_region of the data api to sum_region.
+"""
+
+# standard libraries
+import typing
+
+# third party libraries
+import numpy
+
+# local libraries
+from nion.data import Core
+from nion.data import DataAndMetadata
+from nion.swift.model import DataItem
+
+
+def _get_mask_rectangle(mask_data: numpy.ndarray) -> typing.Optional[typing.Tuple[int, int, int, int]]:
+    # return the top, bottom, left, and right of the mask if it is one within a rectangle and zero outside of it.
+    rows = numpy.flatnonzero(numpy.any(mask_data, axis=1))
+    columns = numpy.flatnonzero(numpy.any(mask_data, axis=0))
+    if len(rows) == 0:
+        return None
+    top, bottom, left, right = rows[0], rows[-1] + 1, columns[0], columns[-1] + 1
+    if numpy.count_nonzero(mask_data) != (bottom - top) * (right - left) or not numpy.all(mask_data[top:bottom, left:right] == 1):
+        return None
+    return top, bottom, left, right
+
+
+def sum_region(data_and_metadata: DataAndMetadata.DataAndMetadata, mask_data_and_metadata: DataAndMetadata.DataAndMetadata) -> typing.Optional[DataAndMetadata.DataAndMetadata]:
+    """Return the sum of the data over the mask. The same as Core.function_sum_region."""
+    summed_area_table = DataItem.BufferedDataSource.get_summed_area_table_of_data(data_and_metadata) if data_and_metadata else None
+    mask_data = mask_data_and_metadata.data if mask_data_and_metadata else None
+    if summed_area_table is not None and mask_data is not None and mask_data.shape == tuple(data_and_metadata.data_shape[0:2]):
+        rectangle = _get_mask_rectangle(mask_data)
+        if rectangle is not None:
+            top, bottom, left, right = rectangle
+            # the dtype and calibrations of the result are those of the sum over the top left pixel of the rectangle,
+            # which Core sums quickly.
+            pixel_xdata = DataAndMetadata.new_data_and_metadata(data_and_metadata.data[top:top + 1, left:left + 1],
+                                                                data_and_metadata.intensity_calibration,
+                                                                data_and_metadata.dimensional_calibrations,
+                                                                data_descriptor=data_and_metadata.data_descriptor)
+            pixel_mask_xdata = DataAndMetadata.new_data_and_metadata(mask_data[top:top + 1, left:left + 1])
+            pixel_sum_xdata = Core.function_sum_region(pixel_xdata, pixel_mask_xdata)
+            result_data = summed_area_table[bottom, right] - summed_area_table[top, right] - summed_area_table[bottom, left] + summed_area_table[top, left]
+            return DataAndMetadata.new_data_and_metadata(result_data.astype(pixel_sum_xdata.data_dtype),
+                                                         pixel_sum_xdata.intensity_calibration,
+                                                         pixel_sum_xdata.dimensional_calibrations,
+                                                         data_descriptor=pixel_sum_xdata.data_descriptor)
+    return Core.function_sum_region(data_and_metadata, mask_data_and_metadata)
@@ -408,15 +408,26 @@ class Computation(Observable.Observable, Persistence.PersistentObject):
         self.__bound_item_changed_event_listeners = dict()
         self.__variable_property_changed_listener = dict()
         self.last_evaluate_data_time = 0
+        self.evaluation_cost = 0.0  # smoothed duration of recent evaluations, in seconds
+        self.target_rate = None  # maximum evaluations per second for this computation; None for no limit
+        self.timings = dict()  # smoothed duration of the bind, compile, execute, and merge steps, in seconds
+        self.__compiled_code = None  # tuple of expression and its compiled code
+        self.__api_objects = dict()  # map variable uuid to tuple of api, resolved object, and api object
         self.needs_update = expression is not None
         self.computation_mutated_event = Event.Event()
         self.variable_inserted_event = Event.Event()
         self.variable_removed_event = Event.Event()
         self._evaluation_count_for_test = 0
+        self._compile_count_for_test = 0
 
     def read_from_dict(self, properties):
         super().read_from_dict(properties)
 
+    def about_to_be_removed(self):
+        # release the cached api objects so that they do not outlive the objects they wrap
+        self.__api_objects = dict()
+        self.__compiled_code = None
+
     def __error_changed(self, name, value):
         self.notify_property_changed(name)
         self.computation_mutated_event.fire()
@@ -469,6 +480,7 @@ class Computation(Observable.Observable, Persistence.PersistentObject):
         if value != self.original_expression:
             self.original_expression = value
             self.processing_id = None
+            self.__compiled_code = None
             self.needs_update = True
             self.computation_mutated_event.fire()
 
@@ -488,12 +500,22 @@ class Computation(Observable.Observable, Persistence.PersistentObject):
             pass
         return names
 
+    def record_timing(self, step: str, elapsed: float) -> None:
+        """Add the duration of an evaluation step to the smoothed timings.
+
+        The steps are bind, compile, and execute, which are recorded during evaluate_with_target, and merge, which
+        is recorded by the caller when it applies the results to the target.
+        """
+        timing = self.timings.get(step)
+        self.timings[step] = 0.8 * timing + 0.2 * elapsed if timing else elapsed
+
     def evaluate_with_target(self, api, target) -> str:
         assert target is not None
         error_text = None
         needs_update = self.needs_update
         self.needs_update = False
         if needs_update:
+            start_time = time.perf_counter()
             variables = dict()
             for variable in self.variables:
                 bound_object = self.__bound_items.get(variable.uuid)
@@ -502,8 +524,10 @@ class Computation(Observable.Observable, Persistence.PersistentObject):
                     # in the ideal world, we could clone the object/data and computations would not be
                     # able to modify the input objects; reality, though, dictates that performance is
                     # more important than this protection. so use the resolved object directly.
-                    api_object = api._new_api_object(resolved_object) if resolved_object else None
+                    api_object = self.__get_api_object(api, variable, resolved_object)
                     variables[variable.name] = api_object if api_object else resolved_object  # use api only if resolved_object is an api style object
+            bind_time = time.perf_counter()
+            self.record_timing("bind", bind_time - start_time)
 
             expression = self.original_expression
             if expression:
@@ -511,21 +535,42 @@ class Computation(Observable.Observable, Persistence.PersistentObject):
 
             self._evaluation_count_for_test += 1
             self.last_evaluate_data_time = time.perf_counter()
+            evaluation_time = self.last_evaluate_data_time - start_time
+            self.evaluation_cost = 0.8 * self.evaluation_cost + 0.2 * evaluation_time if self.evaluation_cost else evaluation_time
         return error_text
 
+    def __get_api_object(self, api, variable: ComputationVariable, resolved_object):
+        # api objects only wrap the resolved object, so the same api object can be reused for as long as the
+        # variable resolves to the same object.
+        if not resolved_object:
+            return None
+        cached_api, cached_resolved_object, api_object = self.__api_objects.get(variable.uuid, (None, None, None))
+        if cached_api is not api or cached_resolved_object is not resolved_object:
+            api_object = api._new_api_object(resolved_object)
+            self.__api_objects[variable.uuid] = api, resolved_object, api_object
+        return api_object
+
+    def __get_compiled_code(self, expression: str):
+        # the cache is keyed by the expression so that a new expression is always compiled.
+        compiled_code = self.__compiled_code
+        if compiled_code is None or compiled_code[0] != expression:
+            compiled_code = expression, compile(expression, "expr", "exec")
+            self.__compiled_code = compiled_code
+            self._compile_count_for_test += 1
+        return compiled_code[1]
+
     def __execute_code(self, api, expression, target, variables) -> typing.Optional[str]:
-        code_lines = []
         g = variables
         g["api"] = api
         g["target"] = target
         l = dict()
-        expression_lines = expression.split("\n")
-        code_lines.extend(expression_lines)
-        code = "\n".join(code_lines)
         try:
-            # print(code)
-            compiled = compile(code, "expr", "exec")
+            start_time = time.perf_counter()
+            compiled = self.__get_compiled_code(expression)
+            compile_time = time.perf_counter()
+            self.record_timing("compile", compile_time - start_time)
             exec(compiled, g, l)
+            self.record_timing("execute", time.perf_counter() - compile_time)
         except Exception as e:
             # import sys, traceback
             # traceback.print_exc()
@@ -559,6 +604,7 @@ class Computation(Observable.Observable, Persistence.PersistentObject):
         self.__variable_needs_rebind_event_listeners[variable.uuid] = variable.needs_rebind_event.listen(rebind)
 
     def __unbind_variable(self, variable: ComputationVariable) -> None:
+        self.__api_objects.pop(variable.uuid, None)
         self.__variable_changed_event_listeners[variable.uuid].close()
         del self.__variable_changed_event_listeners[variable.uuid]
         self.__variable_needs_rebind_event_listeners[variable.uuid].close()
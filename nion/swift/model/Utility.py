@@ -5,6 +5,7 @@ import contextlib
 import datetime
 import functools
 import logging
+import os
 import sys
 import threading
 import time
@@ -216,6 +217,24 @@ def clean_item_no_list(i):
     return None
 
 
+def get_nested_strings(item, keys=None) -> set:
+    """
+        Return the set of strings within a json-clean item, including those within its dicts and lists. If keys is
+        given, only return the strings which are values of those keys in dicts.
+    """
+    strings = set()
+    items = [(None, item)]
+    while items:
+        key, item = items.pop()
+        if isinstance(item, dict):
+            items.extend(item.items())
+        elif isinstance(item, (list, tuple)):
+            items.extend((None, list_item) for list_item in item)
+        elif isinstance(item, str) and (keys is None or key in keys):
+            strings.add(item)
+    return strings
+
+
 def parse_version(version, count=3, max_count=None):
     max_count = max_count if max_count is not None else count
     version_components = [int(version_component) for version_component in version.split(".")]
@@ -245,6 +264,14 @@ def compare_versions(version1: str, version2: str) -> int:
     return 0
 
 
+def get_available_memory():
+    """Return the physical memory available now in bytes, or None if it is not known on this platform."""
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
 def fps_tick(fps_id):
     v = globals().setdefault("__fps_" + fps_id, [0, 0.0, None, 0.0, None, []])
     v[0] += 1
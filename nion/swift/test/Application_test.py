@@ -14,16 +14,27 @@ import unittest
 # local libraries
 from nion.swift import Application
 from nion.swift.model import Cache
+from nion.swift.model import DataItem
+from nion.swift.model import DocumentModel
+from nion.swift.model import NDataHandler
 from nion.ui import TestUI
 
 
 class TestApplicationClass(unittest.TestCase):
 
+    document_model_settings = ("computation_min_period", "computation_max_load", "computation_thread_count", "persistent_storage_write_delay")
+
     def setUp(self):
-        pass
+        # starting the application configures the document model class; restore it for other tests.
+        self.__document_model_settings = {key: getattr(DocumentModel.DocumentModel, key) for key in self.document_model_settings}
+        self.__memory_map_min_size = NDataHandler.NDataHandler.memory_map_min_size
+        self.__summed_area_table_max_size = DataItem.BufferedDataSource.summed_area_table_max_size
 
     def tearDown(self):
-        pass
+        for key, value in self.__document_model_settings.items():
+            setattr(DocumentModel.DocumentModel, key, value)
+        NDataHandler.NDataHandler.memory_map_min_size = self.__memory_map_min_size
+        DataItem.BufferedDataSource.summed_area_table_max_size = self.__summed_area_table_max_size
 
     def test_switching_library_closes_document_only_once(self):
         current_working_directory = os.getcwd()
@@ -1,13 +1,17 @@
 # standard libraries
+import contextlib
 import logging
+import os
 import unittest
 import uuid
 
 # third party libraries
-# None
+import numpy
 
 # local libraries
 from nion.swift.model import Cache
+from nion.swift.model import DataItem
+from nion.swift.model import DocumentModel
 
 
 class TestSuspendableCacheClass(unittest.TestCase):
@@ -55,6 +59,232 @@ class TestSuspendableCacheClass(unittest.TestCase):
         suspendable_cache.spill_cache()
         self.assertTrue(suspendable_cache.get_cached_value(suspendable_cache, "key", False))
 
+    def test_values_held_while_suspended_are_counted_in_storage_budget_and_written_when_over_budget(self):
+        lru_storage_cache = Cache.LruStorageCache(Cache.DictStorageCache(), max_bytes=10000)
+        suspendable_cache = Cache.SuspendableCache(lru_storage_cache)
+        suspendable_cache.max_bytes = 3000
+        targets = [TestLruStorageCacheClass.Target() for i in range(3)]
+        suspendable_cache.suspend_cache()
+        suspendable_cache.set_cached_value(targets[0], "key", numpy.zeros((1000, ), dtype=numpy.uint8))
+        suspendable_cache.set_cached_value(targets[1], "key", numpy.zeros((1000, ), dtype=numpy.uint8))
+        self.assertEqual(suspendable_cache.byte_count, 2000)
+        self.assertEqual(lru_storage_cache.reserved_byte_count, 2000)
+        self.assertEqual(lru_storage_cache.byte_count, 0)
+        suspendable_cache.set_cached_value(targets[2], "key", numpy.zeros((2000, ), dtype=numpy.uint8))
+        self.assertEqual(suspendable_cache.byte_count, 0)
+        self.assertEqual(lru_storage_cache.reserved_byte_count, 0)
+        self.assertEqual(lru_storage_cache.byte_count, 4000)
+        suspendable_cache.spill_cache()
+
+    def test_releasing_target_writes_its_held_values(self):
+        storage_cache = Cache.DictStorageCache()
+        suspendable_cache = Cache.SuspendableCache(storage_cache)
+        targets = [TestLruStorageCacheClass.Target() for i in range(2)]
+        suspendable_cache.suspend_cache()
+        suspendable_cache.set_cached_value(targets[0], "key", numpy.zeros((1000, ), dtype=numpy.uint8), True)
+        suspendable_cache.set_cached_value(targets[1], "key", numpy.zeros((500, ), dtype=numpy.uint8))
+        suspendable_cache.release_cached_values(targets[0])
+        self.assertEqual(suspendable_cache.byte_count, 500)
+        self.assertEqual(storage_cache.get_cached_value(targets[0], "key").shape, (1000, ))
+        self.assertTrue(storage_cache.is_cached_value_dirty(targets[0], "key"))
+        self.assertIsNone(storage_cache.get_cached_value(targets[1], "key"))
+        suspendable_cache.spill_cache()
+        self.assertEqual(storage_cache.get_cached_value(targets[1], "key").shape, (500, ))
+
+
+class TestShadowCacheClass(unittest.TestCase):
+
+    def test_values_held_before_storage_cache_is_set_are_bounded(self):
+        shadow_cache = Cache.ShadowCache()
+        shadow_cache.max_bytes = 2500
+        target = TestLruStorageCacheClass.Target()
+        for key in ("a", "b", "c"):
+            shadow_cache.set_cached_value(target, key, numpy.zeros((1000, ), dtype=numpy.uint8))
+        self.assertIsNone(shadow_cache.get_cached_value(target, "a"))
+        self.assertTrue(shadow_cache.is_cached_value_dirty(target, "a"))
+        self.assertIsNotNone(shadow_cache.get_cached_value(target, "c"))
+        shadow_cache.release_cached_values(target)
+        self.assertIsNone(shadow_cache.get_cached_value(target, "c"))
+
+
+class TestDictStorageCacheClass(unittest.TestCase):
+
+    def test_least_recently_written_values_are_dropped_when_over_budget(self):
+        storage_cache = Cache.DictStorageCache(max_bytes=2500)
+        targets = [TestLruStorageCacheClass.Target() for i in range(3)]
+        for target in targets:
+            storage_cache.set_cached_value(target, "key", numpy.zeros((1000, ), dtype=numpy.uint8), False)
+        self.assertIsNone(storage_cache.get_cached_value(targets[0], "key"))
+        self.assertTrue(storage_cache.is_cached_value_dirty(targets[0], "key"))
+        self.assertEqual(storage_cache.byte_count, 2000)
+        storage_cache.reserve_bytes(1000)
+        self.assertIsNone(storage_cache.get_cached_value(targets[1], "key"))
+        self.assertIsNotNone(storage_cache.get_cached_value(targets[2], "key"))
+
+
+class TestDbStorageCacheClass(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    class Target:
+        def __init__(self):
+            self.uuid = uuid.uuid4()
+
+    def test_values_and_dirty_flags_are_visible_before_and_after_flush(self):
+        storage_cache = Cache.DbStorageCache(":memory:")
+        try:
+            storage_cache.flush_interval = 3600
+            target = TestDbStorageCacheClass.Target()
+            data = numpy.arange(12, dtype=numpy.uint32).reshape(3, 4)
+            storage_cache.set_cached_value(target, "thumbnail_data", data)
+            storage_cache.set_cached_value(target, "value", {"a": 1}, dirty=True)
+            storage_cache.set_cached_value_dirty(target, "missing", False)
+            for i in range(2):
+                self.assertTrue(numpy.array_equal(storage_cache.get_cached_value(target, "thumbnail_data"), data))
+                self.assertEqual(storage_cache.get_cached_value(target, "value"), {"a": 1})
+                self.assertFalse(storage_cache.is_cached_value_dirty(target, "thumbnail_data"))
+                self.assertTrue(storage_cache.is_cached_value_dirty(target, "value"))
+                self.assertTrue(storage_cache.is_cached_value_dirty(target, "missing"))
+                self.assertIsNone(storage_cache.get_cached_value(target, "missing"))
+                storage_cache.flush()
+            storage_cache.remove_cached_value(target, "value")
+            self.assertIsNone(storage_cache.get_cached_value(target, "value"))
+        finally:
+            storage_cache.close()
+
+    def test_get_many_returns_values_and_keeps_rows_for_subsequent_reads(self):
+        storage_cache = Cache.DbStorageCache(":memory:")
+        try:
+            targets = [TestDbStorageCacheClass.Target() for i in range(4)]
+            for i, target in enumerate(targets[:3]):
+                storage_cache.set_cached_value(target, "thumbnail_data", numpy.full((2, 2), i, dtype=numpy.uint32), dirty=i == 1)
+            storage_cache.flush()
+            storage_cache.set_cached_value(targets[2], "thumbnail_data", numpy.full((2, 2), 7, dtype=numpy.uint32))
+            values = storage_cache.get_many([(target, "thumbnail_data") for target in targets])
+            self.assertEqual([value[0, 0] for value in values[:3]], [0, 1, 7])
+            self.assertIsNone(values[3])
+            self.assertTrue(storage_cache.is_cached_value_dirty(targets[1], "thumbnail_data"))
+            self.assertEqual(storage_cache.get_cached_value(targets[1], "thumbnail_data")[0, 0], 1)
+            storage_cache.set_cached_value(targets[0], "thumbnail_data", numpy.full((2, 2), 5, dtype=numpy.uint32))
+            self.assertEqual(storage_cache.get_cached_value(targets[0], "thumbnail_data")[0, 0], 5)
+        finally:
+            storage_cache.close()
+
+    def test_get_many_keeps_at_most_prefetch_max_count_rows(self):
+        storage_cache = Cache.DbStorageCache(":memory:")
+        try:
+            storage_cache.prefetch_max_count = 2
+            targets = [TestDbStorageCacheClass.Target() for i in range(4)]
+            for i, target in enumerate(targets):
+                storage_cache.set_cached_value(target, "thumbnail_data", numpy.full((2, 2), i, dtype=numpy.uint32))
+            storage_cache.flush()
+            values = storage_cache.get_many([(target, "thumbnail_data") for target in targets])
+            self.assertEqual([value[0, 0] for value in values], [0, 1, 2, 3])
+            self.assertEqual(len(storage_cache._prefetched), 2)
+            self.assertEqual(storage_cache.get_cached_value(targets[3], "thumbnail_data")[0, 0], 3)
+        finally:
+            storage_cache.close()
+
+    def test_cached_values_are_written_when_closed(self):
+        current_working_directory = os.getcwd()
+        cache_name = os.path.join(current_working_directory, "__Test.nscache")
+        Cache.db_make_directory_if_needed(os.path.dirname(cache_name))
+        try:
+            target = TestDbStorageCacheClass.Target()
+            storage_cache = Cache.DbStorageCache(cache_name)
+            storage_cache.flush_interval = 3600
+            storage_cache.set_cached_value(target, "thumbnail_data", numpy.ones((4, 4), dtype=numpy.float32))
+            storage_cache.set_cached_value(target, "value", [1, 2, 3])
+            storage_cache.close()
+            storage_cache = Cache.DbStorageCache(cache_name)
+            try:
+                thumbnail_data = storage_cache.get_cached_value(target, "thumbnail_data")
+                self.assertEqual(thumbnail_data.dtype, numpy.float32)
+                self.assertTrue(numpy.array_equal(thumbnail_data, numpy.ones((4, 4), dtype=numpy.float32)))
+                self.assertEqual(storage_cache.get_cached_value(target, "value"), [1, 2, 3])
+            finally:
+                storage_cache.close()
+        finally:
+            os.remove(cache_name)
+
+
+class TestLruStorageCacheClass(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    class Target:
+        def __init__(self):
+            self.uuid = uuid.uuid4()
+
+    def test_values_are_read_from_memory_after_first_read(self):
+        storage_cache = Cache.DictStorageCache()
+        lru_storage_cache = Cache.LruStorageCache(storage_cache)
+        target = TestLruStorageCacheClass.Target()
+        storage_cache.set_cached_value(target, "key", numpy.zeros((4, 4), dtype=numpy.uint32), dirty=True)
+        self.assertEqual(lru_storage_cache.get_cached_value(target, "key").shape, (4, 4))
+        self.assertEqual(lru_storage_cache.miss_count, 1)
+        self.assertTrue(lru_storage_cache.is_cached_value_dirty(target, "key"))
+        storage_cache.remove_cached_value(target, "key")
+        self.assertEqual(lru_storage_cache.get_cached_value(target, "key").shape, (4, 4))
+        self.assertTrue(lru_storage_cache.is_cached_value_dirty(target, "key"))
+        self.assertEqual(lru_storage_cache.hit_count, 1)
+        self.assertEqual(lru_storage_cache.byte_count, 64)
+        lru_storage_cache.remove_cached_value(target, "key")
+        self.assertIsNone(lru_storage_cache.get_cached_value(target, "key"))
+        self.assertEqual(lru_storage_cache.byte_count, 0)
+
+    def test_least_recently_used_values_are_evicted_when_over_budget(self):
+        storage_cache = Cache.DictStorageCache()
+        lru_storage_cache = Cache.LruStorageCache(storage_cache, max_bytes=4000)
+        targets = [TestLruStorageCacheClass.Target() for i in range(4)]
+        for target in targets[:3]:
+            lru_storage_cache.set_cached_value(target, "key", numpy.zeros((1000, ), dtype=numpy.uint8))
+        lru_storage_cache.get_cached_value(targets[0], "key")
+        lru_storage_cache.set_cached_value(targets[3], "key", numpy.zeros((1500, ), dtype=numpy.uint8))
+        self.assertEqual(lru_storage_cache.eviction_count, 1)
+        self.assertEqual(lru_storage_cache.byte_count, 3500)
+        self.assertEqual(lru_storage_cache.statistics["count"], 3)
+        # the evicted value is still available from the storage cache
+        hit_count = lru_storage_cache.hit_count
+        self.assertIsNotNone(lru_storage_cache.get_cached_value(targets[1], "key"))
+        self.assertEqual(lru_storage_cache.hit_count, hit_count)
+        self.assertIsNotNone(lru_storage_cache.get_cached_value(targets[0], "key"))
+        self.assertLessEqual(lru_storage_cache.byte_count, 4000)
+
+    def test_values_of_released_target_are_removed_from_memory_only(self):
+        storage_cache = Cache.DictStorageCache()
+        lru_storage_cache = Cache.LruStorageCache(storage_cache)
+        targets = [TestLruStorageCacheClass.Target() for i in range(2)]
+        for target in targets:
+            lru_storage_cache.set_cached_value(target, "a", numpy.zeros((100, ), dtype=numpy.uint8))
+            lru_storage_cache.set_cached_value(target, "b", numpy.zeros((100, ), dtype=numpy.uint8))
+        lru_storage_cache.release_cached_values(targets[0])
+        self.assertEqual(lru_storage_cache.byte_count, 200)
+        self.assertEqual(lru_storage_cache.statistics["count"], 2)
+        miss_count = lru_storage_cache.miss_count
+        self.assertIsNotNone(lru_storage_cache.get_cached_value(targets[0], "a"))
+        self.assertEqual(lru_storage_cache.miss_count, miss_count + 1)
+
+    def test_values_of_closed_display_are_released(self):
+        lru_storage_cache = Cache.LruStorageCache(Cache.DictStorageCache())
+        document_model = DocumentModel.DocumentModel(storage_cache=lru_storage_cache)
+        with contextlib.closing(document_model):
+            data_item = DataItem.DataItem(numpy.zeros((8, 8)))
+            document_model.append_data_item(data_item)
+            display = data_item.displays[0]
+            display._display_cache.set_cached_value(display, "key", numpy.zeros((100, ), dtype=numpy.uint8))
+            self.assertEqual(lru_storage_cache.byte_count, 100)
+            document_model.remove_data_item(data_item)
+            self.assertEqual(lru_storage_cache.byte_count, 0)
+
 if __name__ == '__main__':
     logging.getLogger().setLevel(logging.DEBUG)
     unittest.main()
@@ -541,13 +541,34 @@ class TestDataItemClass(unittest.TestCase):
             display_specifier.data_item.set_data(numpy.ones((8, 8), numpy.uint32))
             self.assertTrue(inverted_display_specifier.data_item.computation.needs_update)
             document_model.recompute_one()
-            document_model.recompute_one()
             self.assertFalse(inverted_display_specifier.data_item.computation.needs_update)
             self.assertTrue(inverted2_display_specifier.data_item.computation.needs_update)
             document_model.recompute_all()
             self.assertFalse(inverted_display_specifier.data_item.computation.needs_update)
             self.assertFalse(inverted2_display_specifier.data_item.computation.needs_update)
 
+    def test_recompute_one_evaluates_the_first_computation_of_a_chain_before_its_dependents(self):
+        document_model = DocumentModel.DocumentModel()
+        with contextlib.closing(document_model):
+            data_item = DataItem.DataItem(numpy.zeros((8, 8), numpy.uint32))
+            document_model.append_data_item(data_item)
+            inverted_data_item = document_model.get_invert_new(data_item)
+            inverted2_data_item = document_model.get_invert_new(inverted_data_item)
+            document_model.recompute_all()
+            statistics = document_model.computation_statistics
+            # a single recompute_one evaluates the computation of the changed source, even if a request for the
+            # dependent computation is queued ahead of it, and evaluates it once.
+            data_item.set_data(numpy.ones((8, 8), numpy.uint32))
+            document_model.recompute_one()
+            self.assertFalse(inverted_data_item.computation.needs_update)
+            self.assertTrue(inverted2_data_item.computation.needs_update)
+            self.assertEqual(statistics["evaluated"] + 1, document_model.computation_statistics["evaluated"])
+            # the next recompute_one evaluates the dependent computation from the merged result
+            document_model.recompute_one()
+            self.assertFalse(inverted2_data_item.computation.needs_update)
+            self.assertEqual(statistics["evaluated"] + 2, document_model.computation_statistics["evaluated"])
+            self.assertTrue(numpy.array_equal(inverted2_data_item.data, numpy.ones((8, 8))))
+
     def test_data_item_that_is_recomputed_notifies_listeners_of_a_single_data_change(self):
         # this test ensures that doing a recompute_data is efficient and doesn't produce
         # extra data_item_content_changed messages.
@@ -1207,6 +1228,26 @@ class TestDataItemClass(unittest.TestCase):
                 Utility.local_timezone_override = None
                 Utility.local_utcoffset_override = None
 
+    def test_data_items_created_in_quick_succession_have_unique_created_times(self):
+        created_list = [DataItem.DataItem().created for i in range(20)]
+        self.assertEqual(len(set(created_list)), len(created_list))
+        self.assertEqual(sorted(created_list), created_list)
+
+    def test_data_item_read_from_storage_has_only_stored_displays(self):
+        memory_persistent_storage_system = DocumentModel.MemoryStorageSystem()
+        document_model = DocumentModel.DocumentModel(persistent_storage_systems=[memory_persistent_storage_system])
+        with contextlib.closing(document_model):
+            data_item = DataItem.DataItem(numpy.zeros((8, 8), numpy.uint32))
+            document_model.append_data_item(data_item)
+            data_item.displays[0].add_graphic(Graphics.RectangleGraphic())
+            display_uuid = data_item.displays[0].uuid
+        document_model = DocumentModel.DocumentModel(persistent_storage_systems=[memory_persistent_storage_system])
+        with contextlib.closing(document_model):
+            data_item = document_model.data_items[0]
+            self.assertEqual(len(data_item.displays), 1)
+            self.assertEqual(data_item.displays[0].uuid, display_uuid)
+            self.assertEqual(len(data_item.displays[0].graphics), 1)
+
     # modify property/item/relationship on data source, display, region, etc.
     # copy or snapshot
 
@@ -15,6 +15,7 @@ from nion.swift.model import DataGroup
 from nion.swift.model import DataItem
 from nion.swift.model import DataItemsBinding
 from nion.swift.model import DocumentModel
+from nion.ui import DrawingContext
 from nion.ui import TestUI
 from nion.utils import Geometry
 
@@ -600,6 +601,36 @@ class TestDataPanelClass(unittest.TestCase):
             data_panel.data_list_controller.scroll_bar_canvas_item.simulate_drag((8, 8), (24, 8))
             self.assertEqual(data_panel.data_list_controller.scroll_area_canvas_item.content.canvas_rect, Geometry.IntRect((-80, 0), (800, 304)))
 
+    def test_data_panel_prefetches_thumbnails_of_visible_items_when_drawn(self):
+        document_model = DocumentModel.DocumentModel()
+        document_controller = DocumentController.DocumentController(self.app.ui, document_model, workspace_id="library")
+        with contextlib.closing(document_controller):
+            for _ in range(10):
+                document_model.append_data_item(DataItem.DataItem(numpy.zeros((8, 8), numpy.uint32)))
+            document_controller.periodic()
+            data_panel = document_controller.find_dock_widget("data-panel").panel
+            data_list_controller = data_panel.data_list_controller
+            data_list_controller.thumbnail_prefetch_count = 3
+            prefetched_display_items = list()
+            prefetch_thumbnails = data_list_controller.on_prefetch_thumbnails
+            def record_prefetch_thumbnails(display_items):
+                prefetched_display_items.append(display_items)
+                prefetch_thumbnails(display_items)
+            data_list_controller.on_prefetch_thumbnails = record_prefetch_thumbnails
+            data_panel._data_list_widget.content_widget.children[0].canvas_item.layout_immediate(Geometry.IntSize(width=320, height=160))
+            self.assertEqual(len(prefetched_display_items), 0)
+            scroll_area_canvas_item = data_list_controller.scroll_area_canvas_item
+            # the two visible items are read in one batch along with the next one
+            scroll_area_canvas_item.content._repaint_visible(DrawingContext.DrawingContext(), scroll_area_canvas_item.visible_rect)
+            display_items = data_list_controller.display_items
+            self.assertEqual(prefetched_display_items, [display_items[0:3]])
+            # drawing again reads nothing; scrolling to items not read yet reads the next batch
+            scroll_area_canvas_item.content._repaint_visible(DrawingContext.DrawingContext(), scroll_area_canvas_item.visible_rect)
+            self.assertEqual(len(prefetched_display_items), 1)
+            data_list_controller.scroll_bar_canvas_item.simulate_drag((8, 8), (24, 8))
+            scroll_area_canvas_item.content._repaint_visible(DrawingContext.DrawingContext(), scroll_area_canvas_item.visible_rect)
+            self.assertEqual(prefetched_display_items, [display_items[0:3], display_items[3:6]])
+
     def test_data_panel_grid_contents_resize_properly(self):
         document_model = DocumentModel.DocumentModel()
         document_controller = DocumentController.DocumentController(self.app.ui, document_model, workspace_id="library")
@@ -3,6 +3,7 @@ import contextlib
 import copy
 import gc
 import random
+import time
 import unittest
 
 # third party libraries
@@ -90,6 +91,48 @@ class TestDocumentModelClass(unittest.TestCase):
             self.assertEqual(len(document_model.data_items), len(set([d.uuid for d in document_model.data_items])))
             self.assertEqual(len(document_model.data_items), 1)
 
+    def test_loading_document_defers_displays_of_data_items_not_referenced_by_computations_or_connections(self):
+        memory_persistent_storage_system = DocumentModel.MemoryStorageSystem()
+        document_model = DocumentModel.DocumentModel(persistent_storage_systems=[memory_persistent_storage_system])
+        with contextlib.closing(document_model):
+            data_item = DataItem.DataItem(numpy.zeros((8, 8)))
+            document_model.append_data_item(data_item)
+            graphic = Graphics.RectangleGraphic()
+            data_item.displays[0].add_graphic(graphic)
+            graphic_uuid = graphic.uuid
+            data_item_uuid = data_item.uuid
+            source_data_item = DataItem.DataItem(numpy.zeros((8, 8)))
+            document_model.append_data_item(source_data_item)
+            line_profile_data_item = document_model.get_line_profile_new(source_data_item)
+            document_model.recompute_all()
+            source_data_item_uuid = source_data_item.uuid
+            line_profile_data_item_uuid = line_profile_data_item.uuid
+        document_model = DocumentModel.DocumentModel(persistent_storage_systems=[memory_persistent_storage_system])
+        with contextlib.closing(document_model):
+            data_item = document_model.get_data_item_by_uuid(data_item_uuid)
+            self.assertTrue(data_item._are_displays_deferred)
+            # the source of the line profile and the line profile itself are referenced by the computation
+            self.assertFalse(document_model.get_data_item_by_uuid(source_data_item_uuid)._are_displays_deferred)
+            self.assertFalse(document_model.get_data_item_by_uuid(line_profile_data_item_uuid)._are_displays_deferred)
+            # finding the graphic reads the displays of the data item containing it
+            self.assertEqual(document_model.get_graphic_by_uuid(graphic_uuid).uuid, graphic_uuid)
+            self.assertFalse(data_item._are_displays_deferred)
+            self.assertEqual(len(data_item.displays[0].graphics), 1)
+            data_item.title = "title"
+        document_model = DocumentModel.DocumentModel(persistent_storage_systems=[memory_persistent_storage_system])
+        with contextlib.closing(document_model):
+            data_item = document_model.get_data_item_by_uuid(data_item_uuid)
+            self.assertEqual(data_item.title, "title")
+            self.assertTrue(data_item._are_displays_deferred)
+            # changing a deferred data item keeps its displays
+            data_item.title = "title2"
+        document_model = DocumentModel.DocumentModel(persistent_storage_systems=[memory_persistent_storage_system])
+        with contextlib.closing(document_model):
+            data_item = document_model.get_data_item_by_uuid(data_item_uuid)
+            self.assertEqual(data_item.title, "title2")
+            self.assertEqual(len(data_item.displays), 1)
+            self.assertEqual(data_item.displays[0].graphics[0].uuid, graphic_uuid)
+
     def test_document_model_releases_data_item(self):
         # test memory usage
         document_model = DocumentModel.DocumentModel()
@@ -118,6 +161,50 @@ class TestDocumentModelClass(unittest.TestCase):
             self.assertEqual(len(data_item.displays[0].graphics[0].interval_descriptors), 1)
             self.assertEqual(data_item.displays[0].graphics[0].interval_descriptors[0]["interval"], interval.interval)
 
+    def test_processing_pick_region_sums_rectangle_using_summed_area_table(self):
+        summed_area_table_max_size = DataItem.BufferedDataSource.summed_area_table_max_size
+        DataItem.BufferedDataSource.summed_area_table_max_size = 1024 * 1024
+        try:
+            document_model = DocumentModel.DocumentModel()
+            with contextlib.closing(document_model):
+                d = (100 * numpy.random.randn(8, 10, 16)).astype(numpy.int32)
+                data_item = DataItem.DataItem(d)
+                document_model.append_data_item(data_item)
+                pick_region = Graphics.RectangleGraphic()
+                pick_region.bounds = (0.25, 0.2), (0.5, 0.3)
+                data_item.displays[0].add_graphic(pick_region)
+                pick_data_item = document_model.get_pick_region_new(data_item, pick_region=pick_region)
+                document_model.recompute_all()
+                self.assertIn("xd.sum_region(", pick_data_item.computation.expression)
+                # the first sum is made from the data while the table is made
+                self.assertTrue(numpy.array_equal(pick_data_item.data, numpy.sum(d[2:7, 2:6, :], axis=(0, 1))))
+                sum_dtype = pick_data_item.data.dtype
+                summed_area_table = data_item.data_source.get_summed_area_table(wait=True)
+                self.assertIsNotNone(summed_area_table)
+                self.assertEqual(summed_area_table.dtype, numpy.int64)
+                self.assertIs(summed_area_table, DataItem.BufferedDataSource.get_summed_area_table_of_data(data_item.xdata))
+                # sums made from the table have the same dtype as those made from the data
+                pick_region.bounds = (0.5, 0.5), (0.5, 0.5)
+                document_model.recompute_all()
+                self.assertTrue(numpy.array_equal(pick_data_item.data, numpy.sum(d[4:, 5:, :], axis=(0, 1))))
+                self.assertEqual(pick_data_item.data.dtype, sum_dtype)
+                # the table is made again when the data changes
+                d = d + 1
+                data_item.set_data(d)
+                self.assertIsNone(data_item.data_source.get_summed_area_table())
+                data_item.data_source.get_summed_area_table(wait=True)
+                document_model.recompute_all()
+                self.assertTrue(numpy.array_equal(pick_data_item.data, numpy.sum(d[4:, 5:, :], axis=(0, 1))))
+                # the result is the same without a table
+                DataItem.BufferedDataSource.summed_area_table_max_size = 1024
+                data_item.set_data(d)
+                self.assertIsNone(data_item.data_source.get_summed_area_table(wait=True))
+                pick_region.bounds = (0.25, 0.2), (0.5, 0.3)
+                document_model.recompute_all()
+                self.assertTrue(numpy.array_equal(pick_data_item.data, numpy.sum(d[2:7, 2:6, :], axis=(0, 1))))
+        finally:
+            DataItem.BufferedDataSource.summed_area_table_max_size = summed_area_table_max_size
+
     def test_processing_pick_configures_in_and_out_regions_and_connection(self):
         document_model = DocumentModel.DocumentModel()
         with contextlib.closing(document_model):
@@ -185,6 +272,174 @@ class TestDocumentModelClass(unittest.TestCase):
             document_model.perform_data_item_merges()
             self.assertTrue(numpy.array_equal(computed_data_item.data, d + 10))
 
+    def test_pending_computation_waits_for_pending_upstream_computation(self):
+        document_model = DocumentModel.DocumentModel()
+        with contextlib.closing(document_model):
+            d = numpy.zeros((2, 2), numpy.int)
+            data_item = DataItem.DataItem(d)
+            document_model.append_data_item(data_item)
+            computation1 = document_model.create_computation(Symbolic.xdata_expression("a.xdata + x"))
+            computation1.create_object("a", document_model.get_object_specifier(data_item))
+            computation1.create_variable("x", value_type="integral", value=1)
+            computed_data_item1 = DataItem.DataItem(d)
+            document_model.append_data_item(computed_data_item1)
+            document_model.set_data_item_computation(computed_data_item1, computation1)
+            computation2 = document_model.create_computation(Symbolic.xdata_expression("a.xdata + y"))
+            computation2.create_object("a", document_model.get_object_specifier(computed_data_item1))
+            y = computation2.create_variable("y", value_type="integral", value=1)
+            computed_data_item2 = DataItem.DataItem(d)
+            document_model.append_data_item(computed_data_item2)
+            document_model.set_data_item_computation(computed_data_item2, computation2)
+            document_model.recompute_all()
+            document_model.recompute_all()
+            self.assertTrue(numpy.array_equal(computed_data_item2.data, d + 2))
+            # queue the downstream computation first, then the upstream one
+            y.value = 10
+            data_item.set_data(d + 1)
+            document_model.recompute_one()
+            self.assertTrue(numpy.array_equal(computed_data_item1.data, d + 2))
+            self.assertTrue(numpy.array_equal(computed_data_item2.data, d + 2))
+            document_model.recompute_all()
+            self.assertTrue(numpy.array_equal(computed_data_item2.data, d + 12))
+
+    def test_chained_computations_evaluate_each_target_once_per_change(self):
+        document_model = DocumentModel.DocumentModel()
+        with contextlib.closing(document_model):
+            d = numpy.zeros((2, 2), numpy.int)
+            data_item = DataItem.DataItem(d)
+            document_model.append_data_item(data_item)
+            computation1 = document_model.create_computation(Symbolic.xdata_expression("a.xdata + x"))
+            computation1.create_object("a", document_model.get_object_specifier(data_item))
+            x = computation1.create_variable("x", value_type="integral", value=1)
+            computed_data_item1 = DataItem.DataItem(d)
+            document_model.append_data_item(computed_data_item1)
+            document_model.set_data_item_computation(computed_data_item1, computation1)
+            computation2 = document_model.create_computation(Symbolic.xdata_expression("a.xdata + y"))
+            computation2.create_object("a", document_model.get_object_specifier(computed_data_item1))
+            y = computation2.create_variable("y", value_type="integral", value=1)
+            computed_data_item2 = DataItem.DataItem(d)
+            document_model.append_data_item(computed_data_item2)
+            document_model.set_data_item_computation(computed_data_item2, computation2)
+            document_model.recompute_all()
+            document_model.recompute_all()
+            statistics = document_model.computation_statistics
+            x.value = 2
+            y.value = 2
+            document_model.recompute_all()
+            document_model.recompute_all()
+            self.assertTrue(numpy.array_equal(computed_data_item2.data, d + 4))
+            self.assertEqual(statistics["evaluated"] + 2, document_model.computation_statistics["evaluated"])
+            self.assertLess(statistics["coalesced"], document_model.computation_statistics["coalesced"])
+
+    def test_computation_with_target_rate_merges_requests_until_due(self):
+        document_model = DocumentModel.DocumentModel()
+        with contextlib.closing(document_model):
+            d = numpy.zeros((2, 2), numpy.int)
+            data_item = DataItem.DataItem(d)
+            document_model.append_data_item(data_item)
+            computation = document_model.create_computation(Symbolic.xdata_expression("a.xdata + x"))
+            computation.create_object("a", document_model.get_object_specifier(data_item))
+            x = computation.create_variable("x", value_type="integral", value=1)
+            computation.target_rate = 4.0
+            self.assertAlmostEqual(document_model.get_computation_period(computation), 0.25)
+            computed_data_item = DataItem.DataItem(d)
+            document_model.append_data_item(computed_data_item)
+            document_model.set_data_item_computation(computed_data_item, computation)
+            document_model.start_dispatcher()
+
+            def wait_for_data(data) -> bool:
+                for _ in range(200):
+                    document_model.perform_data_item_merges()
+                    if numpy.array_equal(computed_data_item.data, data):
+                        return True
+                    time.sleep(0.01)
+                return False
+
+            self.assertTrue(wait_for_data(d + 1))
+            evaluation_count = computation._evaluation_count_for_test
+            x.value = 2
+            x.value = 3
+            time.sleep(0.05)
+            document_model.perform_data_item_merges()
+            self.assertTrue(numpy.array_equal(computed_data_item.data, d + 1))
+            self.assertTrue(wait_for_data(d + 3))
+            self.assertEqual(evaluation_count + 1, computation._evaluation_count_for_test)
+            self.assertLess(0, document_model.computation_statistics["throttled"])
+
+    def test_independent_computations_complete_with_multiple_computation_threads(self):
+        old_computation_thread_count = DocumentModel.DocumentModel.computation_thread_count
+        DocumentModel.DocumentModel.computation_thread_count = 4
+        try:
+            document_model = DocumentModel.DocumentModel()
+            with contextlib.closing(document_model):
+                computed_data_items = list()
+                for i in range(8):
+                    data_item = DataItem.DataItem(numpy.full((4, 4), i))
+                    document_model.append_data_item(data_item)
+                    computed_data_items.append(document_model.get_invert_new(data_item))
+                document_model.start_dispatcher()
+                for _ in range(500):
+                    document_model.perform_data_item_merges()
+                    if all(computed_data_item.data is not None and computed_data_item.data[0, 0] == -i for i, computed_data_item in enumerate(computed_data_items)):
+                        break
+                    time.sleep(0.01)
+                for i, computed_data_item in enumerate(computed_data_items):
+                    self.assertTrue(numpy.array_equal(computed_data_item.data, numpy.full((4, 4), -i)))
+        finally:
+            DocumentModel.DocumentModel.computation_thread_count = old_computation_thread_count
+
+    def test_computation_target_merges_data_and_property_changes(self):
+        document_model = DocumentModel.DocumentModel()
+        with contextlib.closing(document_model):
+            d = numpy.zeros((2, 2), numpy.int)
+            data_item = DataItem.DataItem(d)
+            document_model.append_data_item(data_item)
+            expression = "target.xdata = a.xdata + 1\ntarget.set_intensity_calibration(api.create_calibration(units='e'))\ntarget.title = 'computed'"
+            computation = document_model.create_computation(expression)
+            computation.create_object("a", document_model.get_object_specifier(data_item))
+            computed_data_item = DataItem.DataItem(d)
+            computed_data_item.displays[0].add_graphic(Graphics.PointGraphic())
+            document_model.append_data_item(computed_data_item)
+            document_model.set_data_item_computation(computed_data_item, computation)
+            document_model.recompute_all()
+            self.assertTrue(numpy.array_equal(computed_data_item.data, d + 1))
+            self.assertEqual(computed_data_item.intensity_calibration.units, "e")
+            self.assertEqual(computed_data_item.title, "computed")
+            self.assertEqual(len(computed_data_item.displays[0].graphics), 1)
+
+    def test_computation_target_merges_changes_made_through_other_api(self):
+        document_model = DocumentModel.DocumentModel()
+        with contextlib.closing(document_model):
+            d = numpy.zeros((2, 2), numpy.int)
+            data_item = DataItem.DataItem(d)
+            document_model.append_data_item(data_item)
+            expression = "target.xdata = a.xdata + 1\ntarget.add_point_region(0.25, 0.5)"
+            computation = document_model.create_computation(expression)
+            computation.create_object("a", document_model.get_object_specifier(data_item))
+            computed_data_item = DataItem.DataItem(d)
+            document_model.append_data_item(computed_data_item)
+            document_model.set_data_item_computation(computed_data_item, computation)
+            document_model.recompute_all()
+            self.assertTrue(numpy.array_equal(computed_data_item.data, d + 1))
+            self.assertEqual(len(computed_data_item.displays[0].graphics), 1)
+            self.assertEqual(computed_data_item.displays[0].graphics[0].position, (0.25, 0.5))
+
+    def test_computation_target_merges_changes_made_before_falling_back_to_other_api(self):
+        document_model = DocumentModel.DocumentModel()
+        with contextlib.closing(document_model):
+            d = numpy.zeros((2, 2), numpy.int)
+            data_item = DataItem.DataItem(d)
+            document_model.append_data_item(data_item)
+            expression = "target.title = 'New Title'\nx = target.display\ntarget.xdata = a.xdata + 1"
+            computation = document_model.create_computation(expression)
+            computation.create_object("a", document_model.get_object_specifier(data_item))
+            computed_data_item = DataItem.DataItem(d)
+            document_model.append_data_item(computed_data_item)
+            document_model.set_data_item_computation(computed_data_item, computation)
+            document_model.recompute_all()
+            self.assertTrue(numpy.array_equal(computed_data_item.data, d + 1))
+            self.assertEqual(computed_data_item.title, "New Title")
+
     def test_data_item_recording(self):
         data_item = DataItem.DataItem(numpy.zeros((16, 16)))
         data_item_recorder = Recorder.Recorder(data_item)
@@ -193,6 +193,21 @@ class TestFacadeClass(unittest.TestCase):
             self.assertIsInstance(data_item_1d.displays[0].graphics[0], Graphics.IntervalGraphic)
             self.assertIsInstance(data_item_1d.displays[0].graphics[1], Graphics.ChannelGraphic)
 
+    def test_graphic_mask_xdata_is_read_only(self):
+        memory_persistent_storage_system = DocumentModel.MemoryStorageSystem()
+        document_model = DocumentModel.DocumentModel(persistent_storage_systems=[memory_persistent_storage_system])
+        document_controller = self.app.create_document_controller(document_model, "library")
+        with contextlib.closing(document_controller):
+            data_item = DataItem.DataItem(numpy.zeros((8, 8)))
+            document_model.append_data_item(data_item)
+            api = Facade.get_api("~1.0", "~1.0")
+            region = api.library.data_items[0].add_rectangle_region(0.5, 0.5, 0.5, 0.5)
+            mask_xdata = region.mask_xdata_with_shape((8, 8))
+            self.assertFalse(mask_xdata.data.flags.writeable)
+            with self.assertRaises(ValueError):
+                mask_xdata.data[0, 0] = 1
+            self.assertEqual(mask_xdata.data[0, 0], 0)
+
     def test_display_data_panel_reuses_existing_display(self):
         memory_persistent_storage_system = DocumentModel.MemoryStorageSystem()
         document_model = DocumentModel.DocumentModel(persistent_storage_systems=[memory_persistent_storage_system])
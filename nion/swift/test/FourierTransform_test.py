@@ -0,0 +1,105 @@
+# standard libraries
+import contextlib
+import logging
+import unittest
+
+# third party libraries
+import numpy
+
+# local libraries
+from nion.data import Calibration
+from nion.data import Core
+from nion.data import DataAndMetadata
+from nion.swift import Application
+from nion.swift import Facade
+from nion.swift.model import DataItem
+from nion.swift.model import DocumentModel
+from nion.swift.model import FourierTransform
+from nion.ui import TestUI
+
+
+Facade.initialize()
+
+
+class TestFourierTransformClass(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Application.Application(TestUI.UserInterface(), set_global=False)
+
+    def tearDown(self):
+        pass
+
+    def test_fft_and_ifft_match_core_functions(self):
+        thread_count = FourierTransform.thread_count
+        try:
+            # check both the in place transforms on several threads and the single thread transforms
+            for transform_thread_count in (1, 2):
+                FourierTransform.thread_count = transform_thread_count
+                for data_shape in ((32, 32), (15, 20), (1, 9)):
+                    for dtype in (numpy.int16, numpy.float32, numpy.float64, numpy.complex64, numpy.complex128):
+                        data = (100 * numpy.random.randn(*data_shape)).astype(dtype)
+                        xdata = DataAndMetadata.new_data_and_metadata(data, Calibration.Calibration(units="e"), [Calibration.Calibration(scale=2.0, units="nm"), Calibration.Calibration(scale=3.0, units="1/nm")])
+                        for function, core_function in ((FourierTransform.fft, Core.function_fft), (FourierTransform.ifft, Core.function_ifft)):
+                            result_xdata = function(xdata)
+                            expected_xdata = core_function(xdata)
+                            self.assertEqual(result_xdata.data_dtype, expected_xdata.data_dtype)
+                            self.assertTrue(numpy.allclose(result_xdata.data, expected_xdata.data, rtol=1E-4, atol=1E-3))
+                            self.assertEqual(result_xdata.intensity_calibration, expected_xdata.intensity_calibration)
+                            self.assertEqual(result_xdata.dimensional_calibrations, expected_xdata.dimensional_calibrations)
+        finally:
+            FourierTransform.thread_count = thread_count
+
+    def test_correlations_match_core_functions(self):
+        thread_count = FourierTransform.thread_count
+        try:
+            for transform_thread_count in (1, 2):
+                FourierTransform.thread_count = transform_thread_count
+                for data_shape in ((32, 32), (15, 20), (16, 9)):
+                    for dtype in (numpy.int16, numpy.float32, numpy.float64):
+                        xdata1 = DataAndMetadata.new_data_and_metadata((100 * numpy.random.randn(*data_shape)).astype(dtype), dimensional_calibrations=[Calibration.Calibration(scale=2.0, units="nm"), Calibration.Calibration(scale=3.0, units="nm")])
+                        xdata2 = DataAndMetadata.new_data_and_metadata((100 * numpy.random.randn(*data_shape)).astype(dtype))
+                        for result_xdata, expected_xdata in ((FourierTransform.autocorrelate(xdata1), Core.function_autocorrelate(xdata1)), (FourierTransform.crosscorrelate(xdata1, xdata2), Core.function_crosscorrelate(xdata1, xdata2))):
+                            self.assertEqual(result_xdata.data_shape_and_dtype, expected_xdata.data_shape_and_dtype)
+                            self.assertTrue(numpy.allclose(result_xdata.data, expected_xdata.data))
+                            self.assertEqual(result_xdata.intensity_calibration, expected_xdata.intensity_calibration)
+                            self.assertEqual(result_xdata.dimensional_calibrations, expected_xdata.dimensional_calibrations)
+            # constant data is not normalized
+            xdata = DataAndMetadata.new_data_and_metadata(numpy.ones((8, 8)))
+            self.assertTrue(numpy.allclose(FourierTransform.autocorrelate(xdata).data, Core.function_autocorrelate(xdata).data))
+        finally:
+            FourierTransform.thread_count = thread_count
+
+    def test_fft_reuses_workspace_and_returns_new_data_each_time(self):
+        xdata = DataAndMetadata.new_data_and_metadata(numpy.random.randn(16, 16))
+        workspace = FourierTransform.get_workspace((16, 16), numpy.complex128)
+        self.assertIs(workspace, FourierTransform.get_workspace((16, 16), numpy.complex128))
+        fft_xdata1 = FourierTransform.fft(xdata)
+        fft_data1 = numpy.copy(fft_xdata1.data)
+        fft_xdata2 = FourierTransform.fft(DataAndMetadata.new_data_and_metadata(numpy.random.randn(16, 16)))
+        self.assertIsNot(fft_xdata1.data, fft_xdata2.data)
+        self.assertTrue(numpy.array_equal(fft_xdata1.data, fft_data1))
+        self.assertIs(workspace, FourierTransform.get_workspace((16, 16), numpy.complex128))
+
+    def test_fourier_processing_matches_core_functions(self):
+        document_model = DocumentModel.DocumentModel()
+        with contextlib.closing(document_model):
+            data_item = DataItem.DataItem(numpy.random.randn(32, 32))
+            document_model.append_data_item(data_item)
+            fft_data_item = document_model.get_fft_new(data_item)
+            FourierTransform._workspaces.clear()
+            document_model.recompute_all()
+            self.assertTrue(numpy.allclose(fft_data_item.data, Core.function_fft(data_item.xdata).data))
+            # the saved expression calls the data api, which dispatches to the transform workspaces
+            self.assertIn("xd.fft(", fft_data_item.computation.expression)
+            self.assertIn(((32, 32), numpy.dtype(numpy.complex128)), FourierTransform._workspaces)
+            ifft_data_item = document_model.get_ifft_new(fft_data_item)
+            document_model.recompute_all()
+            self.assertTrue(numpy.allclose(ifft_data_item.data, data_item.data))
+            auto_correlate_data_item = document_model.get_auto_correlate_new(data_item)
+            document_model.recompute_all()
+            self.assertTrue(numpy.allclose(auto_correlate_data_item.data, Core.function_autocorrelate(data_item.xdata).data))
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,90 @@
+# standard libraries
+import contextlib
+import datetime
+import logging
+import os
+import shutil
+import unittest
+import uuid
+
+# third party libraries
+import numpy
+
+# local libraries
+from nion.swift.model import Cache
+from nion.swift.model import HDF5Handler
+
+
+class TestHDF5HandlerClass(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_chunk_shape_holds_one_frame_or_one_collection_row(self):
+        self.assertEqual(HDF5Handler.get_chunk_shape((10, 64, 64), 4, is_sequence=True), (1, 64, 64))
+        self.assertEqual(HDF5Handler.get_chunk_shape((32, 32, 512), 4), (1, 32, 512))
+        self.assertEqual(HDF5Handler.get_chunk_shape((64, 64), 4), (64, 64))
+        self.assertEqual(HDF5Handler.get_chunk_shape((4096, 4096), 4), (512, 512))
+
+    def test_hdf5_handler_writes_region_of_chunked_compressed_data(self):
+        now = datetime.datetime.now()
+        current_working_directory = os.getcwd()
+        data_dir = os.path.join(current_working_directory, "__Test")
+        Cache.db_make_directory_if_needed(data_dir)
+        compression = HDF5Handler.HDF5Handler.compression
+        HDF5Handler.HDF5Handler.compression = "gzip"
+        try:
+            h = HDF5Handler.HDF5Handler(os.path.join(data_dir, "abc.h5"))
+            with contextlib.closing(h):
+                p = {u"uuid": str(uuid.uuid4()), u"data_source": {u"is_sequence": True}}
+                h.write_properties(p, now)
+                data = numpy.zeros((4, 16, 16), dtype=numpy.float32)
+                h.write_data(data, now)
+                d = h.read_data()
+                self.assertEqual(d.chunks, (1, 16, 16))
+                self.assertEqual(d.compression, "gzip")
+                self.assertEqual(h.read_properties(), p)
+                data[2] = 1
+                h.write_data_region(data, (slice(2, 3), ), now)
+                self.assertTrue(numpy.array_equal(h.read_data()[:], data))
+                # a region write with a different shape writes all of the data
+                data = numpy.ones((3, 8, 8), dtype=numpy.float32)
+                h.write_data_region(data, (slice(0, 1), ), now)
+                self.assertTrue(numpy.array_equal(h.read_data()[:], data))
+                self.assertEqual(h.read_properties(), p)
+        finally:
+            HDF5Handler.HDF5Handler.compression = compression
+            #logging.debug("rmtree %s", data_dir)
+            shutil.rmtree(data_dir)
+
+    def test_hdf5_handler_writes_reserved_sequence_frame_by_frame(self):
+        now = datetime.datetime.now()
+        current_working_directory = os.getcwd()
+        data_dir = os.path.join(current_working_directory, "__Test")
+        Cache.db_make_directory_if_needed(data_dir)
+        try:
+            h = HDF5Handler.HDF5Handler(os.path.join(data_dir, "abc.h5"))
+            with contextlib.closing(h):
+                p = {u"uuid": str(uuid.uuid4())}
+                h.write_properties(p, now)
+                h.reserve_data((8, 16, 16), numpy.float32, now)
+                for i in range(3):
+                    h.write_data_frame(numpy.full((16, 16), i + 1, dtype=numpy.float32), i, now)
+                self.assertEqual(h.read_data().shape, (8, 16, 16))
+                self.assertEqual(h.read_data().chunks, (1, 16, 16))
+                h.reserve_data((3, 16, 16), numpy.float32, now)
+                d = h.read_data()[:]
+                self.assertEqual(d.shape, (3, 16, 16))
+                self.assertEqual(list(d[:, 0, 0]), [1, 2, 3])
+                self.assertEqual(h.read_properties(), p)
+        finally:
+            #logging.debug("rmtree %s", data_dir)
+            shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
@@ -1,6 +1,8 @@
 import contextlib
 import copy
 import datetime
+import json
+import os
 import threading
 import time
 import unittest
@@ -11,6 +13,7 @@ from nion.data import DataAndMetadata
 from nion.swift.model import DataItem
 from nion.swift.model import DocumentModel
 from nion.swift.model import HardwareSource
+from nion.swift.model import PipelineStatistics
 from nion.swift.model import ImportExportManager
 from nion.swift.model import Utility
 from nion.swift import Application
@@ -736,6 +739,276 @@ class TestHardwareSourceClass(unittest.TestCase):
             self.assertAlmostEqual(data[0, 0], 1.0)
             self.assertAlmostEqual(data[128, 0], 16.0)
 
+    def test_data_channel_reports_updated_sub_area_only_for_partial_updates(self):
+        document_controller, document_model, hardware_source = self.__setup_scan_hardware_source()
+        with contextlib.closing(document_controller):
+            data_channel = hardware_source.data_channels[0]
+            data = numpy.zeros((256, 256))
+            data_channel.update(DataAndMetadata.new_data_and_metadata(data), "complete", None, None)
+            self.assertIsNone(data_channel.updated_sub_area)
+            data_channel.update(DataAndMetadata.new_data_and_metadata(data + 1), "partial", ((0, 0), (128, 256)), None)
+            self.assertEqual(data_channel.updated_sub_area, ((0, 0), (128, 256)))
+            self.assertEqual(data_channel.data_and_metadata.data[0, 0], 1)
+            self.assertEqual(data_channel.data_and_metadata.data[128, 0], 0)
+            data_channel.update(DataAndMetadata.new_data_and_metadata(data + 2), "complete", ((0, 0), (256, 256)), None)
+            self.assertIsNone(data_channel.updated_sub_area)
+
+    def test_frame_buffer_pool_reuses_only_released_buffers(self):
+        frame_buffer_pool = HardwareSource.FrameBufferPool(max_count=2)
+        buffer0 = frame_buffer_pool.take((4, 4), numpy.float32)
+        buffer1 = frame_buffer_pool.take((4, 4), numpy.float32)
+        self.assertIsNot(buffer0, buffer1)
+        buffer0.flags.writeable = False
+        frame_buffer_pool.release(buffer0)
+        buffer2 = frame_buffer_pool.take((4, 4), numpy.float32)
+        self.assertIs(buffer2, buffer0)
+        self.assertTrue(buffer2.flags.writeable)
+        # a released buffer is taken only once, and only for the same shape and dtype
+        self.assertIsNot(frame_buffer_pool.take((4, 4), numpy.float32), buffer0)
+        frame_buffer_pool.release(buffer1)
+        self.assertIsNot(frame_buffer_pool.take((8, 8), numpy.float32), buffer1)
+        self.assertIsNot(frame_buffer_pool.take((4, 4), numpy.float64), buffer1)
+        self.assertIs(frame_buffer_pool.take((4, 4), numpy.float32), buffer1)
+
+    def test_data_channel_publishes_read_only_data_and_reuses_it_only_when_released_by_all_listeners(self):
+        document_controller, document_model, hardware_source = self.__setup_scan_hardware_source()
+        with contextlib.closing(document_controller):
+            data_channel = HardwareSource.DataChannel(hardware_source, 0)
+            published = list()
+            releasing = [True]
+
+            def data_channel_updated(data_and_metadata):
+                published.append(data_and_metadata)
+                if releasing[0]:
+                    data_channel.release_data(data_and_metadata)
+
+            with contextlib.closing(data_channel.data_channel_updated_event.listen(data_channel_updated)):
+                # the published data is read only; listeners which modify it must copy it
+                data_channel.update(DataAndMetadata.new_data_and_metadata(numpy.zeros((4, 4))), "complete", None, None)
+                with self.assertRaises(ValueError):
+                    published[0].data[0, 0] = 1
+                data = numpy.copy(published[0].data)
+                data[0, 0] = 1
+                # the frame buffer is reused once the channel and the listener have released it
+                data_channel.update(DataAndMetadata.new_data_and_metadata(numpy.ones((4, 4))), "complete", None, None)
+                data_channel.update(DataAndMetadata.new_data_and_metadata(numpy.full((4, 4), 2.0)), "complete", None, None)
+                self.assertIs(published[2].data, published[0].data)
+                # the frame buffer of data which a listener keeps is not reused
+                releasing[0] = False
+                data_channel.update(DataAndMetadata.new_data_and_metadata(numpy.full((4, 4), 3.0)), "complete", None, None)
+                for i in range(4):
+                    data_channel.update(DataAndMetadata.new_data_and_metadata(numpy.full((4, 4), 4.0 + i)), "complete", None, None)
+                self.assertTrue(numpy.array_equal(published[3].data, numpy.full((4, 4), 3.0)))
+                self.assertEqual(len(set(id(xdata.data) for xdata in published[3:])), len(published[3:]))
+            # a second listener which does not release keeps the data of the first from being reused
+            listener2 = data_channel.data_channel_updated_event.listen(lambda data_and_metadata: None)
+            with contextlib.closing(listener2), contextlib.closing(data_channel.data_channel_updated_event.listen(data_channel_updated)):
+                releasing[0] = True
+                published = list()
+                for i in range(4):
+                    data_channel.update(DataAndMetadata.new_data_and_metadata(numpy.full((4, 4), i)), "complete", None, None)
+                self.assertEqual(len(set(id(xdata.data) for xdata in published)), len(published))
+                self.assertTrue(numpy.array_equal(published[0].data, numpy.zeros((4, 4))))
+
+    def test_document_model_releases_frames_it_drops_or_replaces_but_not_frames_it_shows(self):
+        document_controller, document_model, hardware_source = self.__setup_scan_hardware_source()
+        with contextlib.closing(document_controller):
+            data_channel = hardware_source.data_channels[0]
+            frames = list()
+            for i in range(3):
+                data_channel.update(DataAndMetadata.new_data_and_metadata(numpy.full((16, 16), i, numpy.float32)), "complete", None, None)
+                frames.append(data_channel.data_and_metadata.data)
+            document_controller.periodic()
+            data_item = document_model.data_items[0]
+            # the data item shows frame 2; frame 1 was replaced before it was shown, so it is reused for frame 3
+            self.assertTrue(numpy.array_equal(data_item.data, numpy.full((16, 16), 2)))
+            data_channel.update(DataAndMetadata.new_data_and_metadata(numpy.full((16, 16), 3, numpy.float32)), "complete", None, None)
+            self.assertIs(data_channel.data_and_metadata.data, frames[1])
+            document_controller.periodic()
+            self.assertTrue(numpy.array_equal(data_item.data, numpy.full((16, 16), 3)))
+            # frames shown by the data item are never reused, since anything may still refer to them
+            for i in range(4, 10):
+                data_channel.update(DataAndMetadata.new_data_and_metadata(numpy.full((16, 16), i, numpy.float32)), "complete", None, None)
+                self.assertIsNot(data_channel.data_and_metadata.data, frames[1])
+                self.assertIsNot(data_channel.data_and_metadata.data, frames[2])
+            self.assertTrue(numpy.array_equal(frames[1], numpy.full((16, 16), 3)))
+            self.assertTrue(numpy.array_equal(frames[2], numpy.full((16, 16), 2)))
+
+    def test_data_channel_buffer_shares_read_only_published_data(self):
+        document_controller, document_model, hardware_source = self.__setup_scan_hardware_source()
+        with contextlib.closing(document_controller):
+            data_channel = hardware_source.data_channels[0]
+            data_channel_buffer = HardwareSource.DataChannelBuffer([data_channel])
+            with contextlib.closing(data_channel_buffer):
+                data_channel_buffer.start()
+                data = numpy.ones((16, 16))
+                data_channel.update(DataAndMetadata.new_data_and_metadata(data, metadata={"a": {"b": 1}}), "complete", None, None)
+                data[0, 0] = 2
+                xdata = data_channel_buffer.grab_latest()[0]
+                self.assertEqual(xdata.data[0, 0], 1)
+                self.assertFalse(xdata.data.flags.writeable)
+                self.assertTrue(numpy.shares_memory(xdata.data, data_channel.data_and_metadata.data))
+                self.assertEqual(xdata.metadata["a"], {"b": 1})
+                self.assertEqual(xdata.metadata["hardware_source"]["channel_index"], 0)
+                data_channel_buffer.stop()
+
+    def test_data_channel_buffer_limits_frames_by_byte_count(self):
+        document_controller, document_model, hardware_source = self.__setup_scan_hardware_source()
+        with contextlib.closing(document_controller):
+            data_channel = hardware_source.data_channels[0]
+            data_channel_buffer = HardwareSource.DataChannelBuffer([data_channel], buffer_size=16, max_bytes=3 * 16 * 16 * 8)
+            with contextlib.closing(data_channel_buffer):
+                data_channel_buffer.start()
+                for i in range(5):
+                    data_channel.update(DataAndMetadata.new_data_and_metadata(numpy.full((16, 16), i, numpy.float64)), "complete", None, None)
+                self.assertEqual([data_channel_buffer.grab_earliest()[0].data[0, 0] for i in range(3)], [2, 3, 4])
+                data_channel_buffer.stop()
+
+    def test_preallocated_data_channel_buffer_returns_views_of_ring_buffer_slots(self):
+        document_controller, document_model, hardware_source = self.__setup_scan_hardware_source()
+        with contextlib.closing(document_controller):
+            data_channel = hardware_source.data_channels[0]
+            data_channel_buffer = HardwareSource.DataChannelBuffer([data_channel], buffer_size=4, max_bytes=3 * 16 * 16 * 4, preallocate=True)
+            with contextlib.closing(data_channel_buffer):
+                data_channel_buffer.start()
+                for i in range(5):
+                    data_channel.update(DataAndMetadata.new_data_and_metadata(numpy.full((16, 16), i, numpy.float32)), "complete", None, None)
+                self.assertEqual(data_channel_buffer.slot_count, 3)
+                xdata = data_channel_buffer.grab_earliest()[0]
+                self.assertEqual(xdata.data[0, 0], 2)
+                self.assertFalse(xdata.data.flags.writeable)
+                self.assertFalse(xdata.data.flags.owndata)
+                self.assertFalse(numpy.shares_memory(xdata.data, data_channel.data_and_metadata.data))
+                self.assertEqual(data_channel_buffer.grab_earliest()[0].data[0, 0], 3)
+                self.assertEqual(data_channel_buffer.grab_latest()[0].data[0, 0], 4)
+                # the slot of the earliest frame is written again after the buffer wraps around
+                data_channel.update(DataAndMetadata.new_data_and_metadata(numpy.full((16, 16), 5, numpy.float32)), "complete", None, None)
+                self.assertEqual(xdata.data[0, 0], 5)
+                # a new frame shape reallocates the ring buffer
+                data_channel.update(DataAndMetadata.new_data_and_metadata(numpy.full((8, 8), 6, numpy.float32)), "complete", None, None)
+                self.assertEqual(data_channel_buffer.slot_count, 4)
+                self.assertEqual(data_channel_buffer.grab_earliest()[0].data.shape, (8, 8))
+                data_channel_buffer.stop()
+
+    def test_sequence_recorder_writes_frames_to_storage_as_they_arrive(self):
+        memory_persistent_storage_system = DocumentModel.MemoryStorageSystem()
+        document_controller, document_model, hardware_source = self.__setup_simple_hardware_source(persistent_storage_systems=[memory_persistent_storage_system])
+        with contextlib.closing(document_controller):
+            data_channel = hardware_source.data_channels[0]
+            data_item = DataItem.DataItem(large_format=True)
+            document_model.append_data_item(data_item)
+            sequence_recorder = HardwareSource.SequenceRecorder(data_channel, data_item, 4)
+            with contextlib.closing(sequence_recorder):
+                sequence_recorder.start()
+                for i in range(2):
+                    data_channel.update(DataAndMetadata.new_data_and_metadata(numpy.full((16, 16), i + 1, numpy.float32)), "complete", None, None)
+                data_channel.update(DataAndMetadata.new_data_and_metadata(numpy.full((8, 8), 9, numpy.float32)), "complete", None, None)
+                data_channel.update(DataAndMetadata.new_data_and_metadata(numpy.full((16, 16), 3, numpy.float32)), "complete", None, None)
+                self.assertEqual(memory_persistent_storage_system.data[str(data_item.uuid)].shape, (4, 16, 16))
+                self.assertFalse(data_item.has_data)
+                self.assertEqual(sequence_recorder.frame_index, 3)
+                self.assertEqual(sequence_recorder.skipped_count, 1)
+                sequence_recorder.stop()
+            self.assertTrue(data_item.xdata.is_sequence)
+            self.assertEqual(data_item.xdata.data_shape, (3, 16, 16))
+            self.assertEqual(list(data_item.data[:, 0, 0]), [1, 2, 3])
+            self.assertEqual(memory_persistent_storage_system.data[str(data_item.uuid)].shape, (3, 16, 16))
+            self.assertEqual(data_item.metadata["hardware_source"]["channel_index"], 0)
+
+    def test_sequence_recorder_requires_large_format_data_item_in_document(self):
+        document_controller, document_model, hardware_source = self.__setup_simple_hardware_source()
+        with contextlib.closing(document_controller):
+            data_channel = hardware_source.data_channels[0]
+            data_item = DataItem.DataItem()
+            document_model.append_data_item(data_item)
+            with self.assertRaises(AssertionError):
+                HardwareSource.SequenceRecorder(data_channel, data_item, 4)
+            with self.assertRaises(AssertionError):
+                HardwareSource.SequenceRecorder(data_channel, DataItem.DataItem(large_format=True), 4)
+
+    def test_accumulating_processors_process_frames_in_place(self):
+        frames = [numpy.full((4, 4), value, numpy.uint16) for value in (4, 8, 2, 6, 10)]
+        processors = [HardwareSource.RunningAverageProcessor(), HardwareSource.ExponentialAverageProcessor(0.5), HardwareSource.FrameSumProcessor(2),
+                      HardwareSource.MaximumHoldProcessor(), HardwareSource.MinimumHoldProcessor()]
+        results = list()
+        for processor in processors:
+            processed_data_list = [processor.process(DataAndMetadata.new_data_and_metadata(frame, metadata={"a": 1})) for frame in frames]
+            self.assertEqual(processor.frame_count, 5)
+            # the processed data is the processor's accumulator
+            self.assertIs(processed_data_list[0].data, processed_data_list[-1].data)
+            self.assertEqual(processed_data_list[-1].metadata, {"a": 1})
+            results.append(processed_data_list[-1].data[0, 0])
+        self.assertEqual(results, [6, 7.5, 16, 10, 2])
+        self.assertEqual(processors[2].process(DataAndMetadata.new_data_and_metadata(frames[0])).data.dtype, numpy.int64)
+        # a new frame shape or a reset starts again
+        self.assertEqual(processors[0].process(DataAndMetadata.new_data_and_metadata(numpy.full((2, 2), 3.0))).data[0, 0], 3)
+        processors[3].reset()
+        self.assertEqual(processors[3].process(DataAndMetadata.new_data_and_metadata(frames[2])).data[0, 0], 2)
+        self.assertEqual(processors[3].frame_count, 1)
+
+    def test_frame_sum_processor_sums_most_recent_frames_after_wrapping(self):
+        processor = HardwareSource.FrameSumProcessor(3)
+        sums = [processor.process(DataAndMetadata.new_data_and_metadata(numpy.full((2, 2), 0.1 * i))).data[0, 0] for i in range(1, 11)]
+        for i in range(2, 10):
+            self.assertAlmostEqual(sums[i], 0.1 * (i + 1 + i + i - 1))
+
+    def test_accumulating_processor_publishes_to_processor_data_channel(self):
+        document_controller, document_model, hardware_source = self.__setup_simple_hardware_source()
+        with contextlib.closing(document_controller):
+            hardware_source.add_channel_processor(0, HardwareSource.MaximumHoldProcessor())
+            self.__acquire_one(document_controller, hardware_source)
+            self.__acquire_one(document_controller, hardware_source)
+            data_channel = hardware_source.data_channels[1]
+            self.assertEqual(data_channel.channel_id, "maximum_hold")
+            self.assertTrue(numpy.array_equal(data_channel.data_and_metadata.data, hardware_source.data_channels[0].data_and_metadata.data))
+            self.assertEqual(data_channel.processor.frame_count, 2)
+
+    def test_pipeline_statistics_record_stage_latencies_for_each_channel(self):
+        document_controller, document_model, hardware_source = self.__setup_simple_hardware_source()
+        with contextlib.closing(document_controller):
+            self.__acquire_one(document_controller, hardware_source)
+            statistics_dict = hardware_source.get_pipeline_statistics()["0"]
+            for stage in ("acquire", "convert", "update", "queue", "wait", "apply", "persist"):
+                self.assertGreaterEqual(statistics_dict["stages"][stage]["count"], 1)
+            self.assertEqual(statistics_dict["counts"]["frames"], statistics_dict["stages"]["update"]["count"])
+            file_path = os.path.join(os.getcwd(), "__Test.json")
+            try:
+                hardware_source.write_pipeline_statistics(file_path)
+                with open(file_path) as fp:
+                    self.assertEqual(json.load(fp)["channels"]["0"]["counts"], statistics_dict["counts"])
+            finally:
+                os.remove(file_path)
+            hardware_source.reset_pipeline_statistics()
+            self.assertEqual(hardware_source.get_pipeline_statistics()["0"], {"stages": dict(), "counts": dict()})
+
+    def test_pipeline_statistics_count_merged_updates(self):
+        document_controller, document_model, hardware_source = self.__setup_simple_hardware_source()
+        with contextlib.closing(document_controller):
+            self.__acquire_one(document_controller, hardware_source)
+            data_channel = hardware_source.data_channels[0]
+            data_channel.statistics.reset()
+            for i in range(3):
+                data_channel.update(DataAndMetadata.new_data_and_metadata(numpy.zeros((16, 16))), "complete", None, None)
+                time.sleep(0.02)
+            document_controller.periodic()
+            self.assertEqual(data_channel.statistics.get_count("frames"), 3)
+            self.assertEqual(data_channel.statistics.get_count("merged"), 2)
+            self.assertEqual(data_channel.statistics.get_histogram("apply")["count"], 1)
+            # the wait is measured from the first of the merged updates
+            self.assertGreaterEqual(data_channel.statistics.get_histogram("wait")["max"], 0.06)
+
+    def test_latency_histogram_buckets_by_power_of_two_microseconds(self):
+        statistics = PipelineStatistics.PipelineStatistics()
+        for elapsed in (0.0, 0.0000015, 0.000003, 0.001, 1000.0):
+            statistics.add_latency("stage", elapsed)
+        histogram = statistics.get_histogram("stage")
+        self.assertEqual(histogram["count"], 5)
+        self.assertEqual(histogram["buckets"][:3], [1, 1, 1])
+        self.assertEqual(histogram["buckets"][10], 1)
+        self.assertEqual(histogram["buckets"][-1], 1)
+        self.assertEqual(histogram["max"], 1000.0)
+        self.assertAlmostEqual(histogram["p50"], 0.000004)
+
     def test_standard_data_element_constructs_metadata_with_hardware_source_as_dict(self):
         data_element = ScanAcquisitionTask(False, 0).make_data_element()
         data_item = ImportExportManager.create_data_item_from_data_element(data_element)
@@ -1077,6 +1350,26 @@ class TestHardwareSourceClass(unittest.TestCase):
             threading.Thread(target=do_record).start()
             done_event.wait(3.0)
 
+    def test_hardware_source_api_records_sequence_to_storage(self):
+        memory_persistent_storage_system = DocumentModel.MemoryStorageSystem()
+        document_controller, document_model, _hardware_source = self.__setup_simple_hardware_source(persistent_storage_systems=[memory_persistent_storage_system])
+        with contextlib.closing(document_controller):
+            library = Facade.Library(document_model)  # hack to build Facade.Library directly
+            hardware_source = Facade.HardwareSource(_hardware_source)
+            data_item = library.create_data_item("Sequence", large_format=True)
+            sequence_record_task = hardware_source.create_sequence_record_task([data_item], 4)
+            try:
+                self.assertTrue(sequence_record_task.wait(3.0))
+                self.assertTrue(sequence_record_task.is_finished)
+                self.assertEqual(sequence_record_task.frame_count, 4)
+                self.assertEqual(memory_persistent_storage_system.data[str(data_item._data_item.uuid)].shape, (4, 256))
+            finally:
+                sequence_record_task.close()
+            xdata = data_item._data_item.xdata
+            self.assertEqual(xdata.data_shape, (4, 256))
+            self.assertTrue(xdata.is_sequence)
+            self.assertEqual(xdata.datum_dimension_count, 1)
+
     def test_hardware_source_updates_timezone_during_acquisition(self):
         document_controller, document_model, hardware_source = self.__setup_simple_hardware_source()
         with contextlib.closing(document_controller):
@@ -0,0 +1,86 @@
+# standard libraries
+import contextlib
+import logging
+import unittest
+
+# third party libraries
+import numpy
+
+# local libraries
+from nion.data import Calibration
+from nion.data import Core
+from nion.data import DataAndMetadata
+from nion.swift import Application
+from nion.swift import Facade
+from nion.swift.model import DataItem
+from nion.swift.model import DocumentModel
+from nion.swift.model import Graphics
+from nion.swift.model import LineProfile
+from nion.ui import TestUI
+
+
+Facade.initialize()
+
+
+class TestLineProfileClass(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Application.Application(TestUI.UserInterface(), set_global=False)
+
+    def tearDown(self):
+        pass
+
+    def test_line_profile_matches_core_line_profile(self):
+        for data in ((100 * numpy.random.randn(40, 60)).astype(numpy.int32), (100 * numpy.random.randn(60, 40)).astype(numpy.float32),
+                     numpy.random.randint(0, 255, (40, 60, 3)).astype(numpy.uint8)):
+            xdata = DataAndMetadata.new_data_and_metadata(data, Calibration.Calibration(units="e"), [Calibration.Calibration(scale=2.0), Calibration.Calibration(scale=3.0, units="nm")])
+            # includes lines which are partly outside of the data, too short, and wider than the data
+            for vector in (((0.1, 0.2), (0.8, 0.7)), ((-0.2, 0.5), (1.1, 0.4)), ((0.5, 0.5), (0.51, 0.5)), ((0.9, 0.1), (0.1, 0.9))):
+                for width in (1, 2, 5, 100):
+                    expected_xdata = Core.function_line_profile(xdata, vector, width)
+                    line_profile_xdata = LineProfile.line_profile(xdata, vector, width)
+                    self.assertEqual(line_profile_xdata.data_dtype, expected_xdata.data_dtype)
+                    self.assertTrue(numpy.allclose(line_profile_xdata.data, expected_xdata.data))
+                    self.assertEqual(line_profile_xdata.intensity_calibration, expected_xdata.intensity_calibration)
+                    self.assertEqual(line_profile_xdata.dimensional_calibrations, expected_xdata.dimensional_calibrations)
+
+    def test_line_profiles_reuse_samplers_and_sum_wide_profiles_in_parallel(self):
+        parallel_sample_count = LineProfile.parallel_sample_count
+        LineProfile.parallel_sample_count = 16
+        try:
+            data = (100 * numpy.random.randn(64, 64)).astype(numpy.int64)
+            xdata = DataAndMetadata.new_data_and_metadata(data)
+            lines = [(((0.1, 0.1), (0.9, 0.8)), 20), (((0.5, 0.0), (0.5, 1.0)), 1), (((0.5, 0.5), (0.5, 0.5)), 3)]
+            line_profile_xdatas = LineProfile.line_profiles(xdata, lines)
+            for (vector, width), line_profile_xdata in zip(lines, line_profile_xdatas):
+                expected_xdata = Core.function_line_profile(xdata, vector, width)
+                self.assertEqual(line_profile_xdata.data_dtype, expected_xdata.data_dtype)
+                self.assertTrue(numpy.array_equal(line_profile_xdata.data, expected_xdata.data))
+                self.assertTrue(numpy.array_equal(LineProfile.line_profile(xdata, vector, width).data, expected_xdata.data))
+            self.assertIs(LineProfile.get_sampler((64, 64), lines[0][0], 20), LineProfile.get_sampler((64, 64), lines[0][0], 20))
+        finally:
+            LineProfile.parallel_sample_count = parallel_sample_count
+
+    def test_line_profile_processing_uses_line_profile_of_display_data(self):
+        document_model = DocumentModel.DocumentModel()
+        with contextlib.closing(document_model):
+            data = numpy.random.randn(32, 32)
+            data_item = DataItem.DataItem(data)
+            document_model.append_data_item(data_item)
+            line_region = Graphics.LineProfileGraphic()
+            line_region.start = 0.2, 0.1
+            line_region.end = 0.7, 0.9
+            line_region.width = 3
+            data_item.displays[0].add_graphic(line_region)
+            line_profile_data_item = document_model.get_line_profile_new(data_item, None, line_region)
+            LineProfile._samplers.clear()
+            document_model.recompute_all()
+            self.assertIn("xd.line_profile(", line_profile_data_item.computation.expression)
+            self.assertEqual(len(LineProfile._samplers), 1)
+            expected_xdata = Core.function_line_profile(data_item.xdata, line_region.vector, line_region.width)
+            self.assertTrue(numpy.array_equal(line_profile_data_item.data, expected_xdata.data))
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
@@ -9,6 +9,7 @@ import os
 import shutil
 import unittest
 import uuid
+import zipfile
 
 # third party libraries
 import numpy
@@ -118,6 +119,236 @@ class TestNDataHandlerClass(unittest.TestCase):
             #logging.debug("rmtree %s", data_dir)
             shutil.rmtree(data_dir)
 
+    def test_ndata_handler_writes_properties_without_moving_data(self):
+        now = datetime.datetime.now()
+        current_working_directory = os.getcwd()
+        data_dir = os.path.join(current_working_directory, "__Test")
+        Cache.db_make_directory_if_needed(data_dir)
+        try:
+            file_path = os.path.join(data_dir, "abc.ndata")
+            h = NDataHandler.NDataHandler(file_path)
+            with contextlib.closing(h):
+                p = {u"abc": 1, u"uuid": str(uuid.uuid4())}
+                h.write_properties(p, now)
+                h.write_data(numpy.arange(64, dtype=numpy.float32).reshape(8, 8), now)
+                file_size = os.path.getsize(file_path)
+                # properties that fit into the existing metadata are written in place
+                p[u"abc"] = 2
+                h.write_properties(p, now)
+                self.assertEqual(h.read_properties(), p)
+                self.assertEqual(os.path.getsize(file_path), file_size)
+                # properties that grow are written after the data
+                p[u"def"] = u"x" * 4096
+                h.write_properties(p, now)
+                self.assertEqual(h.read_properties(), p)
+                with open(file_path, "rb") as fp:
+                    local_files, dir_files, eocd = NDataHandler.parse_zip(fp)
+                    self.assertEqual(dir_files[b"data.npy"][1], 0)
+                    self.assertEqual(len(local_files), 2)
+                self.assertTrue(numpy.array_equal(h.read_data(), numpy.arange(64, dtype=numpy.float32).reshape(8, 8)))
+        finally:
+            #logging.debug("rmtree %s", data_dir)
+            shutil.rmtree(data_dir)
+
+    def test_ndata_handler_compacts_reversed_zip_file_on_close(self):
+        now = datetime.datetime.now()
+        current_working_directory = os.getcwd()
+        data_dir = os.path.join(current_working_directory, "__Test")
+        Cache.db_make_directory_if_needed(data_dir)
+        try:
+            file_path = os.path.join(data_dir, "file.ndata")
+            p = {u"abc": 1, u"uuid": str(uuid.uuid4())}
+            d = numpy.arange(16, dtype=numpy.float32).reshape(4, 4)
+            # write zip file where metadata is first
+            with open(file_path, "w+b") as fp:
+                json_bytes = bytes(json.dumps(p), 'ISO-8859-1')
+                def write_json(fp):
+                    fp.write(json_bytes)
+                    return binascii.crc32(json_bytes) & 0xFFFFFFFF
+                json_len, json_crc32 = NDataHandler.write_local_file(fp, b"metadata.json", write_json, now)
+                NDataHandler.write_zip_fp(fp, d, None, [(0, b"metadata.json", json_len, json_crc32)])
+            h = NDataHandler.NDataHandler(file_path)
+            with contextlib.closing(h):
+                p[u"def"] = u"x" * 4096
+                h.write_properties(p, now)
+                self.assertEqual(h.read_properties(), p)
+                with open(file_path, "rb") as fp:
+                    local_files, dir_files, eocd = NDataHandler.parse_zip(fp)
+                    self.assertNotEqual(dir_files[b"data.npy"][1], 0)
+                    self.assertEqual(len(local_files), 3)
+                # a later write that fits in place does not cancel the compaction
+                p[u"abc"] = 2
+                h.write_properties(p, now)
+            with open(file_path, "rb") as fp:
+                local_files, dir_files, eocd = NDataHandler.parse_zip(fp)
+                self.assertEqual(dir_files[b"data.npy"][1], 0)
+                self.assertEqual(len(local_files), 2)
+            h = NDataHandler.NDataHandler(file_path)
+            with contextlib.closing(h):
+                self.assertEqual(h.read_properties(), p)
+                self.assertTrue(numpy.array_equal(h.read_data(), d))
+        finally:
+            #logging.debug("rmtree %s", data_dir)
+            shutil.rmtree(data_dir)
+
+    def test_ndata_handler_compacts_zip_file_when_unused_space_is_large(self):
+        now = datetime.datetime.now()
+        current_working_directory = os.getcwd()
+        data_dir = os.path.join(current_working_directory, "__Test")
+        Cache.db_make_directory_if_needed(data_dir)
+        try:
+            file_path = os.path.join(data_dir, "file.ndata")
+            p = {u"abc": u"x" * 8192, u"uuid": str(uuid.uuid4())}
+            d = numpy.arange(16, dtype=numpy.float32).reshape(4, 4)
+            # write zip file where large metadata is first
+            with open(file_path, "w+b") as fp:
+                json_bytes = bytes(json.dumps(p), 'ISO-8859-1')
+                def write_json(fp):
+                    fp.write(json_bytes)
+                    return binascii.crc32(json_bytes) & 0xFFFFFFFF
+                json_len, json_crc32 = NDataHandler.write_local_file(fp, b"metadata.json", write_json, now)
+                NDataHandler.write_zip_fp(fp, d, None, [(0, b"metadata.json", json_len, json_crc32)])
+            h = NDataHandler.NDataHandler(file_path)
+            with contextlib.closing(h):
+                p[u"def"] = u"y" * 1024
+                h.write_properties(p, now)
+                # the old metadata is most of the file, so it is reclaimed without waiting for close
+                with open(file_path, "rb") as fp:
+                    local_files, dir_files, eocd = NDataHandler.parse_zip(fp)
+                    self.assertEqual(dir_files[b"data.npy"][1], 0)
+                    self.assertEqual(len(local_files), 2)
+                self.assertEqual(h.read_properties(), p)
+                self.assertTrue(numpy.array_equal(h.read_data(), d))
+                with zipfile.ZipFile(file_path) as z:
+                    self.assertIsNone(z.testzip())
+        finally:
+            #logging.debug("rmtree %s", data_dir)
+            shutil.rmtree(data_dir)
+
+    def test_ndata_handler_maps_large_data_copy_on_write(self):
+        now = datetime.datetime.now()
+        current_working_directory = os.getcwd()
+        data_dir = os.path.join(current_working_directory, "__Test")
+        Cache.db_make_directory_if_needed(data_dir)
+        memory_map_min_size = NDataHandler.NDataHandler.memory_map_min_size
+        NDataHandler.NDataHandler.memory_map_min_size = 1024
+        try:
+            file_path = os.path.join(data_dir, "abc.ndata")
+            h = NDataHandler.NDataHandler(file_path)
+            with contextlib.closing(h):
+                p = {u"uuid": str(uuid.uuid4())}
+                h.write_properties(p, now)
+                # small data is read
+                h.write_data(numpy.zeros((4, 4), dtype=numpy.float32), now)
+                self.assertNotIsInstance(h.read_data(), numpy.memmap)
+                # large data is mapped
+                h.write_data(numpy.arange(1024, dtype=numpy.float32).reshape(32, 32), now)
+                d = h.read_data()
+                self.assertIsInstance(d, numpy.memmap)
+                self.assertTrue(numpy.array_equal(d, numpy.arange(1024, dtype=numpy.float32).reshape(32, 32)))
+                # writing to the mapped data does not change the file
+                d[0, 0] = 100
+                self.assertEqual(h.read_data()[0, 0], 0)
+                # writing the mapped data replaces the file and leaves the map intact
+                h.write_data(d, now)
+                self.assertEqual(h.read_data()[0, 0], 100)
+                self.assertEqual(d[0, 0], 100)
+                self.assertEqual(d[31, 31], 1023)
+                self.assertEqual(h.read_properties(), p)
+                # writing a region while the data is mapped leaves the map intact
+                d = h.read_data()
+                data = numpy.arange(1024, dtype=numpy.float32).reshape(32, 32)
+                data[4:8, :] = 3
+                h.write_data_region(data, (slice(4, 8), slice(0, 32)), now)
+                self.assertEqual(d[4, 0], 128)
+                self.assertEqual(d[0, 0], 100)
+                self.assertTrue(numpy.array_equal(h.read_data(), data))
+                # once the maps are released, regions are written in place
+                d = None
+                data[8:12, :] = 4
+                h.write_data_region(data, (slice(8, 12), slice(0, 32)), now)
+                self.assertTrue(numpy.array_equal(h.read_data(), data))
+            with zipfile.ZipFile(file_path) as z:
+                self.assertIsNone(z.testzip())
+        finally:
+            NDataHandler.NDataHandler.memory_map_min_size = memory_map_min_size
+            #logging.debug("rmtree %s", data_dir)
+            shutil.rmtree(data_dir)
+
+    def test_ndata_handler_writes_data_region_in_place(self):
+        now = datetime.datetime.now()
+        current_working_directory = os.getcwd()
+        data_dir = os.path.join(current_working_directory, "__Test")
+        Cache.db_make_directory_if_needed(data_dir)
+        try:
+            file_path = os.path.join(data_dir, "abc.ndata")
+            h = NDataHandler.NDataHandler(file_path)
+            with contextlib.closing(h):
+                p = {u"uuid": str(uuid.uuid4())}
+                h.write_properties(p, now)
+                data = numpy.zeros((16, 8), dtype=numpy.float32)
+                h.write_data(data, now)
+                file_size = os.path.getsize(file_path)
+                data[4:8, :] = 3
+                h.write_data_region(data, (slice(4, 8), slice(0, 8)), now)
+                self.assertEqual(os.path.getsize(file_path), file_size)
+                self.assertTrue(numpy.array_equal(h.read_data(), data))
+                self.assertEqual(h.read_properties(), p)
+                data[8:16, :] = 4
+                h.write_data_region(data, (slice(8, 16), slice(0, 8)), now)
+                self.assertTrue(numpy.array_equal(h.read_data(), data))
+                with zipfile.ZipFile(file_path) as z:
+                    self.assertIsNone(z.testzip())
+                # a region write with a different shape writes all of the data
+                data = numpy.ones((4, 4), dtype=numpy.float32)
+                h.write_data_region(data, (slice(0, 1), slice(0, 4)), now)
+                self.assertTrue(numpy.array_equal(h.read_data(), data))
+                self.assertEqual(h.read_properties(), p)
+        finally:
+            #logging.debug("rmtree %s", data_dir)
+            shutil.rmtree(data_dir)
+
+    def test_ndata_handler_updates_crc32_of_data_once_per_frame_of_region_writes(self):
+        now = datetime.datetime.now()
+        current_working_directory = os.getcwd()
+        data_dir = os.path.join(current_working_directory, "__Test")
+        Cache.db_make_directory_if_needed(data_dir)
+        crc32 = binascii.crc32
+        crc32_byte_counts = list()
+
+        def counting_crc32(data, value=0):
+            crc32_byte_counts.append(memoryview(data).nbytes)
+            return crc32(data, value)
+
+        try:
+            file_path = os.path.join(data_dir, "abc.ndata")
+            h = NDataHandler.NDataHandler(file_path)
+            with contextlib.closing(h):
+                h.write_properties({u"uuid": str(uuid.uuid4())}, now)
+                data = numpy.zeros((1024, 1024), dtype=numpy.float32)
+                h.write_data(data, now)
+                binascii.crc32 = counting_crc32
+                try:
+                    # partial updates do not calculate the crc32 of the data
+                    for row in range(0, 1024, 128):
+                        data[row:row + 128, :] = row
+                        h.write_data_region(data, (slice(row, row + 128), slice(0, 1024)), now)
+                        self.assertTrue(numpy.array_equal(h.read_data(), data))
+                        self.assertEqual(sum(crc32_byte_counts) >= data.nbytes, row + 128 == 1024)
+                finally:
+                    binascii.crc32 = crc32
+                with zipfile.ZipFile(file_path) as z:
+                    self.assertIsNone(z.testzip())
+                # a frame which is not completed has its crc32 updated when the handler is closed
+                data[0:128, :] = 2048
+                h.write_data_region(data, (slice(0, 128), slice(0, 1024)), now)
+                self.assertTrue(numpy.array_equal(h.read_data(), data))
+            with zipfile.ZipFile(file_path) as z:
+                self.assertIsNone(z.testzip())
+        finally:
+            #logging.debug("rmtree %s", data_dir)
+            shutil.rmtree(data_dir)
+
     def test_ndata_handles_discontiguous_data(self):
         logging.getLogger().setLevel(logging.DEBUG)
         now = datetime.datetime.now()
@@ -0,0 +1,98 @@
+# standard libraries
+import contextlib
+import logging
+import unittest
+
+# third party libraries
+import numpy
+
+# local libraries
+from nion.data import Calibration
+from nion.data import Core
+from nion.data import DataAndMetadata
+from nion.swift import Application
+from nion.swift import Facade
+from nion.swift.model import DataItem
+from nion.swift.model import DocumentModel
+from nion.swift.model import Graphics
+from nion.swift.model import RegionSum
+from nion.swift.model import Utility
+from nion.ui import TestUI
+
+
+Facade.initialize()
+
+
+class TestRegionSumClass(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Application.Application(TestUI.UserInterface(), set_global=False)
+
+    def tearDown(self):
+        pass
+
+    def test_sum_region_matches_core_sum_region_with_and_without_summed_area_table(self):
+        summed_area_table_max_size = DataItem.BufferedDataSource.summed_area_table_max_size
+        try:
+            for dtype in (numpy.int32, numpy.uint16, numpy.float32, numpy.bool_, numpy.complex64):
+                data = (100 * numpy.random.randn(8, 10, 16)).astype(dtype)
+                xdata = DataAndMetadata.new_data_and_metadata(data, Calibration.Calibration(units="e"), [Calibration.Calibration(), Calibration.Calibration(), Calibration.Calibration(scale=2.0, units="eV")])
+                document_model = DocumentModel.DocumentModel()
+                with contextlib.closing(document_model):
+                    data_item = DataItem.DataItem(data)
+                    document_model.append_data_item(data_item)
+                    rectangle = Graphics.RectangleGraphic()
+                    rectangle.bounds = (0.25, 0.2), (0.5, 0.3)
+                    ellipse = Graphics.EllipseGraphic()
+                    ellipse.bounds = (0.25, 0.2), (0.5, 0.6)
+                    for graphic in (rectangle, ellipse):
+                        # new data has no table
+                        DataItem.BufferedDataSource.summed_area_table_max_size = None
+                        data_item.set_xdata(xdata)
+                        xdata = data_item.xdata
+                        mask_xdata = DataAndMetadata.new_data_and_metadata(graphic.get_mask((8, 10)))
+                        expected_xdata = Core.function_sum_region(xdata, mask_xdata)
+                        # without a table, then with one
+                        self.assertIsNone(DataItem.BufferedDataSource.get_summed_area_table_of_data(xdata))
+                        data_xdata = RegionSum.sum_region(xdata, mask_xdata)
+                        DataItem.BufferedDataSource.summed_area_table_max_size = 1024 * 1024
+                        self.assertIsNotNone(DataItem.BufferedDataSource.get_summed_area_table_of_data(xdata, wait=True))
+                        table_xdata = RegionSum.sum_region(xdata, mask_xdata)
+                        for result_xdata in (data_xdata, table_xdata):
+                            self.assertEqual(result_xdata.data_dtype, expected_xdata.data_dtype)
+                            # single precision sums from the table are rounded differently
+                            self.assertTrue(numpy.allclose(result_xdata.data, expected_xdata.data, atol=1E-3))
+                            self.assertEqual(result_xdata.intensity_calibration, expected_xdata.intensity_calibration)
+                            self.assertEqual(result_xdata.dimensional_calibrations, expected_xdata.dimensional_calibrations)
+            # data which is not the current data of a data source is summed directly
+            data_xdata = DataAndMetadata.new_data_and_metadata(numpy.ones((8, 10, 16)))
+            self.assertIsNone(DataItem.BufferedDataSource.get_summed_area_table_of_data(data_xdata, wait=True))
+            mask_xdata = DataAndMetadata.new_data_and_metadata(rectangle.get_mask((8, 10)))
+            self.assertTrue(numpy.array_equal(RegionSum.sum_region(data_xdata, mask_xdata).data, Core.function_sum_region(data_xdata, mask_xdata).data))
+        finally:
+            DataItem.BufferedDataSource.summed_area_table_max_size = summed_area_table_max_size
+
+    def test_summed_area_table_is_made_only_when_enabled_and_memory_is_available(self):
+        summed_area_table_max_size = DataItem.BufferedDataSource.summed_area_table_max_size
+        get_available_memory = Utility.get_available_memory
+        try:
+            document_model = DocumentModel.DocumentModel()
+            with contextlib.closing(document_model):
+                data_item = DataItem.DataItem(numpy.ones((8, 10, 16), numpy.float32))
+                document_model.append_data_item(data_item)
+                # the table of 9x11x16 float64 is 12672 bytes
+                DataItem.BufferedDataSource.summed_area_table_max_size = None
+                self.assertIsNone(data_item.data_source.get_summed_area_table(wait=True))
+                DataItem.BufferedDataSource.summed_area_table_max_size = 1024 * 1024
+                Utility.get_available_memory = lambda: 2 * 12672 - 1
+                self.assertIsNone(data_item.data_source.get_summed_area_table(wait=True))
+                Utility.get_available_memory = lambda: 2 * 12672
+                self.assertIsNotNone(data_item.data_source.get_summed_area_table(wait=True))
+        finally:
+            DataItem.BufferedDataSource.summed_area_table_max_size = summed_area_table_max_size
+            Utility.get_available_memory = get_available_memory
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
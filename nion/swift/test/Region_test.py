@@ -136,6 +136,52 @@ class TestRegionClass(unittest.TestCase):
         self.assertEqual(mask.data[250, 300], 1)  # center bottom
         self.assertEqual(mask.data[200, 250], 1)  # center left
 
+    def test_region_mask_is_cached_until_geometry_or_shape_changes(self):
+        for graphic in (Graphics.RectangleGraphic(), Graphics.EllipseGraphic(), Graphics.RingGraphic()):
+            mask = graphic.get_mask((64, 64))
+            self.assertFalse(mask.flags.writeable)
+            self.assertIs(graphic.get_mask((64, 64)), mask)
+            self.assertIsNot(graphic.get_mask((32, 32)), mask)
+            if isinstance(graphic, Graphics.RingGraphic):
+                graphic.radius_1 = 0.3
+            else:
+                graphic.bounds = (0.1, 0.2), (0.3, 0.4)
+            self.assertFalse(numpy.array_equal(graphic.get_mask((64, 64)), mask))
+
+    def test_region_mask_in_use_is_not_modified_when_region_moves(self):
+        for graphic_class in (Graphics.RectangleGraphic, Graphics.EllipseGraphic):
+            graphic = graphic_class()
+            graphic.bounds = (0.2, 0.2), (0.3, 0.4)
+            old_mask = graphic.get_mask((100, 100))
+            old_mask_copy = numpy.copy(old_mask)
+            for bounds in (((0.3, 0.25), (0.3, 0.4)), ((0.6, 0.5), (0.2, 0.1)), ((0.7, 0.8), (0.5, 0.5))):
+                graphic.bounds = bounds
+                mask = graphic.get_mask((100, 100))
+                self.assertIsNot(mask, old_mask)
+                expected_graphic = graphic_class()
+                expected_graphic.bounds = bounds
+                self.assertTrue(numpy.array_equal(mask, expected_graphic.get_mask((100, 100))))
+            self.assertTrue(numpy.array_equal(old_mask, old_mask_copy))
+
+    def test_region_mask_is_not_cached_when_region_changes_while_making_it(self):
+        graphic = Graphics.EllipseGraphic()
+        graphic.bounds = (0.2, 0.2), (0.3, 0.4)
+        make_mask = graphic._make_mask
+
+        def make_mask_while_region_moves(data_shape, mask_extent):
+            # another thread moves the region and moves it back while the mask is being made
+            graphic.bounds = (0.25, 0.25), (0.3, 0.4)
+            mask = make_mask(data_shape, mask_extent)
+            graphic.bounds = (0.2, 0.2), (0.3, 0.4)
+            return mask
+
+        graphic._make_mask = make_mask_while_region_moves
+        graphic.get_mask((100, 100))
+        graphic._make_mask = make_mask
+        expected_graphic = Graphics.EllipseGraphic()
+        expected_graphic.bounds = (0.2, 0.2), (0.3, 0.4)
+        self.assertTrue(numpy.array_equal(graphic.get_mask((100, 100)), expected_graphic.get_mask((100, 100))))
+
     def test_region_mask_spot(self):
         spot_graphic = Graphics.SpotGraphic()
         spot_graphic.bounds = (0.2, 0.2), (0.1, 0.1)
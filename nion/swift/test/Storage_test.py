@@ -348,6 +348,234 @@ class TestStorageClass(unittest.TestCase):
             #logging.debug("rmtree %s", workspace_dir)
             shutil.rmtree(workspace_dir)
 
+    def test_persistent_storage_writes_are_deferred_until_document_closes(self):
+        old_persistent_storage_write_delay = DocumentModel.DocumentModel.persistent_storage_write_delay
+        DocumentModel.DocumentModel.persistent_storage_write_delay = 60.0
+        current_working_directory = os.getcwd()
+        workspace_dir = os.path.join(current_working_directory, "__Test")
+        Cache.db_make_directory_if_needed(workspace_dir)
+        file_persistent_storage_system = DocumentModel.FileStorageSystem([workspace_dir])
+        lib_name = os.path.join(workspace_dir, "Data.nslib")
+        try:
+            library_storage = DocumentModel.FilePersistentStorage(lib_name)
+            document_model = DocumentModel.DocumentModel(persistent_storage_systems=[file_persistent_storage_system], library_storage=library_storage)
+            with contextlib.closing(document_model):
+                data_item = DataItem.DataItem(numpy.zeros((16, 16), numpy.uint32))
+                document_model.append_data_item(data_item)
+                storage_handler = document_model.persistent_object_context._get_persistent_storage_for_object(data_item)._storage_handler
+                title = storage_handler.read_properties().get("title")
+                for i in range(10):
+                    data_item.title = "title " + str(i)
+                self.assertEqual(title, storage_handler.read_properties().get("title"))
+                document_model.append_data_group(DataGroup.DataGroup())
+                self.assertFalse(os.path.exists(lib_name))
+            document_model = DocumentModel.DocumentModel(persistent_storage_systems=[file_persistent_storage_system], library_storage=DocumentModel.FilePersistentStorage(lib_name))
+            with contextlib.closing(document_model):
+                self.assertEqual("title 9", document_model.data_items[0].title)
+                self.assertEqual(1, len(document_model.data_groups))
+        finally:
+            DocumentModel.DocumentModel.persistent_storage_write_delay = old_persistent_storage_write_delay
+            #logging.debug("rmtree %s", workspace_dir)
+            shutil.rmtree(workspace_dir)
+
+    def test_library_changes_are_journaled_and_replayed_when_reopened(self):
+        current_working_directory = os.getcwd()
+        workspace_dir = os.path.join(current_working_directory, "__Test")
+        Cache.db_make_directory_if_needed(workspace_dir)
+        lib_name = os.path.join(workspace_dir, "Data.nslib")
+        try:
+            library_storage = DocumentModel.FilePersistentStorage(lib_name)
+            document_model = DocumentModel.DocumentModel(library_storage=library_storage)
+            with contextlib.closing(document_model):
+                data_group = DataGroup.DataGroup()
+                document_model.append_data_group(data_group)
+                snapshot_size = os.path.getsize(lib_name)
+                data_group.title = "data group"
+                data_group.append_data_group(DataGroup.DataGroup())
+                data_group.append_data_group(DataGroup.DataGroup())
+                data_group.remove_data_group(data_group.data_groups[0])
+                self.assertEqual(snapshot_size, os.path.getsize(lib_name))
+                properties = library_storage.properties
+            self.assertEqual(properties, DocumentModel.FilePersistentStorage(lib_name).properties)
+            # a partially written change is ignored
+            with open(lib_name + ".journal", "a") as fp:
+                fp.write("[[\"set\", [], \"modif")
+            library_storage = DocumentModel.FilePersistentStorage(lib_name)
+            self.assertEqual(properties, library_storage.properties)
+            document_model = DocumentModel.DocumentModel(library_storage=library_storage)
+            with contextlib.closing(document_model):
+                self.assertEqual("data group", document_model.data_groups[0].title)
+                document_model.data_groups[0].title = "data group 2"
+                properties = library_storage.properties
+            self.assertEqual(properties, DocumentModel.FilePersistentStorage(lib_name).properties)
+        finally:
+            #logging.debug("rmtree %s", workspace_dir)
+            shutil.rmtree(workspace_dir)
+
+    def test_library_journal_replay_stops_at_first_change_which_cannot_be_applied(self):
+        current_working_directory = os.getcwd()
+        workspace_dir = os.path.join(current_working_directory, "__Test")
+        Cache.db_make_directory_if_needed(workspace_dir)
+        lib_name = os.path.join(workspace_dir, "Data.nslib")
+        try:
+            library_storage = DocumentModel.FilePersistentStorage(lib_name)
+            document_model = DocumentModel.DocumentModel(library_storage=library_storage)
+            with contextlib.closing(document_model):
+                document_model.append_data_group(DataGroup.DataGroup())
+                document_model.data_groups[0].title = "data group"
+                properties = library_storage.properties
+            # the first change of the bad line can be applied, the second cannot; the line after it is good
+            with open(lib_name + ".journal", "a") as fp:
+                fp.write(json.dumps([["set", [], "modified", "bad"], ["remove", [], "missing", 4]]) + "\n")
+                fp.write(json.dumps([["set", [["data_groups", 0]], "title", "later"]]) + "\n")
+            with self.assertLogs(level=logging.ERROR):
+                library_storage = DocumentModel.FilePersistentStorage(lib_name)
+            self.assertEqual(properties, library_storage.properties)
+            # the next write compacts the journal from the last good state
+            document_model = DocumentModel.DocumentModel(library_storage=library_storage)
+            with contextlib.closing(document_model):
+                self.assertEqual("data group", document_model.data_groups[0].title)
+                document_model.data_groups[0].title = "data group 2"
+                properties = library_storage.properties
+            with open(lib_name + ".journal", "r") as fp:
+                self.assertNotIn("missing", fp.read())
+            self.assertEqual(properties, DocumentModel.FilePersistentStorage(lib_name).properties)
+        finally:
+            #logging.debug("rmtree %s", workspace_dir)
+            shutil.rmtree(workspace_dir)
+
+    def test_library_journal_is_compacted_in_a_separate_write(self):
+        old_persistent_storage_write_delay = DocumentModel.DocumentModel.persistent_storage_write_delay
+        old_journal_min_compaction_size = DocumentModel.FilePersistentStorage.journal_min_compaction_size
+        DocumentModel.DocumentModel.persistent_storage_write_delay = 0.0
+        DocumentModel.FilePersistentStorage.journal_min_compaction_size = 0
+        current_working_directory = os.getcwd()
+        workspace_dir = os.path.join(current_working_directory, "__Test")
+        Cache.db_make_directory_if_needed(workspace_dir)
+        lib_name = os.path.join(workspace_dir, "Data.nslib")
+        try:
+            library_storage = DocumentModel.FilePersistentStorage(lib_name)
+            document_model = DocumentModel.DocumentModel(library_storage=library_storage)
+            with contextlib.closing(document_model):
+                document_model.append_data_group(DataGroup.DataGroup())
+                properties = library_storage.properties
+                self.assertIs(properties, library_storage.properties)
+                for i in range(20):
+                    document_model.data_groups[0].title = "data group " + str(i) * 1000
+                self.assertIsNot(properties, library_storage.properties)
+                properties = library_storage.properties
+            with open(lib_name + ".journal", "r") as fp:
+                self.assertLess(len(fp.readlines()), 20)
+            self.assertEqual(properties, DocumentModel.FilePersistentStorage(lib_name).properties)
+        finally:
+            DocumentModel.FilePersistentStorage.journal_min_compaction_size = old_journal_min_compaction_size
+            DocumentModel.DocumentModel.persistent_storage_write_delay = old_persistent_storage_write_delay
+            #logging.debug("rmtree %s", workspace_dir)
+            shutil.rmtree(workspace_dir)
+
+    def test_file_storage_system_rescan_reads_changed_files(self):
+        current_working_directory = os.getcwd()
+        workspace_dir = os.path.join(current_working_directory, "__Test")
+        Cache.db_make_directory_if_needed(workspace_dir)
+        file_persistent_storage_system = DocumentModel.FileStorageSystem([workspace_dir])
+        try:
+            document_model = DocumentModel.DocumentModel(persistent_storage_systems=[file_persistent_storage_system])
+            with contextlib.closing(document_model):
+                for i in range(4):
+                    data_item = DataItem.DataItem(numpy.zeros((16, 16), numpy.uint32))
+                    data_item.title = "title " + str(i)
+                    document_model.append_data_item(data_item)
+            storage_handlers = file_persistent_storage_system.find_data_items()
+            titles = sorted(storage_handler.read_properties()["description"]["title"] for storage_handler in storage_handlers)
+            self.assertEqual(["title 0", "title 1", "title 2", "title 3"], titles)
+            document_model = DocumentModel.DocumentModel(persistent_storage_systems=[file_persistent_storage_system])
+            with contextlib.closing(document_model):
+                self.assertEqual(4, len(document_model.data_items))
+                document_model.data_items[0].title = "title 4"
+            storage_handlers = file_persistent_storage_system.find_data_items()
+            titles = sorted(storage_handler.read_properties()["description"]["title"] for storage_handler in storage_handlers)
+            self.assertEqual(4, len(titles))
+            self.assertIn("title 4", titles)
+        finally:
+            #logging.debug("rmtree %s", workspace_dir)
+            shutil.rmtree(workspace_dir)
+
+    def test_file_storage_system_rescan_reads_written_files_with_unchanged_stat(self):
+        # on Windows, writing ndata properties in place changes neither the mtime (restored when writing), the ctime
+        # (the creation time), nor the size of the file. simulate that by returning the stat from before the write.
+        current_working_directory = os.getcwd()
+        workspace_dir = os.path.join(current_working_directory, "__Test")
+        Cache.db_make_directory_if_needed(workspace_dir)
+        data_dir = os.path.join(workspace_dir, "Data")
+        index_path = os.path.join(workspace_dir, "Data.nsindex")
+        file_persistent_storage_system = DocumentModel.FileStorageSystem([data_dir], index_path)
+        stat = os.stat
+        try:
+            document_model = DocumentModel.DocumentModel(persistent_storage_systems=[file_persistent_storage_system])
+            with contextlib.closing(document_model):
+                data_item = DataItem.DataItem(numpy.zeros((16, 16), numpy.uint32))
+                data_item.title = "title 0"
+                document_model.append_data_item(data_item)
+                file_path = document_model.persistent_object_context._test_get_file_path(data_item)
+            file_stat = stat(file_path)
+            os.stat = lambda path, *args, **kwargs: file_stat if path == file_path else stat(path, *args, **kwargs)
+            document_model = DocumentModel.DocumentModel(persistent_storage_systems=[file_persistent_storage_system])
+            with contextlib.closing(document_model):
+                document_model.data_items[0].title = "title 1"
+            document_model = DocumentModel.DocumentModel(persistent_storage_systems=[file_persistent_storage_system])
+            with contextlib.closing(document_model):
+                self.assertEqual("title 1", document_model.data_items[0].title)
+                document_model.data_items[0].title = "title 2"
+            # the index of a later session does not have the written file either
+            document_model = DocumentModel.DocumentModel(persistent_storage_systems=[DocumentModel.FileStorageSystem([data_dir], index_path)])
+            with contextlib.closing(document_model):
+                self.assertEqual("title 2", document_model.data_items[0].title)
+        finally:
+            os.stat = stat
+            #logging.debug("rmtree %s", workspace_dir)
+            shutil.rmtree(workspace_dir)
+
+    def test_file_storage_system_index_finds_unchanged_files_without_reading_them(self):
+        current_working_directory = os.getcwd()
+        workspace_dir = os.path.join(current_working_directory, "__Test")
+        Cache.db_make_directory_if_needed(workspace_dir)
+        data_dir = os.path.join(workspace_dir, "Data")
+        index_path = os.path.join(workspace_dir, "Data.nsindex")
+        try:
+            file_persistent_storage_system = DocumentModel.FileStorageSystem([data_dir], index_path)
+            document_model = DocumentModel.DocumentModel(persistent_storage_systems=[file_persistent_storage_system])
+            with contextlib.closing(document_model):
+                for i in range(3):
+                    data_item = DataItem.DataItem(numpy.zeros((16, 16), numpy.uint32))
+                    data_item.title = "title " + str(i)
+                    document_model.append_data_item(data_item)
+            self.assertEqual(3, len(file_persistent_storage_system.find_data_items()))
+            read_properties_if_matching = DocumentModel.NDataHandler.NDataHandler.read_properties_if_matching
+            read_file_paths = list()
+
+            def read_properties_if_matching_and_record(file_path):
+                read_file_paths.append(file_path)
+                return read_properties_if_matching(file_path)
+
+            DocumentModel.NDataHandler.NDataHandler.read_properties_if_matching = read_properties_if_matching_and_record
+            try:
+                document_model = DocumentModel.DocumentModel(persistent_storage_systems=[DocumentModel.FileStorageSystem([data_dir], index_path)])
+                with contextlib.closing(document_model):
+                    self.assertEqual(0, len(read_file_paths))
+                    self.assertEqual(["title 0", "title 1", "title 2"], sorted(data_item.title for data_item in document_model.data_items))
+                    document_model.data_items[0].title = "title 3"
+                    document_model.remove_data_item(document_model.data_items[1])
+                document_model = DocumentModel.DocumentModel(persistent_storage_systems=[DocumentModel.FileStorageSystem([data_dir], index_path)])
+                with contextlib.closing(document_model):
+                    self.assertEqual(1, len(read_file_paths))
+                    self.assertEqual(2, len(document_model.data_items))
+                    self.assertIn("title 3", [data_item.title for data_item in document_model.data_items])
+            finally:
+                DocumentModel.NDataHandler.NDataHandler.read_properties_if_matching = read_properties_if_matching
+        finally:
+            #logging.debug("rmtree %s", workspace_dir)
+            shutil.rmtree(workspace_dir)
+
     def test_db_storage(self):
         cache_name = ":memory:"
         storage_cache = Cache.DbStorageCache(cache_name)
@@ -590,7 +818,7 @@ class TestStorageClass(unittest.TestCase):
             data_group.append_data_item(document_model.data_items[0])
             data_group.append_data_item(document_model.data_items[1])
             document_model.append_data_group(data_group)
-        library_properties = library_storage.properties
+        library_properties = copy.deepcopy(library_storage.properties)
         library_properties['data_groups'][0]['data_item_uuids'][1] = library_properties['data_groups'][0]['data_item_uuids'][0]
         library_storage._set_properties(library_properties)
         document_model = DocumentModel.DocumentModel(library_storage=library_storage, persistent_storage_systems=[memory_persistent_storage_system])
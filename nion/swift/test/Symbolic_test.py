@@ -1081,6 +1081,47 @@ class TestSymbolicClass(unittest.TestCase):
             document_model.recompute_all()
             self.assertEqual(computation._evaluation_count_for_test - evaluation_count, 1)
 
+    def test_computation_reuses_compiled_expression_and_api_objects_between_evaluations(self):
+        document_model = DocumentModel.DocumentModel()
+        with contextlib.closing(document_model):
+            src_data = numpy.zeros((4, 4))
+            data_item = DataItem.DataItem(src_data)
+            document_model.append_data_item(data_item)
+            expression = "target.xdata = a.xdata + s + (10 if getattr(a, '_evaluated', False) else 0)\na._evaluated = True"
+            computation = document_model.create_computation(expression)
+            s = computation.create_variable("s", value_type="integral", value=1)
+            computation.create_object("a", document_model.get_object_specifier(data_item))
+            computed_data_item = DataItem.DataItem(src_data.copy())
+            document_model.append_data_item(computed_data_item)
+            document_model.set_data_item_computation(computed_data_item, computation)
+            document_model.recompute_all()
+            self.assertEqual(computed_data_item.data[0, 0], 1)
+            s.value = 2
+            document_model.recompute_all()
+            # the api object for 'a' is the same one as in the first evaluation
+            self.assertEqual(computed_data_item.data[0, 0], 12)
+            self.assertEqual(computation._compile_count_for_test, 1)
+            self.assertEqual(set(computation.timings.keys()), {"bind", "compile", "execute", "merge"})
+            computation.expression = "target.xdata = a.xdata + s"
+            document_model.recompute_all()
+            self.assertEqual(computed_data_item.data[0, 0], 2)
+            self.assertEqual(computation._compile_count_for_test, 2)
+
+    def test_computation_evaluates_default_xdata_expression(self):
+        document_model = DocumentModel.DocumentModel()
+        with contextlib.closing(document_model):
+            src_data = numpy.random.randn(4, 4)
+            data_item = DataItem.DataItem(src_data)
+            document_model.append_data_item(data_item)
+            computation = document_model.create_computation(Symbolic.xdata_expression("xd.invert(a.xdata)"))
+            computation.create_object("a", document_model.get_object_specifier(data_item))
+            computed_data_item = DataItem.DataItem(src_data.copy())
+            document_model.append_data_item(computed_data_item)
+            document_model.set_data_item_computation(computed_data_item, computation)
+            document_model.recompute_all()
+            self.assertIsNone(computation.error_text)
+            self.assertTrue(numpy.array_equal(computed_data_item.data, -src_data))
+
     def test_computation_with_object_writes_and_reads(self):
         document_model = DocumentModel.DocumentModel()
         with contextlib.closing(document_model):